@@ -6,7 +6,8 @@ import logging
 from streamlit_navigation_bar import st_navbar
 from logging_config import setup_logging
 # from common_features import set_bg_hack_url
-from common_qc import read_data
+from common_qc import load_tables, find_data_files, get_table_name, build_patient_index
+from qc_scheduler import start_table_qcs
 from pages._3_adt_qc import show_adt_qc
 from pages._4_hosp_qc import show_hosp_qc
 from pages._5_labs_qc import show_labs_qc
@@ -18,6 +19,20 @@ from pages._10_position_qc import show_position_qc
 from pages._11_resp_qc import show_respiratory_support_qc
 from pages._12_vitals_qc import show_vitals_qc
 
+# QC tabs: label -> (page function, name in error messages)
+# ("Microbiology": (show_microbio_qc, "Microbiology") is not enabled yet)
+QC_TABS = {
+    "ADT": (show_adt_qc, "ADT"),
+    "Hospitalization": (show_hosp_qc, "Hospitalization"),
+    "Labs": (show_labs_qc, "Labs"),
+    "Medication": (show_meds_qc, "Medication"),
+    "Patient": (show_patient_qc, "Patient"),
+    "Patient Assessment": (show_patient_assess_qc, "Patient Assessment"),
+    "Position": (show_position_qc, "Position"),
+    "Respiratory Support": (show_respiratory_support_qc, "Respiratory Support"),
+    "Vitals": (show_vitals_qc, "Vitals")
+}
+
 def show_home():
     # Initialize logger
     setup_logging()
@@ -65,108 +80,91 @@ def show_home():
                 accept_multiple_files=True, 
                 type=["csv", "parquet", "fst"]
             )
+            data_path = st.text_input("Or enter a local directory or glob pattern of CLIF tables to read in place without uploading (e.g. /data/clif/*.parquet) ***(optional)***", value=None)
 
             # Sampling option
             s_col1, _, _, _ = st.columns(4)
             with s_col1:
                 sampling_option = st.number_input("Set dataset sample(%) for QC ***(optional)***", min_value=1, max_value=100, value=None, step=5)
+            use_duckdb = st.checkbox("Run missingness, duplicate, summary statistics and mapping checks with DuckDB on all cores over local files (tables are still loaded into memory) ***(optional)***")
+            approximate_stats = st.checkbox("Approximate quartiles in summary statistics with mergeable quantile sketches (about 1% rank error) ***(optional)***")
+            approximate_mappings = st.checkbox("Show only the most frequent name to category pairs, counted in bounded memory with heavy hitter sketches (exact mappings are saved in the background) ***(optional)***")
+            parallel_qc = st.checkbox("Run the checks of all tables in parallel in background worker processes (uses about twice the memory of the loaded tables) ***(optional)***")
             download_path = st.text_input("Enter path to save automated downloads of generated tables and images ***(optional)***", value=None)
 
             submit = st.form_submit_button(label='Submit')
 
         if submit:
-            st.info("Note that a new tab will not load until the current tab has finished loading. " \
+            st.info("Select a table below to run its quality control checks; each table's checks run when it is first selected. " \
                 "The overall progress of the quality control checks will be displayed. For detailed progress information, please expand the required table in the QC section.", 
                 icon="ℹ️")
             with st.spinner('Loading...'):
-                if files:
-                    st.session_state["files"] = "Yes"
+                sources = list(files) if files else []
+                if data_path:
+                    logger.info(f"Local data path option selected: {data_path}")
                     try:
-                        for file in files:
-                            df = read_data(file)
-                            table_name = file.name.split('.')[0]
-                            st.session_state[table_name] = df
+                        sources.extend(find_data_files(data_path))
                     except Exception as e:
-                        st.write("Error: No files were submitted or an issue occurred while processing the files.")
-                        st.write(f"Details: {e}")
+                        st.write(f"Error: {e}")
+                # Local files can be queried in place by the DuckDB backend
+                st.session_state['sources'] = {get_table_name(source): source for source in sources if isinstance(source, str)}
+                if sources:
+                    st.session_state["files"] = "Yes"
+                    # Sampling is applied while the tables are read
+                    sample_frac = sampling_option / 100 if sampling_option else None
+                    st.session_state['total_counts'] = {}
+                    load_progress = st.progress(0, text="Loading tables...")
+                    for i, (table_name, df, error) in enumerate(load_tables(sources, sample_frac)):
+                        if error is None:
+                            st.session_state[table_name] = df
+                            st.session_state['total_counts'][table_name] = df.attrs.get('total_rows', len(df))
+                        else:
+                            st.write(f"Error: An issue occurred while processing {table_name}.")
+                            st.write(f"Details: {error}")
+                        load_progress.progress((i + 1) / len(sources), text=f"Loaded {i + 1} of {len(sources)} tables ({table_name})")
+
+                    # Prebuild the hospitalization to patient index used by the cross-table checks
+                    st.session_state.pop('hospitalization_patient_index', None)
+                    if 'clif_hospitalization' in st.session_state:
+                        st.session_state['hospitalization_patient_index'] = build_patient_index(st.session_state['clif_hospitalization'])
 
                 st.session_state['sampling_option'] = None
                 if sampling_option:
                     logger.info(f"Sampling option selected: {sampling_option}")
                     st.session_state['sampling_option'] = sampling_option
                 
+                st.session_state['qc_backend'] = "duckdb" if use_duckdb else "pandas"
+                logger.info(f"QC backend selected: {st.session_state['qc_backend']}")
+                st.session_state['approximate_stats'] = approximate_stats
+                st.session_state['approximate_mappings'] = approximate_mappings
+
                 st.session_state['download_path'] = None
                 if download_path:
                     logger.info(f"Download path option selected: {download_path}")
                     st.session_state['download_path'] = download_path
 
+                # QC results of the previous submit are recomputed on demand
+                st.session_state['qc_results'] = {}
+                st.session_state['qc_futures'] = {}
+                if parallel_qc:
+                    try:
+                        st.session_state['qc_futures'] = start_table_qcs(st.session_state)
+                    except Exception as e:
+                        # Each table's QC then runs when its tab is opened
+                        logger.error(f"Failed to start the background QC of the tables, running them per tab: {e}")
+                st.session_state['qc_submitted'] = True
+
+        if st.session_state.get('qc_submitted'):
             logger.info("Loading QC results page")
-            # tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, tab10 = st.tabs(["ADT", 
-            #     "Hospitalization", "Labs", "Medication", "Microbiology", "Patient", 
-            #     "Patient Assessment", "Position", "Respiratory Support", "Vitals"])
-            tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs(["ADT", 
-                "Hospitalization", "Labs", "Medication", "Patient", 
-                "Patient Assessment", "Position", "Respiratory Support", "Vitals"])
-
-            with tab1:
-                try:
-                    show_adt_qc()
-                except Exception as e:
-                    st.write(f"Error loading ADT QC: {e}")
-
-            with tab2:
-                try:
-                    show_hosp_qc()
-                except Exception as e:
-                    st.write(f"Error loading Hospitalization QC: {e}")
-
-            with tab3:
-                try:
-                    show_labs_qc()
-                except Exception as e:
-                    st.write(f"Error loading Labs QC: {e}")
-
-            with tab4:
-                try:
-                    show_meds_qc()
-                except Exception as e:
-                    st.write(f"Error loading Medication QC: {e}")
-
-            # with tab5:
-            #     try:
-            #         show_microbio_qc()
-            #     except Exception as e:
-            #         st.write(f"Error loading Microbiology QC: {e}")
-
-            with tab5:
-                try:
-                    show_patient_qc()
-                except Exception as e:
-                    st.write(f"Error loading Patient QC: {e}")
-
-            with tab6:
-                try:
-                    show_patient_assess_qc()
-                except Exception as e:
-                    st.write(f"Error loading Patient Assessment QC: {e}")
-
-            with tab7:
-                try:
-                    show_position_qc()
-                except Exception as e:
-                    st.write(f"Error loading Position QC: {e}")
-
-            with tab8:
-                try:
-                    show_respiratory_support_qc()
-                except Exception as e:
-                    st.write(f"Error loading Respiratory Support QC: {e}")
-
-            with tab9:
-                try:
-                    show_vitals_qc()
-                except Exception as e:
-                    st.write(f"Error loading Vitals QC: {e}")
+            # Only the selected table's QC runs, when it is first selected. Its
+            # results are memoized (see run_qc_step), so switching back to a
+            # table redraws it without recomputing.
+            selected_tab = st.radio("QC table", list(QC_TABS), horizontal=True, key='qc_tab', label_visibility="collapsed")
+            show_qc, qc_name = QC_TABS[selected_tab]
+            try:
+                show_qc()
+            except Exception as e:
+                st.write(f"Error loading {qc_name} QC: {e}")
 
   
 parent_dir = os.path.dirname(os.path.abspath(__file__))
@@ -202,6 +200,8 @@ options = {
     "show_sidebar": False,
 }
 
-selected_page = st_navbar(page, styles=styles, logo_path=logo_path, options=options)
-# set_bg_hack_url()
-show_home()
+# Worker processes (spawned) import this script as __mp_main__ and must not run the app
+if __name__ == "__main__":
+    selected_page = st_navbar(page, styles=styles, logo_path=logo_path, options=options)
+    # set_bg_hack_url()
+    show_home()
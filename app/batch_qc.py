@@ -0,0 +1,123 @@
+import os
+import sys
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from logging_config import setup_logging
+from common_qc import find_data_files, get_table_name, read_cached_data
+from qc_steps import TABLE_QCS, TABLE_QC_INPUTS, get_data_name
+from qc_files import save_table_files
+from reqd_vars_dtypes import table_schema_names
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Headless QC of a directory of CLIF tables, e.g. nightly from cron:
+#
+#   cd app
+#   python batch_qc.py /data/clif --output /data/clif_qc
+#
+# Each table's QC runs in its own worker process with the checks of its
+# page (see qc_steps), and writes the files the page saves to the
+# download path (see qc_files).
+
+
+def run_batch_qc(table, files, options, download_path):
+    """
+    Load a table (and the tables its QC reads), run its QC and save its
+    files. Runs in a worker process.
+
+    Parameters:
+        table (str): Session name of the table's results (see qc_steps.TABLE_QCS).
+        files (dict): Session name -> local file of the table's data and of the tables its QC reads.
+        options (dict): Session options of the checks (see qc_scheduler.QC_OPTIONS).
+        download_path (str): Directory to save the files to.
+
+    Returns:
+        list: Paths of the saved files.
+    """
+    session = dict(options)
+    sampling_option = options.get('sampling_option')
+    sample_frac = sampling_option / 100 if sampling_option else None
+    for name, file in files.items():
+        session[name] = read_cached_data(file, table_schema_names.get(name), sample_frac)
+    data = session[get_data_name(table)]
+    total_counts = data.attrs.get('total_rows', len(data))
+
+    results = TABLE_QCS[table](session, table, in_process=True)
+    return save_table_files(session, results, table, download_path, total_counts)
+
+def run_batch(path, download_path, sampling_option=None, use_duckdb=False, approximate_stats=False, max_workers=None):
+    """
+    Run the QC of every CLIF table at a local path in parallel worker processes.
+
+    Parameters:
+        path (str): Directory, file path or glob pattern of the CLIF tables.
+        download_path (str): Directory to save the files to, created if missing.
+        sampling_option (int, optional): Sample percentage of the tables.
+        use_duckdb (bool): Run the aggregate checks with DuckDB.
+        approximate_stats (bool): Approximate the summary statistics quartiles with quantile sketches.
+        max_workers (int, optional): Number of worker processes. Defaults to one per table, up to the CPU count.
+
+    Returns:
+        dict: Session name of each table's results -> Exception of its QC, for the tables that failed.
+    """
+    sources = {get_table_name(file): os.path.abspath(file) for file in find_data_files(path)}
+    tables = [table for table in TABLE_QCS if get_data_name(table) in sources]
+    read = {get_data_name(table) for table in TABLE_QCS} | {name for inputs in TABLE_QC_INPUTS.values() for name in inputs}
+    for name in sources:
+        if name not in read:
+            logger.warning(f"No QC for {name}, skipped.")
+    if not tables:
+        raise ValueError(f"No CLIF tables with a QC found at '{path}'.")
+    os.makedirs(download_path, exist_ok=True)
+    options = {
+        'qc_backend': "duckdb" if use_duckdb else "pandas",
+        'sampling_option': sampling_option,
+        'sources': sources,
+        'approximate_stats': approximate_stats,
+        # Nothing is displayed, the mappings are counted exactly for the files
+        'approximate_mappings': False
+    }
+
+    failures = {}
+    max_workers = max_workers or min(len(tables), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {}
+        for table in tables:
+            names = [get_data_name(table)] + [name for name in TABLE_QC_INPUTS.get(table, []) if name in sources]
+            futures[executor.submit(run_batch_qc, table, {name: sources[name] for name in names}, options, download_path)] = table
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                paths = future.result()
+                logger.info(f"QC of {table} completed, saved {len(paths)} files.")
+            except Exception as e:
+                logger.error(f"QC of {table} failed: {e}")
+                failures[table] = e
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the CLIF-Lighthouse quality controls without the app and save their files.")
+    parser.add_argument("path", help="directory, file path or glob pattern of the CLIF tables (e.g. '/data/clif/*.parquet')")
+    parser.add_argument("-o", "--output", required=True, help="directory to save the generated tables and images to")
+    parser.add_argument("--sample", type=int, choices=range(1, 101), metavar="PERCENT", help="QC a sample of the hospitalizations")
+    parser.add_argument("--duckdb", action="store_true", help="run missingness, duplicate, summary statistics and mapping checks with DuckDB over the source files")
+    parser.add_argument("--approximate-stats", action="store_true", help="approximate summary statistics quartiles with quantile sketches")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per table, up to the CPU count)")
+    args = parser.parse_args(argv)
+
+    path, download_path = os.path.abspath(os.path.expanduser(args.path)), os.path.abspath(os.path.expanduser(args.output))
+    # The outlier thresholds are read relative to the app directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        failures = run_batch(path, download_path, args.sample, args.duckdb, args.approximate_stats, args.workers)
+    except ValueError as e:
+        logger.error(e)
+        return 2
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
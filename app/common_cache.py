@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import logging
+import pyarrow as pa
+import pyarrow.feather as feather
+from logging_config import setup_logging
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of cached tables changes
+CACHE_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 20
+# Schema metadata key holding DataFrame.attrs (e.g. the row count before sampling)
+ATTRS_METADATA_KEY = b"clif_lighthouse_attrs"
+DEFAULT_CACHE_SIZE_GB = 50
+# Cached files under the size cap: cache subdirectory -> file suffix
+EVICTABLE_FILES = {"tables": ".arrow", "plots": ".png"}
+
+
+def get_cache_dir(subdir):
+    """
+    Return (and create) a directory under the Lighthouse cache.
+    The cache root defaults to ~/.cache/clif_lighthouse and can be set with
+    the CLIF_LIGHTHOUSE_CACHE_DIR environment variable.
+    """
+    root = os.environ.get("CLIF_LIGHTHOUSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "clif_lighthouse"))
+    path = os.path.join(root, subdir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_cache_size_limit():
+    """
+    Return the size cap of the cached tables and plots in bytes, set with the
+    CLIF_LIGHTHOUSE_CACHE_SIZE_GB environment variable. 0 disables the cache.
+    """
+    return int(float(os.environ.get("CLIF_LIGHTHOUSE_CACHE_SIZE_GB", DEFAULT_CACHE_SIZE_GB)) * (1 << 30))
+
+def file_fingerprint(file):
+    """
+    Return a content hash, the size and the mtime of a file.
+    Local files are hashed on their first and last MiB, which together with
+    the size and mtime identifies an extract without reading all of it.
+    Uploaded files are already in memory and are hashed in full.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local file.
+
+    Returns:
+        tuple: (content hash, size in bytes, mtime in ns).
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(file, (str, os.PathLike)):
+        stat = os.stat(file)
+        with open(file, 'rb') as f:
+            digest.update(f.read(HASH_CHUNK_SIZE))
+            if stat.st_size > 2 * HASH_CHUNK_SIZE:
+                f.seek(-HASH_CHUNK_SIZE, os.SEEK_END)
+                digest.update(f.read(HASH_CHUNK_SIZE))
+        return digest.hexdigest(), stat.st_size, stat.st_mtime_ns
+    content = file.getvalue()
+    digest.update(content)
+    return digest.hexdigest(), len(content), None
+
+def table_cache_key(file, *options):
+    """
+    Return the cache key of a decoded table: the file fingerprint plus the
+    read options (e.g. the table name) that change the decoded result.
+    """
+    key = repr((CACHE_VERSION, file_fingerprint(file)) + options)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def get_cached_table_path(key):
+    return os.path.join(get_cache_dir("tables"), f"{key}.arrow")
+
+def load_cached_table(key):
+    """
+    Load a decoded table from the cache by memory mapping its Arrow IPC file.
+
+    Returns:
+        DataFrame: The cached table, or None if it is not cached.
+    """
+    path = get_cached_table_path(key)
+    if get_cache_size_limit() <= 0 or not os.path.exists(path):
+        return None
+    try:
+        # Mark as recently used for LRU eviction
+        os.utime(path)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        logger.info(f"Loaded cached table {path}.")
+        data = table.to_pandas(split_blocks=True)
+        data.attrs.update(json.loads((table.schema.metadata or {}).get(ATTRS_METADATA_KEY, b"{}")))
+        return data
+    except (OSError, pa.ArrowInvalid) as e:
+        logger.warning(f"Ignoring unreadable cached table {path}: {e}")
+        return None
+
+def store_cached_table(key, data):
+    """
+    Store a decoded table in the cache as an uncompressed Arrow IPC (Feather)
+    file, so that later loads can memory map it, then evict the least
+    recently used files above the size cap.
+    """
+    size_limit = get_cache_size_limit()
+    if size_limit <= 0:
+        return
+    path = get_cached_table_path(key)
+    tmp_path = f"{path}.tmp"
+    try:
+        table = pa.Table.from_pandas(data)
+        table = table.replace_schema_metadata({**table.schema.metadata, ATTRS_METADATA_KEY: json.dumps(data.attrs)})
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        logger.info(f"Cached table at {path}.")
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"Failed to cache table at {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    trim_cache(size_limit, keep=path)
+
+def trim_cache(size_limit, keep=None):
+    """
+    Evict the least recently used cached files above the size cap (see
+    evict_cached_files). A cache problem is logged, it never fails the caller.
+    """
+    try:
+        evict_cached_files(size_limit, keep=keep)
+    except OSError as e:
+        logger.warning(f"Failed to evict cached files: {e}")
+
+def evict_cached_files(size_limit, keep=None):
+    """
+    Delete the least recently used cached tables and plots until they fit in
+    size_limit bytes together. Other threads and processes evict concurrently,
+    so a file may be gone before it is stat'ed or removed here.
+
+    Parameters:
+        size_limit (int): Size cap in bytes.
+        keep (str, optional): Path of a cached file that must not be evicted.
+    """
+    entries = []
+    for subdir, suffix in EVICTABLE_FILES.items():
+        cache_dir = get_cache_dir(subdir)
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith(suffix):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= size_limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            logger.info(f"Evicted cached file {path}.")
+        except FileNotFoundError:
+            pass
+        total_size -= size
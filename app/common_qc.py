@@ -1,12 +1,30 @@
+import os
+import re
+import csv
+import glob
+import shutil
+import hashlib
+import subprocess
+from functools import lru_cache
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 import seaborn as sns
 import logging
 from fuzzywuzzy import fuzz 
 from logging_config import setup_logging
-from reqd_vars_dtypes import required_variables, expected_data_types
+from common_cache import get_cache_dir, table_cache_key, load_cached_table, store_cached_table
+import duckdb_qc
+from plot_render import plot_binned_histograms, render_plot
+from quantile_sketch import DEFAULT_EPSILON, KLLSketch, GroupedSummarySketch, epsilon_to_k
+from frequency_sketch import DEFAULT_CAPACITY, SpaceSavingSketch
+from reqd_vars_dtypes import required_variables, expected_data_types, table_schema_names, get_table_columns
 
 # Initialize logger
 setup_logging()
@@ -14,25 +32,546 @@ logger = logging.getLogger(__name__)
 
 # Common Functions
 
-def read_data(file):
+SUPPORTED_EXTENSIONS = (".csv", ".parquet", ".fst")
+SAMPLE_BATCH_SIZE = 1 << 16
+# Parquet files with fewer row groups than this are sampled by rows instead of by row group
+MIN_SAMPLED_ROW_GROUPS = 20
+# Columns whose hash selects the sampled encounters, in order of preference
+SAMPLE_KEY_COLUMNS = ['hospitalization_id', 'patient_id']
+# Seed of the row sample of tables without a sample key column
+SAMPLE_SEED = 0
+# Rows per chunk of the approximate (sketch based) statistics
+SKETCH_CHUNK_SIZE = 1 << 20
+# Similarity score (fuzz.partial_ratio) above which a missing category is reported as similar
+SIMILARITY_THRESHOLD = 90
+# Name to category pairs shown per mapping, the exported mapping files have all pairs
+MAPPING_DISPLAY_ROWS = 1000
+# Rows written at a time when exporting mappings
+MAPPING_CSV_CHUNK_SIZE = 1 << 16
+# Exact mappings saved in approximate mode are counted one at a time in the background
+mapping_export_executor = ThreadPoolExecutor(max_workers=1)
+# Datetime formats tried on text columns, after ISO 8601 (see detect_datetime_format)
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%d %H:%M', '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M',
+    '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M', '%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %I:%M %p', '%m/%d/%Y',
+    '%d-%b-%Y %H:%M:%S', '%d-%b-%Y %H:%M', '%d-%b-%Y', '%Y%m%d %H:%M:%S', '%Y%m%d'
+]
+# Values sampled to detect the datetime format of a column
+DATETIME_SAMPLE_SIZE = 1000
+# Detected datetime format per (table, column)
+datetime_format_cache = {}
+
+def get_file_name(file):
+    """
+    Return the file name of an uploaded file or a local file path.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.basename(os.fspath(file))
+    return file.name
+
+def get_table_name(file):
+    """
+    Return the CLIF table name (e.g. 'clif_labs') for an uploaded file or a local file path.
+    """
+    return get_file_name(file).split('.')[0]
+
+def find_data_files(path):
+    """
+    Resolve a local directory, file path or glob pattern to the CLIF table files it contains.
+
+    Parameters:
+        path (str): Directory, file path or glob pattern (e.g. '/data/clif/*.parquet').
+
+    Returns:
+        list: Sorted paths of the matching csv, parquet and fst files.
+    """
+    path = os.path.expanduser(path.strip())
+    if os.path.isdir(path):
+        candidates = [os.path.join(path, f) for f in os.listdir(path)]
+    else:
+        candidates = glob.glob(path)
+    data_files = sorted(f for f in candidates if os.path.isfile(f) and f.endswith(SUPPORTED_EXTENSIONS))
+    if not data_files:
+        raise ValueError(f"No csv, parquet or fst files found at '{path}'.")
+    return data_files
+
+def get_arrow_type(column, expected_dtype):
+    """
+    Map an expected dtype from reqd_vars_dtypes to the Arrow type used while parsing.
+    *_name and *_category columns are dictionary encoded.
+    """
+    if expected_dtype.startswith('datetime64'):
+        return pa.timestamp('us', tz='UTC')
+    elif expected_dtype == 'float64':
+        return pa.float64()
+    elif expected_dtype == 'int64':
+        return pa.int64()
+    elif expected_dtype == 'bool':
+        return pa.bool_()
+    elif column.endswith(('_name', '_category')):
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+def conform_arrow_table(table, table_name):
+    """
+    Cast the columns of an Arrow table to the expected types of a CLIF table.
+    Timestamps without a timezone are taken to be UTC. Columns that cannot be
+    cast keep their original type so that validate_and_convert_dtypes can
+    report and coerce them.
+
+    Parameters:
+        table (Table): Arrow table.
+        table_name (str): Name of the table in expected_data_types.
+
+    Returns:
+        Table: Arrow table with the expected column types.
+    """
+    expected_dtypes = expected_data_types[table_name]
+    for i, field in enumerate(table.schema):
+        if field.name not in expected_dtypes:
+            continue
+        arrow_type = get_arrow_type(field.name, expected_dtypes[field.name])
+        if field.type == arrow_type:
+            continue
+        try:
+            column = table.column(i).cast(arrow_type, safe=not pa.types.is_timestamp(field.type))
+            table = table.set_column(i, field.name, column)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            logger.info(f"Column {field.name} could not be read as {arrow_type}, keeping {field.type}.")
+    return table
+
+def read_csv_header(file):
+    """
+    Return the column names in the header line of a csv file.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, newline='', encoding='utf-8-sig') as f:
+            line = f.readline()
+    else:
+        line = file.readline()
+        file.seek(0)
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig')
+    return next(csv.reader([line]))
+
+def get_sample_key(columns):
+    """
+    Return the column used to sample a table: hospitalization_id, or
+    patient_id for tables without it, or None.
+    """
+    return next((column for column in SAMPLE_KEY_COLUMNS if column in columns), None)
+
+def sample_mask(keys, sample_frac):
+    """
+    Select the rows of the sampled encounters. Each key is hashed and kept
+    when its hash falls in the first sample_frac of the hash range, so a
+    hospitalization is either fully in or fully out of the sample, and the
+    same hospitalizations are selected in every table and on every run.
+
+    Parameters:
+        keys (Array, ChunkedArray or Series): Sample key of each row (e.g. hospitalization_id).
+        sample_frac (float): Fraction of keys to keep.
+
+    Returns:
+        ndarray: Boolean mask of the rows to keep.
+    """
+    # Hash the text of the keys so ids read as numbers in one table and as text in another match
+    keys = pa.array(keys) if isinstance(keys, pd.Series) else keys
+    keys = keys.cast(pa.string()).to_numpy(zero_copy_only=False)
+    # hash_array hashes each distinct key once with a fixed hash key
+    hashes = pd.util.hash_array(keys)
+    return (hashes >> np.uint64(11)) < np.uint64(round(sample_frac * (1 << 53)))
+
+def sample_batches(batches, schema, sample_frac):
+    """
+    Sample a stream of Arrow record batches so that only the sample is held
+    in memory. Rows are sampled by encounter with sample_mask when the table
+    has a sample key column, otherwise each row is kept with probability
+    sample_frac using a fixed seed.
+
+    Parameters:
+        batches (iterable): Record batches.
+        schema (Schema): Schema of the batches.
+        sample_frac (float): Fraction of rows to keep.
+
+    Returns:
+        Table: Sampled rows.
+        int: Number of rows before sampling.
+    """
+    key = get_sample_key(schema.names)
+    rng = np.random.default_rng(SAMPLE_SEED)
+    sampled = []
+    total_rows = 0
+    for batch in batches:
+        total_rows += batch.num_rows
+        if key is not None:
+            mask = sample_mask(batch.column(key), sample_frac)
+        else:
+            mask = rng.random(batch.num_rows) < sample_frac
+        sampled.append(batch.filter(mask))
+    return pa.Table.from_batches(sampled, schema=schema), total_rows
+
+def read_parquet_sample(file, columns, sample_frac):
+    """
+    Read a sample of a Parquet file. Files are streamed in batches and
+    sampled by encounter. Files without a sample key column that have many
+    row groups are sampled by reading a subset of row groups instead, so
+    only the sampled groups are read.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local file.
+        columns (list): Columns to read, or None for all columns.
+        sample_frac (float): Fraction of rows to keep.
+
+    Returns:
+        Table: Sampled rows.
+        int: Number of rows before sampling.
+    """
+    parquet_file = pq.ParquetFile(file, memory_map=isinstance(file, (str, os.PathLike)))
+    total_rows = parquet_file.metadata.num_rows
+    num_row_groups = parquet_file.num_row_groups
+    schema = parquet_file.schema_arrow
+    if columns is not None:
+        schema = pa.schema([schema.field(column) for column in columns])
+    if get_sample_key(schema.names) is None and num_row_groups >= MIN_SAMPLED_ROW_GROUPS:
+        num_sampled = max(1, round(num_row_groups * sample_frac))
+        row_groups = np.sort(np.random.default_rng(SAMPLE_SEED).choice(num_row_groups, num_sampled, replace=False))
+        return parquet_file.read_row_groups(row_groups.tolist(), columns=columns), total_rows
+    batches = parquet_file.iter_batches(batch_size=SAMPLE_BATCH_SIZE, columns=columns)
+    return sample_batches(batches, schema, sample_frac)
+
+def read_typed_csv(file, table_name, sample_frac=None):
+    """
+    Read the columns of a CLIF table from a csv file with Arrow, applying the
+    expected types during the parse. A column whose values do not parse as
+    the expected type is re-read as text. When sampling, the file is
+    streamed and only the sampled rows are kept.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local file.
+        table_name (str): Name of the table in expected_data_types.
+        sample_frac (float, optional): Fraction of rows to keep.
+
+    Returns:
+        Table: Arrow table.
+        int: Number of rows before sampling.
+    """
+    is_path = isinstance(file, (str, os.PathLike))
+    header = read_csv_header(file)
+    expected_dtypes = expected_data_types[table_name]
+    columns = [column for column in get_table_columns(table_name) if column in header]
+    column_types = {}
+    for column in columns:
+        if column in expected_dtypes:
+            arrow_type = get_arrow_type(column, expected_dtypes[column])
+            # Parse timestamps without a timezone first, most extracts have no offsets
+            column_types[column] = pa.timestamp('us') if pa.types.is_timestamp(arrow_type) else arrow_type
+        else:
+            column_types[column] = pa.string()
+
+    while True:
+        source = pa.memory_map(os.fspath(file)) if is_path else file
+        try:
+            convert_options = pv.ConvertOptions(include_columns=columns, column_types=column_types, strings_can_be_null=True)
+            if sample_frac is None:
+                table = pv.read_csv(source, convert_options=convert_options)
+                return table, table.num_rows
+            reader = pv.open_csv(source, convert_options=convert_options)
+            return sample_batches(reader, reader.schema, sample_frac)
+        except pa.ArrowInvalid as e:
+            match = re.search(r"CSV column #(\d+)", str(e))
+            column = header[int(match.group(1))] if match and int(match.group(1)) < len(header) else None
+            if column not in column_types or column_types[column] == pa.string():
+                raise
+            if column_types[column] == pa.timestamp('us'):
+                column_types[column] = pa.timestamp('us', tz='UTC')
+            else:
+                column_types[column] = pa.string()
+            logger.info(f"Column {column} does not parse as expected, retrying as {column_types[column]}.")
+        finally:
+            if is_path:
+                source.close()
+            else:
+                file.seek(0)
+
+# Reads an fst file with R's fst package (column subset and row range) and writes it as Parquet
+FST_TO_PARQUET_SCRIPT = """
+args <- commandArgs(trailingOnly = TRUE)
+columns <- NULL
+if (args[3] != "") columns <- intersect(strsplit(args[3], ",")[[1]], fst::metadata_fst(args[1])$columnNames)
+to <- NULL
+if (args[5] != "") to <- as.numeric(args[5])
+data <- fst::read_fst(args[1], columns = columns, from = as.numeric(args[4]), to = to)
+arrow::write_parquet(data, args[2])
+"""
+
+def convert_fst_to_parquet(file, columns=None, from_row=1, to_row=None):
+    """
+    Convert an fst file to Parquet with R's fst package and cache the result.
+    Repeat reads of an unchanged file with the same column subset and row
+    range reuse the cached Parquet file.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local fst file.
+        columns (list, optional): Columns to convert. Columns missing from the file are skipped.
+        from_row (int): First row to convert (1-based, as in fst::read_fst).
+        to_row (int, optional): Last row to convert. Defaults to the last row of the file.
+
+    Returns:
+        str: Path to the cached Parquet file.
+    """
+    rscript = shutil.which("Rscript")
+    if rscript is None:
+        raise ValueError("Reading fst files requires R with the 'fst' and 'arrow' packages installed (Rscript was not found).")
+
+    cache_dir = get_cache_dir("fst")
+    if isinstance(file, (str, os.PathLike)):
+        path = os.path.abspath(os.fspath(file))
+    else:
+        # Uploaded files are written to the cache once, named by their content
+        content = file.getvalue()
+        path = os.path.join(cache_dir, f"upload_{hashlib.sha1(content).hexdigest()}.fst")
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    stat = os.stat(path)
+    key = repr((path, stat.st_size, stat.st_mtime_ns, columns, from_row, to_row))
+    parquet_path = os.path.join(cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.parquet")
+    if os.path.exists(parquet_path):
+        logger.info(f"Using cached Parquet conversion of {path}.")
+        return parquet_path
+
+    tmp_path = f"{parquet_path}.tmp"
+    args = [path, tmp_path, ",".join(columns or []), str(from_row), "" if to_row is None else str(to_row)]
+    result = subprocess.run([rscript, "-e", FST_TO_PARQUET_SCRIPT] + args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ValueError(f"Failed to convert fst file {path}: {result.stderr.strip()}")
+    os.replace(tmp_path, parquet_path)
+    logger.info(f"Converted {path} to {parquet_path}.")
+    return parquet_path
+
+def read_fst(file, columns=None, from_row=1, to_row=None):
+    """
+    Read an fst file, or a column subset and row range of it, as an Arrow table.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local fst file.
+        columns (list, optional): Columns to read.
+        from_row (int): First row to read (1-based).
+        to_row (int, optional): Last row to read.
+
+    Returns:
+        Table: Arrow table.
+    """
+    parquet_path = convert_fst_to_parquet(file, columns, from_row, to_row)
+    return pq.read_table(parquet_path, memory_map=True)
+
+def read_data(file, table_name=None, sample_frac=None):
     """
     Read data from file based on file type.
+    Local paths are opened in place with memory mapping instead of being
+    buffered through the browser upload. When the table is known, only its
+    CLIF columns are read and the expected types are applied while parsing.
+    When sampling, only the sampled rows are kept in memory and the number
+    of rows before sampling is stored in data.attrs['total_rows'].
+
     Parameters:
-        filepath (str): Path to the file.
-        filetype (str): Type of the file ('csv' or 'parquet').
+        file (UploadedFile or str): Uploaded file or path to a local file.
+        table_name (str, optional): Name of the table in expected_data_types (e.g. 'Labs').
+        sample_frac (float, optional): Fraction of rows to read.
+
     Returns:
         DataFrame: DataFrame containing the data.
     """
-    if file.name.endswith(".csv"):
-        return pd.read_csv(file)
-    elif file.name.endswith(".parquet"):
-        table = pq.read_table(file)
-        return table.to_pandas()
-    elif file.name.endswith(".fst"):
-        return pd.read_fwf(file)
+    file_name = get_file_name(file)
+    is_path = isinstance(file, (str, os.PathLike))
+    typed = table_name in expected_data_types
+    total_rows = None
+    if file_name.endswith(".csv"):
+        if typed:
+            table, total_rows = read_typed_csv(file, table_name, sample_frac)
+        elif sample_frac is None:
+            return pd.read_csv(file, memory_map=is_path)
+        else:
+            sampled = []
+            total_rows = 0
+            for i, chunk in enumerate(pd.read_csv(file, memory_map=is_path, chunksize=SAMPLE_BATCH_SIZE)):
+                total_rows += len(chunk)
+                key = get_sample_key(chunk.columns)
+                if key is not None:
+                    sampled.append(chunk[sample_mask(chunk[key], sample_frac)])
+                else:
+                    sampled.append(chunk.sample(frac=sample_frac, random_state=SAMPLE_SEED + i))
+            data = pd.concat(sampled)
+            data.attrs['total_rows'] = total_rows
+            return data
+    elif file_name.endswith(".parquet"):
+        columns = None
+        if typed:
+            names = pq.read_schema(file).names
+            if not is_path:
+                file.seek(0)
+            columns = [column for column in get_table_columns(table_name) if column in names]
+        if sample_frac is None:
+            table = pq.read_table(file, columns=columns, memory_map=is_path)
+        else:
+            table, total_rows = read_parquet_sample(file, columns, sample_frac)
+    elif file_name.endswith(".fst"):
+        columns = get_table_columns(table_name) if typed else None
+        if sample_frac is None:
+            table = read_fst(file, columns=columns)
+        else:
+            table, total_rows = read_parquet_sample(convert_fst_to_parquet(file, columns), None, sample_frac)
     else:
         raise ValueError("Unsupported file type. Please provide either 'csv', 'fst' or 'parquet'.")
+    if typed:
+        table = conform_arrow_table(table, table_name)
+    data = table.to_pandas(split_blocks=True, self_destruct=True)
+    if sample_frac is not None:
+        data.attrs['total_rows'] = total_rows
+    return data
     
+def read_cached_data(file, table_name=None, sample_frac=None):
+    """
+    Read data from file through the persistent table cache. Repeat reads of
+    an unchanged file are memory mapped from the cached Arrow IPC file
+    instead of being decoded again.
+
+    Parameters:
+        file (UploadedFile or str): Uploaded file or path to a local file.
+        table_name (str, optional): Name of the table in expected_data_types (e.g. 'Labs').
+        sample_frac (float, optional): Fraction of rows to read.
+
+    Returns:
+        DataFrame: DataFrame containing the data.
+    """
+    key = table_cache_key(file, table_name, sample_frac)
+    data = load_cached_table(key)
+    if data is None:
+        data = read_data(file, table_name, sample_frac)
+        store_cached_table(key, data)
+    return data
+
+def load_tables(files, sample_frac=None, max_workers=None):
+    """
+    Read several CLIF tables concurrently in a thread pool. Arrow and pandas
+    release the GIL while parsing, so the slowest table bounds the load time.
+    Tables are read through the persistent table cache.
+    A table that fails to load does not stop the others.
+
+    Parameters:
+        files (list): Uploaded files and/or paths to local files.
+        sample_frac (float, optional): Fraction of rows to read from each table.
+        max_workers (int, optional): Number of threads. Defaults to one per file, up to the CPU count.
+
+    Yields:
+        tuple: (table_name, DataFrame or None, Exception or None) for each file as it finishes.
+    """
+    max_workers = max_workers or max(1, min(len(files), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for file in files:
+            table_name = get_table_name(file)
+            futures[executor.submit(read_cached_data, file, table_schema_names.get(table_name), sample_frac)] = table_name
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                yield table_name, future.result(), None
+            except Exception as e:
+                logger.error(f"Failed to load {table_name}: {e}")
+                yield table_name, None, e
+
+def get_qc_source(session, table):
+    """
+    Return the local file that out-of-core DuckDB checks should run on, or
+    None when the checks should run in pandas (pandas backend selected, the
+    table was uploaded, or the data is sampled).
+
+    Parameters:
+        session (dict): Streamlit session state.
+        table (str): Session name of the table (e.g. 'clif_labs').
+    """
+    if session.get('qc_backend') != 'duckdb' or session.get('sampling_option') is not None:
+        return None
+    return session.get('sources', {}).get(table)
+
+def run_qc_step(session, table, step, compute, *args, **kwargs):
+    """
+    Run a step of a table's QC once per submit. The result is memoized in
+    session['qc_results'] by (table, step), so opening a tab again redraws
+    its results without recomputing them. The results are cleared when the
+    form is submitted.
+
+    Parameters:
+        session (dict): Streamlit session state.
+        table (str): Session name of the table (e.g. 'clif_labs').
+        step (str): Name of the step, unique within the table's QC.
+        compute (callable): Function computing the step from args and kwargs.
+    """
+    results = session.setdefault('qc_results', {})
+    # Collect the steps a background table QC has computed (see qc_scheduler)
+    pending = session.get('qc_futures', {}).pop(table, None)
+    if pending is not None:
+        try:
+            results.update(pending.result())
+        except Exception as e:
+            logger.warning(f"Background QC of {table} failed, running it here: {e}")
+    if (table, step) not in results:
+        results[(table, step)] = compute(*args, **kwargs)
+    return results[(table, step)]
+
+def run_duckdb_check(check, source, *args):
+    """
+    Run an out-of-core check from duckdb_qc on a source file.
+
+    Returns:
+        The check result, or None when there is no source, the check does not
+        apply to the file or it fails, in which case the caller falls back to pandas.
+    """
+    if source is None or not duckdb_qc.duckdb_available():
+        return None
+    try:
+        return check(source, *args)
+    except Exception as e:
+        logger.warning(f"DuckDB check {check.__name__} failed on {source}, falling back to pandas: {e}")
+        return None
+
+def count_missing(data, source=None):
+    """
+    Count missing values per column.
+
+    Parameters:
+        data (DataFrame): DataFrame to check.
+        source (str, optional): Source file of data to count on out-of-core with DuckDB.
+
+    Returns:
+        Series: Missing value count per column.
+    """
+    missing_counts = run_duckdb_check(duckdb_qc.count_missing, source)
+    if missing_counts is None:
+        return data.isna().sum()
+    # Columns derived after loading are not in the source file
+    derived_columns = [column for column in data.columns if column not in missing_counts.index]
+    return pd.concat([missing_counts, data[derived_columns].isna().sum()]).reindex(data.columns)
+
+def count_duplicates(data, source=None):
+    """
+    Count rows that duplicate an earlier row.
+
+    Parameters:
+        data (DataFrame): DataFrame to check.
+        source (str, optional): Source file of data to count on out-of-core with DuckDB.
+
+    Returns:
+        int: Number of duplicate rows.
+    """
+    duplicate_count = run_duckdb_check(duckdb_qc.count_duplicates, source)
+    if duplicate_count is None:
+        return data.duplicated().sum()
+    return duplicate_count
+
 def check_required_variables(table_name, df): ### Modified from original
     """
     Check if all required variables exist in the DataFrame.
@@ -51,35 +590,247 @@ def check_required_variables(table_name, df): ### Modified from original
     else:
         return f"All required columns present for '{table_name}'."
 
-def generate_summary_stats(data, category_column, value_column):
+def group_order(codes, num_groups):
+    """
+    Return the order that gathers the rows of each group together, a radix
+    sort for small integer codes. Codes must be non-negative.
+    """
+    return np.argsort(codes.astype(np.min_scalar_type(max(num_groups - 1, 0))), kind='stable')
+
+def summarize_groups(codes, values, num_groups, order=None, std=False):
+    """
+    Compute the summary statistics of values by group in one sorted pass.
+    Rows are grouped and each group is sorted once, after which the count, min,
+    max and quartiles of each group are read at computed offsets
+    (quartiles are linearly interpolated, as in Series.quantile) and the
+    sums for the means are taken with one reduceat.
+
+    Parameters:
+        codes (ndarray): Group code of each row, -1 for rows without a group.
+        values (ndarray): Float values, NaN for missing.
+        num_groups (int): Number of groups.
+        order (ndarray, optional): group_order of the codes, to reuse across value columns.
+            Only for codes without -1.
+        std (bool): Also compute the sample standard deviation (Std).
+
+    Returns:
+        dict: N, Missing (count), Min, Mean, Q1, Median, Q3 and Max arrays, one entry per group.
+    """
+    if order is None:
+        grouped = codes >= 0
+        codes, values = codes[grouped], values[grouped]
+        order = group_order(codes, num_groups)
+    missing = np.isnan(values)
+    sizes = np.bincount(codes, minlength=num_groups)
+    counts = sizes - np.bincount(codes[missing], minlength=num_groups)
+    starts = np.cumsum(sizes) - sizes
+    # Gather the rows of each group together, then sort each group's values
+    # in place (missing values last)
+    values = values[order]
+    for start, size in zip(starts, sizes):
+        values[start:start + size].sort()
+
+    has_values = counts > 0
+    # Offsets are clipped so that groups without values read a valid position
+    last = np.maximum(starts + counts - 1, 0)
+
+    def quantile(q):
+        position = q * np.maximum(counts - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        fraction = position - lower
+        below = values.take(np.minimum(starts + lower, last), mode='clip')
+        above = values.take(np.minimum(starts + lower + 1, last), mode='clip')
+        return np.where(has_values, below + (above - below) * fraction, np.nan)
+
+    # Every group has at least one row, so the group starts are increasing
+    sums = np.add.reduceat(np.where(np.isnan(values), 0, values), starts) if num_groups else np.zeros(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(has_values, sums / counts, np.nan)
+    stats = {
+        'N': counts,
+        'Missing': sizes - counts,
+        'Min': np.where(has_values, values.take(np.minimum(starts, last), mode='clip'), np.nan),
+        'Mean': means,
+        'Q1': quantile(0.25),
+        'Median': quantile(0.5),
+        'Q3': quantile(0.75),
+        'Max': np.where(has_values, values.take(last, mode='clip'), np.nan)
+    }
+    if std:
+        deviations = np.nan_to_num(values - np.repeat(means, sizes)) if num_groups else values
+        squares = np.add.reduceat(deviations * deviations, starts) if num_groups else np.zeros(0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats['Std'] = np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+    return stats
+
+def iter_chunks(data, chunk_size=SKETCH_CHUNK_SIZE):
+    """
+    Yield consecutive row chunks of a DataFrame (views, not copies).
+    """
+    for start in range(0, len(data), chunk_size):
+        yield data.iloc[start:start + chunk_size]
+
+def sketch_summary_stats(chunks, category_column, value_column, epsilon=DEFAULT_EPSILON, max_workers=None):
+    """
+    Sketch the summary statistics of a table given as chunks of rows, in
+    parallel, and merge the chunk sketches. Chunks can come from one table
+    in memory, a chunked reader of a table larger than memory, or several
+    files or sites, and the returned sketch can be merged with others.
+
+    Parameters:
+        chunks (iterable): DataFrames with category_column and value_column.
+        category_column (str): Name of the column containing categories.
+        value_column (str): Name of the column containing values.
+        epsilon (float): Normalized rank error of the quartiles.
+        max_workers (int, optional): Number of threads. Defaults to the CPU count.
+
+    Returns:
+        GroupedSummarySketch: Merged sketch, see GroupedSummarySketch.to_frame.
+    """
+    def sketch_chunk(chunk):
+        sketch = GroupedSummarySketch(epsilon)
+        sketch.update(chunk[category_column], chunk[value_column].to_numpy(dtype=float, na_value=np.nan))
+        return sketch
+
+    summary_sketch = GroupedSummarySketch(epsilon)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for sketch in executor.map(sketch_chunk, chunks):
+            summary_sketch.merge(sketch)
+    return summary_sketch
+
+def generate_summary_stats(data, category_column, value_column, source=None, approximate=False):
     """
     Generate summary statistics for a DataFrame based on a specified category column and value column.
+    In approximate mode the quartiles come from mergeable quantile sketches
+    built chunk by chunk (see sketch_summary_stats), the other statistics are exact.
 
     Parameters:
         data (DataFrame): DataFrame containing the data.
         category_column (str): Name of the column containing categories.
         value_column (str): Name of the column containing values.
+        source (str, optional): Source file of data to compute on out-of-core with DuckDB.
+        approximate (bool): Approximate the quartiles.
 
     Returns:
         DataFrame: DataFrame containing summary statistics.
     """
-    summary_stats = data.groupby([category_column]).agg(
-        N=(value_column, 'count'),
-        Missing=(value_column, lambda x: (x.isnull().sum()/data.shape[0])*100),
-        Min=(value_column, 'min'),
-        Mean=(value_column, 'mean'),
-        Q1=(value_column, lambda x: x.quantile(0.25)),
-        Median=(value_column, 'median'),
-        Q3=(value_column, lambda x: x.quantile(0.75)),
-        Max=(value_column, 'max')
-    ).reset_index().sort_values(by=[category_column], ascending=True)
+    summary_stats = run_duckdb_check(duckdb_qc.generate_summary_stats, source, category_column, value_column, approximate)
+    if summary_stats is not None:
+        return summary_stats
+
+    if approximate:
+        return sketch_summary_stats(iter_chunks(data), category_column, value_column).to_frame()
+
+    codes, categories = pd.factorize(data[category_column])
+    stats = summarize_groups(codes, data[value_column].to_numpy(dtype=float, na_value=np.nan), len(categories))
+    summary_stats = pd.DataFrame({category_column: np.asarray(categories, dtype=object), **stats})
+    summary_stats['Missing'] = summary_stats['Missing'] / data.shape[0] * 100
+    # Sort dictionary encoded categories by name rather than by code
+    summary_stats = summary_stats.sort_values(by=[category_column], ascending=True, ignore_index=True)
 
     summary_stats = summary_stats.rename(columns={category_column: 'Category', 'Missing': 'Missing (%)'})
 
     return summary_stats
 
+def describe_columns(data, approximate=False, epsilon=DEFAULT_EPSILON):
+    """
+    Describe the numeric columns of a DataFrame like DataFrame.describe().
+    In approximate mode the quartiles come from quantile sketches built
+    chunk by chunk in parallel, the other statistics are exact.
+
+    Parameters:
+        data (DataFrame): DataFrame to describe.
+        approximate (bool): Approximate the quartiles.
+        epsilon (float): Normalized rank error of the quartiles.
+
+    Returns:
+        DataFrame: count, mean, std, min, 25%, 50%, 75% and max per numeric column.
+    """
+    if not approximate:
+        return data.describe()
+
+    def sketch_chunk(chunk):
+        sketches = {}
+        for column in chunk.columns:
+            sketches[column] = KLLSketch(epsilon_to_k(epsilon))
+            sketches[column].update(chunk[column].to_numpy(dtype=float, na_value=np.nan))
+        return sketches
+
+    numeric = data.select_dtypes(include='number')
+    sketches = {column: KLLSketch(epsilon_to_k(epsilon)) for column in numeric.columns}
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for chunk_sketches in executor.map(sketch_chunk, iter_chunks(numeric)):
+            for column, sketch in chunk_sketches.items():
+                sketches[column].merge(sketch)
+
+    summary = {}
+    for column in numeric.columns:
+        q1, median, q3 = sketches[column].quantiles([0.25, 0.5, 0.75])
+        summary[column] = [numeric[column].count(), numeric[column].mean(), numeric[column].std(), numeric[column].min(), q1, median, q3, numeric[column].max()]
+    return pd.DataFrame(summary, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
+def describe_by_group(data, group_columns, value_columns):
+    """
+    Describe several value columns by group, like melting the value columns
+    into an attribute column and calling groupby(...).describe(), but on
+    the wide columns: the groups are factorized and ordered once and each
+    value column is summarized in place (see summarize_groups), so no long
+    table is built. Non-numeric value columns are coerced to numbers.
+
+    Parameters:
+        data (DataFrame): DataFrame containing the data.
+        group_columns (list): Columns to group by. Rows missing any of them are dropped.
+        value_columns (list): Columns to describe.
+
+    Returns:
+        DataFrame: group_columns, attribute, count, mean, std, min, 25%, 50%,
+            75% and max of each observed group and value column, sorted by group and attribute.
+    """
+    # Observed groups, sorted like groupby (categoricals in category order)
+    group_codes = [pd.factorize(data[column], sort=True) for column in group_columns]
+    codes = np.zeros(len(data), dtype=np.int64)
+    grouped = np.ones(len(data), dtype=bool)
+    for column_codes, uniques in group_codes:
+        codes = codes * len(uniques) + column_codes
+        grouped &= column_codes >= 0
+    codes = codes[grouped]
+    num_keys = int(np.prod([len(uniques) for _, uniques in group_codes]))
+    if num_keys <= 4 * len(codes) + (1 << 20):
+        present = np.bincount(codes, minlength=num_keys) > 0
+        key_codes = (np.cumsum(present) - 1)[codes]
+        codes = np.flatnonzero(present)
+    else:
+        # Too many possible groups for a dense lookup
+        codes, key_codes = np.unique(codes, return_inverse=True)
+    num_groups = len(codes)
+    order = group_order(key_codes, num_groups)
+
+    attributes = sorted(value_columns)
+    stats = []
+    for column in attributes:
+        values = data[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values, errors='coerce')
+        values = values.to_numpy(dtype=float, na_value=np.nan)[grouped]
+        stats.append(summarize_groups(key_codes, values, num_groups, order=order, std=True))
+
+    summary = {}
+    # Unpack the combined group codes into one key column per group column
+    for column, (_, uniques) in reversed(list(zip(group_columns, group_codes))):
+        summary[column] = np.repeat(np.asarray(uniques, dtype=object).take(codes % len(uniques)), len(attributes))
+        codes = codes // len(uniques)
+    summary = {column: summary[column] for column in group_columns}
+    summary['attribute'] = np.tile(attributes, num_groups)
+    for name, key in [('count', 'N'), ('mean', 'Mean'), ('std', 'Std'), ('min', 'Min'),
+                      ('25%', 'Q1'), ('50%', 'Median'), ('75%', 'Q3'), ('max', 'Max')]:
+        summary[name] = np.column_stack([column_stats[key] for column_stats in stats]).ravel() if stats else np.zeros(0)
+    summary = pd.DataFrame(summary)
+    summary['count'] = summary['count'].astype(float)
+    return summary
+
 def find_closest_match(label, labels):
     """
+    Find the label most similar to label (fuzz.partial_ratio) by scoring every label.
     """
     closest_label = None
     highest_similarity = -1
@@ -90,6 +841,90 @@ def find_closest_match(label, labels):
             highest_similarity = similarity
     return closest_label, highest_similarity
 
+def get_trigrams(label):
+    return Counter(label[i:i + 3] for i in range(len(label) - 2))
+
+def build_trigram_index(labels):
+    """
+    Build an inverted index from each trigram to the labels containing it.
+
+    Returns:
+        dict: trigram -> (label positions, occurrences of the trigram in each label).
+    """
+    postings = {}
+    for position, label in enumerate(labels):
+        for trigram, count in get_trigrams(label).items():
+            postings.setdefault(trigram, ([], []))
+            postings[trigram][0].append(position)
+            postings[trigram][1].append(count)
+    return {trigram: (np.array(positions), np.array(counts)) for trigram, (positions, counts) in postings.items()}
+
+def min_shared_trigrams(shorter, threshold):
+    """
+    Return the fewest trigrams two strings share when their partial_ratio
+    reaches threshold (see match_categories).
+
+    Parameters:
+        shorter (ndarray): Length of the shorter string of each pair.
+        threshold (int): Minimum similarity of a match.
+
+    Returns:
+        ndarray: Lower bound of the shared trigrams of each pair (-inf when no pair can be ruled out).
+    """
+    r = (threshold - 0.5) / 100
+    if 2.5 * r - 2 <= 0:
+        return np.full(len(shorter), -np.inf)
+    return (2.5 * r - 2) * 2 * shorter / (2 - r) - 2
+
+@lru_cache(maxsize=32)
+def match_categories(expected, observed, threshold=SIMILARITY_THRESHOLD):
+    """
+    Find the closest observed category of every expected category that is
+    not observed, scoring only candidate pairs from a trigram index.
+    Results are cached per (expected categories, observed categories).
+
+    partial_ratio scores the shorter string (length m) against windows of
+    the longer one (length w <= m) as round(100 * 2M / (m + w)), where M
+    characters match in k blocks. The blocks share at least M - 2k
+    trigrams, and consecutive blocks are separated by at least one
+    unmatched (substituted, inserted or deleted) character, so
+    k <= 1 + m + w - 2M. A score of threshold needs 2M >= r * (m + w) with
+    r = (threshold - 0.5) / 100, hence w >= r * m / (2 - r) and at least
+    (2.5 * r - 2) * 2 * m / (2 - r) - 2 shared trigrams (see
+    min_shared_trigrams). Pairs sharing fewer trigrams cannot reach the
+    threshold and are not scored, so the result is the same as scoring
+    every pair with find_closest_match.
+
+    Parameters:
+        expected (tuple): Expected categories (e.g. from the outlier thresholds).
+        observed (tuple): Distinct observed categories.
+        threshold (int): Minimum similarity of a match.
+
+    Returns:
+        tuple: (similar_categories, missing_categories) as in check_categories_exist.
+    """
+    index = build_trigram_index(observed)
+    observed_lengths = np.array([len(category) for category in observed], dtype=np.int64)
+    observed_set = set(observed)
+    similar_categories = []
+    missing_categories = []
+    for category in expected:
+        if category in observed_set:
+            continue
+        shared = np.zeros(len(observed), dtype=np.int64)
+        for trigram, count in get_trigrams(category).items():
+            if trigram in index:
+                positions, counts = index[trigram]
+                shared[positions] += np.minimum(counts, count)
+        shorter = np.minimum(observed_lengths, len(category))
+        candidates = np.flatnonzero(shared >= min_shared_trigrams(shorter, threshold))
+        closest_match, similarity = find_closest_match(category, [observed[i] for i in candidates])
+        if similarity >= threshold:
+            similar_categories.append((category, closest_match))
+        else:
+            missing_categories.append(category)
+    return similar_categories, missing_categories
+
 def check_categories_exist(data, outlier_thresholds, category_column):
     """
     Check if categories in outlier thresholds match with categories in the data DataFrame.
@@ -100,66 +935,121 @@ def check_categories_exist(data, outlier_thresholds, category_column):
         category_column (str): Name of the column containing categories.
 
     Returns:
-        None
+        list: (missing category, similar observed category) pairs.
+        list: Missing categories without a similar observed category.
     """
-    categories = data[category_column].unique()
-    # Lower case categories
-    categories = [category.lower() for category in categories]
-    missing_categories = []
-    similar_categories = []
+    # Lower case the distinct categories
+    categories = pd.Index(data[category_column].dropna().unique()).astype(str).str.lower().unique()
+    similar_categories, missing_categories = match_categories(tuple(outlier_thresholds[category_column]), tuple(categories))
+    return list(similar_categories), list(missing_categories)
 
-    # Iterate through outlier_thresholds DataFrame
-    for _, row in outlier_thresholds.iterrows():
-        category = row[category_column]
-        # Check if category exists in data categories
-        if category not in categories:
-            # If not found, find closest match
-            closest_match, similarity = find_closest_match(category, categories)
-            if similarity >= 90:  # Set a threshold for similarity score
-                similar_categories.append((category, closest_match))
-            else:
-                missing_categories.append(category)  
-    return similar_categories, missing_categories
+def find_outliers_long(df, df_outlier_thresholds, category_variable, numeric_variable):
+    """
+    Flag the values of a long table that fall outside the limits of their category
+    in a single pass. Categories are factorized once and each row's limits are
+    looked up by its category code, instead of filtering the table per category.
+
+    Parameters:
+        df (DataFrame): DataFrame in long format (e.g. labs).
+        df_outlier_thresholds (DataFrame): Outlier thresholds with category_variable, lower_limit and upper_limit columns.
+        category_variable (str): Category column (e.g. 'lab_category').
+        numeric_variable (str): Value column (e.g. 'lab_value_numeric').
+
+    Returns:
+        ndarray: Boolean outlier mask over the rows of df.
+        ndarray: Position in df_outlier_thresholds of the category of each outlier.
+    """
+    codes, categories = pd.factorize(df[category_variable])
+    # Threshold row of each category (the first one if a category is repeated), -1 when it has no thresholds
+    first_rows = np.flatnonzero(~df_outlier_thresholds[category_variable].duplicated().to_numpy())
+    positions = pd.Index(df_outlier_thresholds[category_variable].iloc[first_rows]).get_indexer(categories)
+    threshold_rows = np.where(positions >= 0, first_rows[positions], -1)
+    # Limits per category, with a trailing NaN for rows without a category (code -1)
+    lower_limits = np.append(np.where(threshold_rows >= 0, df_outlier_thresholds['lower_limit'].to_numpy(dtype=float)[threshold_rows], np.nan), np.nan)
+    upper_limits = np.append(np.where(threshold_rows >= 0, df_outlier_thresholds['upper_limit'].to_numpy(dtype=float)[threshold_rows], np.nan), np.nan)
+
+    values = df[numeric_variable].to_numpy(dtype=float, na_value=np.nan)
+    # Comparisons with NaN limits or values are False
+    mask = (values < lower_limits[codes]) | (values > upper_limits[codes])
+    return mask, np.append(threshold_rows, -1)[codes[mask]]
 
 def replace_outliers_with_na_long(df, df_outlier_thresholds, category_variable, numeric_variable):
     """
     Replace outliers in the labs DataFrame with NaNs based on outlier thresholds.
+    df is not modified: the returned DataFrame shares its columns except the
+    masked numeric column, so the check can be re-run on the same table.
 
     Parameters:
         df (DataFrame): DataFrame containing lab data.
         df_outlier_thresholds (DataFrame): DataFrame containing outlier thresholds.
 
     Returns:
-        DataFrame: Updated DataFrame with outliers replaced with NaNs.
+        DataFrame: DataFrame with outliers replaced with NaNs.
         int: Count of replaced observations.
         float: Proportion of replaced observations.
+        list: (category, lower limit, upper limit, outlier values) per threshold row.
     """
-    replaced_count = 0
-    outlier_details = []
+    mask, outlier_threshold_rows = find_outliers_long(df, df_outlier_thresholds, category_variable, numeric_variable)
+    outlier_rows = np.flatnonzero(mask)
 
-    for _, row in df_outlier_thresholds.iterrows():
-        rclif_category = row[category_variable]
-        lower_limit = row['lower_limit']
-        upper_limit = row['upper_limit']
-        # Filter DataFrame for the current category
-        recorded_values = df.loc[df[category_variable] == rclif_category, numeric_variable]
-        # Identify outliers
-        outliers = recorded_values[(recorded_values < lower_limit) | (recorded_values > upper_limit)]
-        # Store outlier details for display
+    # Split the outliers by threshold row for display
+    order = np.argsort(outlier_threshold_rows, kind='stable')
+    splits = np.searchsorted(outlier_threshold_rows[order], np.arange(len(df_outlier_thresholds) + 1))
+    outlier_details = []
+    for i, (rclif_category, lower_limit, upper_limit) in enumerate(zip(df_outlier_thresholds[category_variable], df_outlier_thresholds['lower_limit'], df_outlier_thresholds['upper_limit'])):
+        outliers = df[numeric_variable].iloc[outlier_rows[order[splits[i]:splits[i + 1]]]]
         outlier_details.append((rclif_category, lower_limit, upper_limit, outliers))
-        # Replace values outside the specified range with NaNs
-        replaced_count += len(outliers)
-        df.loc[df[category_variable] == rclif_category, numeric_variable] = np.where((recorded_values < lower_limit) | (recorded_values > upper_limit), np.nan, recorded_values)
 
-    total_count = len(df)
-    proportion_replaced = replaced_count / total_count
-    df.reset_index(drop=True, inplace=True)
+    replaced_count = len(outlier_rows)
+    proportion_replaced = replaced_count / len(df)
+
+    return mask_columns(df, {numeric_variable: mask}), replaced_count, proportion_replaced, outlier_details
+
+def find_outliers_wide(data, outlier_thresholds):
+    """
+    Flag the values of each column of a wide table that fall outside the column's limits.
+
+    Parameters:
+        data (DataFrame): DataFrame in wide format (e.g. respiratory support).
+        outlier_thresholds (DataFrame): Outlier thresholds with variable_name, lower_limit and upper_limit columns.
+
+    Returns:
+        dict: Boolean outlier mask per column.
+        list: (column, lower limit, upper limit) per threshold row.
+    """
+    masks = {}
+    limits = []
+    for col, lower_limit, upper_limit in zip(outlier_thresholds['variable_name'], outlier_thresholds['lower_limit'], outlier_thresholds['upper_limit']):
+        if col in masks:
+            continue
+        values = data[col].to_numpy(dtype=float, na_value=np.nan)
+        masks[col] = (values < lower_limit) | (values > upper_limit)
+        limits.append((col, lower_limit, upper_limit))
+    return masks, limits
+
+def mask_columns(data, masks):
+    """
+    Return a shallow copy of data with the masked values of some columns set
+    to NaN. Only the masked columns are rewritten, the other columns share
+    memory with data, and data itself is not modified.
+
+    Parameters:
+        data (DataFrame): DataFrame to mask.
+        masks (dict): Boolean mask per column.
 
-    return df, replaced_count, proportion_replaced, outlier_details
+    Returns:
+        DataFrame: Masked DataFrame with a default index.
+    """
+    masked = data.copy(deep=False)
+    for col, mask in masks.items():
+        masked[col] = data[col].mask(mask)
+    masked.index = pd.RangeIndex(len(masked))
+    return masked
 
 def replace_outliers_with_na_wide(data, outlier_thresholds):
     """
     Replace outliers with NA values in a DataFrame based on specified lower and upper limits.
+    data is not modified, see mask_columns.
 
     Parameters:
         data (DataFrame): DataFrame containing the data.
@@ -169,32 +1059,71 @@ def replace_outliers_with_na_wide(data, outlier_thresholds):
         DataFrame: DataFrame with outliers replaced by NA values.
         int: Total number of observations replaced with NA.
         float: Proportion of observations replaced with NA.
+        list: (column, lower limit, upper limit, outlier values) per column.
     """
-    # Initialize variables to record replaced observations
-    total_replaced = 0
-    outlier_details = []
-
-    # Iterate over each column in the DataFrame
-    for col in outlier_thresholds['variable_name']:
-        # Get lower and upper limits for the current column
-        lower_limit = outlier_thresholds.loc[outlier_thresholds['variable_name'] == col, 'lower_limit'].values[0]
-        upper_limit = outlier_thresholds.loc[outlier_thresholds['variable_name'] == col, 'upper_limit'].values[0]
-
-        # Replace outliers with NA values
-        outliers_mask = (data[col] < lower_limit) | (data[col] > upper_limit)
-        outlier_details.append((col, lower_limit, upper_limit, data.loc[outliers_mask, col]))
-        total_replaced += outliers_mask.sum()
-        data.loc[outliers_mask, col] = np.nan
+    masks, limits = find_outliers_wide(data, outlier_thresholds)
+    outlier_details = [(col, lower_limit, upper_limit, data[col][masks[col]]) for col, lower_limit, upper_limit in limits]
+    total_replaced = sum(int(mask.sum()) for mask in masks.values())
 
     # Calculate proportion of replaced observations
     total_observations = data.shape[0]
     proportion_replaced = total_replaced / total_observations
 
-    return data, total_replaced, proportion_replaced, outlier_details
+    return mask_columns(data, masks), total_replaced, proportion_replaced, outlier_details
+
+def bin_by_category(categories, values, bins=30, chunk_size=SKETCH_CHUNK_SIZE):
+    """
+    Count the values of each category in bins equally spaced between the
+    category's minimum and maximum, as np.histogram(values, bins) would per
+    category. Values are binned on category codes in two chunked passes
+    (range, then counts), so memory does not grow with the number of rows.
+
+    Parameters:
+        categories (Series): Category of each row.
+        values (array-like): Value of each row. Missing values are ignored.
+        bins (int): Number of bins per category.
+
+    Returns:
+        tuple: (categories, bin edges of shape (categories, bins + 1),
+            counts of shape (categories, bins)).
+    """
+    if isinstance(categories.dtype, pd.CategoricalDtype):
+        # Like seaborn, categorical columns get a facet per category
+        codes, uniques = categories.cat.codes.to_numpy(), categories.cat.categories
+    else:
+        codes, uniques = pd.factorize(categories)
+    values = np.asarray(values, dtype=float)
+    num_groups = len(uniques)
+    lows, highs = np.full(num_groups, np.inf), np.full(num_groups, -np.inf)
+    for start in range(0, len(codes), chunk_size):
+        chunk_codes, chunk_values = codes[start:start + chunk_size], values[start:start + chunk_size]
+        valid = (chunk_codes >= 0) & ~np.isnan(chunk_values)
+        np.minimum.at(lows, chunk_codes[valid], chunk_values[valid])
+        np.maximum.at(highs, chunk_codes[valid], chunk_values[valid])
+
+    # A constant category is binned around its value, as in np.histogram
+    constant = lows == highs
+    lows, highs = np.where(constant, lows - 0.5, lows), np.where(constant, highs + 0.5, highs)
+    # Categories without values get NaN edges and no counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scales = bins / (highs - lows)
+        edges = lows[:, None] + (highs - lows)[:, None] * (np.arange(bins + 1) / bins)
+
+    counts = np.zeros(num_groups * bins, dtype=np.int64)
+    for start in range(0, len(codes), chunk_size):
+        chunk_codes, chunk_values = codes[start:start + chunk_size], values[start:start + chunk_size]
+        valid = (chunk_codes >= 0) & ~np.isnan(chunk_values)
+        chunk_codes, chunk_values = chunk_codes[valid].astype(np.int64), chunk_values[valid]
+        bin_index = np.clip(((chunk_values - lows[chunk_codes]) * scales[chunk_codes]).astype(np.int64), 0, bins - 1)
+        counts += np.bincount(chunk_codes * bins + bin_index, minlength=num_groups * bins)
+    return uniques, edges, counts.reshape(num_groups, bins)
 
 def generate_facetgrid_histograms(data, category_column, value_column):
     """
-    Generate histograms using seaborn's FacetGrid.
+    Generate a histogram of the values of each category, in a FacetGrid
+    layout. The values are binned with NumPy (see bin_by_category) and only
+    the bin counts are plotted, so the plot time does not grow with the
+    number of rows.
 
     Parameters:
         data (DataFrame): DataFrame containing the data.
@@ -202,20 +1131,23 @@ def generate_facetgrid_histograms(data, category_column, value_column):
         value_column (str): Name of the column containing values.
 
     Returns:
-        FacetGrid: Seaborn FacetGrid object containing the generated histograms.
+        Figure: Matplotlib figure containing the generated histograms.
     """
-    # Create a FacetGrid
-    g = sns.FacetGrid(data, col=category_column, col_wrap=3, sharex=False, sharey=False)
-    g.map(sns.histplot, value_column, bins=30, color='dodgerblue', edgecolor='black')
-
-    # Set titles and labels
-    g.set_titles(col_template='{col_name}')
-    g.set_axis_labels(value_column, 'Frequency')
+    categories, edges, counts = bin_by_category(data[category_column], data[value_column].to_numpy(dtype=float, na_value=np.nan), bins=30)
+    return plot_binned_histograms(categories, edges, counts, value_column, 'Frequency')
 
-    # Adjust layout and add a main title
-    plt.subplots_adjust(top=0.9, hspace=0.4, wspace=0.4)
+def render_facetgrid_histograms(data, category_column, value_column, in_process=False):
+    """
+    Render the histograms of generate_facetgrid_histograms to PNG in the
+    plot worker pool (see plot_render.render_plot). Only the binning runs
+    in the calling thread; a plot of unchanged bin counts comes from the
+    plot cache.
 
-    return g
+    Returns:
+        Future: PNG bytes of the histograms.
+    """
+    categories, edges, counts = bin_by_category(data[category_column], data[value_column].to_numpy(dtype=float, na_value=np.nan), bins=30)
+    return render_plot('binned_histograms', in_process, categories=list(categories), edges=edges, counts=counts, xlabel=value_column, ylabel='Frequency')
 
 def non_scientific_format(x):
     """
@@ -251,10 +1183,156 @@ def plot_histograms_by_device_category(data, selected_category, selected_mode =
     return g
 
 
+def parse_datetimes(values, datetime_format):
+    """
+    Parse an Arrow string array as UTC timestamps with Arrow compute kernels.
+    Values without an offset are taken to be UTC, as in conform_arrow_table.
+
+    Parameters:
+        values (Array or ChunkedArray): Text values.
+        datetime_format (str): strptime format, or 'ISO8601'.
+
+    Returns:
+        ChunkedArray: timestamp[us, tz=UTC] values, null where a value does not parse.
+        Raises ArrowInvalid when an ISO 8601 value does not parse.
+    """
+    utc = pa.timestamp('us', tz='UTC')
+    if datetime_format == 'ISO8601':
+        try:
+            return pc.cast(values, pa.timestamp('us')).cast(utc)
+        except pa.ArrowInvalid:
+            return pc.cast(values, utc)
+    parsed = pc.strptime(values, format=datetime_format, unit='us', error_is_null=True)
+    return parsed.cast(utc) if parsed.type.tz is None else parsed
+
+def detect_datetime_format(values):
+    """
+    Find the datetime format that parses the most values of a sample:
+    ISO 8601 (which also covers fractional seconds and offsets, but only
+    when every value parses), then DATETIME_FORMATS.
+
+    Parameters:
+        values (Array or ChunkedArray): Text values without nulls.
+
+    Returns:
+        str: The format, or None if no format parses at least half of the sample.
+    """
+    best_format, best_count = None, len(values) / 2
+    for datetime_format in ['ISO8601'] + DATETIME_FORMATS:
+        try:
+            count = len(values) - parse_datetimes(values, datetime_format).null_count
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+        if count == len(values):
+            return datetime_format
+        if count > best_count:
+            best_format, best_count = datetime_format, count
+    return best_format
+
+def detect_datetime_format_failed(values, datetime_format):
+    try:
+        return parse_datetimes(values, datetime_format).null_count > len(values) / 2
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return True
+
+def parse_unique_values(series, parse):
+    """
+    Parse each distinct value of a column once and broadcast the results
+    back to the rows by their factorized codes. CLIF timestamps and text
+    values repeat heavily, so this parses a small fraction of the rows.
+
+    Parameters:
+        series (Series): Column to parse.
+        parse (function): Parses a Series of distinct values into a Series of the same length.
+
+    Returns:
+        Series: Parsed values, missing where series is missing.
+    """
+    codes, uniques = pd.factorize(series)
+    parsed = parse(pd.Series(uniques))
+    # Numpy results are taken from their ndarray (ints promoted to float for
+    # the missing rows), extension arrays such as datetimes with a time zone as is
+    array = parsed.array if isinstance(parsed.dtype, pd.api.extensions.ExtensionDtype) else parsed.to_numpy()
+    values = pd.api.extensions.take(array, codes, allow_fill=True)
+    return pd.Series(values, index=series.index, name=series.name)
+
+def convert_datetime_column(series, cache_key=None):
+    """
+    Convert a column to datetime64[us, UTC]. Datetime columns are normalized
+    to UTC microseconds in one vectorized step. The distinct values of text
+    columns are parsed once (see parse_unique_values) with Arrow, using a
+    format detected on a sample of them and cached per cache_key; values
+    that do not parse become NaT.
+
+    Parameters:
+        series (Series): Column to convert.
+        cache_key (tuple, optional): Key of the detected format (e.g. (table, column)).
+
+    Returns:
+        Series: datetime64[us, UTC] column.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = series.dt.tz_localize('UTC') if series.dt.tz is None else series.dt.tz_convert('UTC')
+        return series.dt.as_unit('us')
+
+    def parse(uniques):
+        values = pa.array(uniques.to_numpy(dtype=object), from_pandas=True).cast(pa.string())
+        sample = values[:DATETIME_SAMPLE_SIZE]
+        datetime_format = datetime_format_cache.get(cache_key)
+        # Reuse the cached format while it still parses the sample
+        if datetime_format is None or detect_datetime_format_failed(sample, datetime_format):
+            datetime_format = detect_datetime_format(sample)
+            if cache_key is not None and datetime_format is not None:
+                datetime_format_cache[cache_key] = datetime_format
+        try:
+            if datetime_format is None:
+                raise pa.ArrowInvalid("No datetime format parses the sample.")
+            return pd.Series(parse_datetimes(values, datetime_format).to_pandas()).astype('datetime64[us, UTC]')
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # Mixed or unknown formats, let pandas infer each value
+            return pd.to_datetime(uniques, errors='coerce', utc=True, format='mixed').dt.as_unit('us')
+
+    return parse_unique_values(series, parse)
+
+def convert_column(series, expected_dtype, cache_key=None):
+    """
+    Convert a column to its expected dtype, coercing values that do not
+    convert to missing. Numeric columns are cast with Arrow compute kernels,
+    text columns are parsed once per distinct value.
+    """
+    if expected_dtype.startswith('datetime64'):
+        return convert_datetime_column(series, cache_key)
+    if expected_dtype in ('float64', 'int64'):
+        if not (pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype)):
+            series = parse_unique_values(series, lambda uniques: pd.to_numeric(uniques, errors='coerce'))
+            return series if expected_dtype == 'float64' else series.astype(expected_dtype)
+        arrow_type = pa.float64() if expected_dtype == 'float64' else pa.int64()
+        values = pc.cast(pa.array(series, from_pandas=True), arrow_type)
+        return pd.Series(values.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+    return series.astype(expected_dtype)
+
+def extract_numeric_values(series):
+    """
+    Extract the first number of each text value (e.g. '< 0.5' -> 0.5),
+    running the regular expression once per distinct value.
+
+    Parameters:
+        series (Series): Text values (e.g. lab_value).
+
+    Returns:
+        Series: float values, NaN where no number is found.
+    """
+    def parse(uniques):
+        return pd.to_numeric(uniques.astype(str).str.extract(r'(\d+\.?\d*)', expand=False), errors='coerce')
+    return parse_unique_values(series, parse).astype(float)
+
 def validate_and_convert_dtypes(table_name, data):
     """
     Validate and convert data types of columns in the DataFrame 
     based on expected data types.
+    Mismatched columns are converted in parallel across columns, and a new
+    DataFrame is returned: data is not modified and the columns that already
+    match are shared with it.
 
     Parameters:
         table_name (str): Name of the table.
@@ -267,114 +1345,322 @@ def validate_and_convert_dtypes(table_name, data):
     """
     expected_dtypes = expected_data_types[table_name]
     validation_results = []
+    mismatched = []
 
     for column, expected_dtype in expected_dtypes.items():
         if column in data.columns:
             actual_dtype = data[column].dtype
 
-            # Check if the expected type is datetime64
-            if expected_dtype == 'datetime64':
-                # Ensure the column is in a valid datetime format
-                if not pd.api.types.is_datetime64_any_dtype(actual_dtype):
-                    validation_results.append((column, actual_dtype, 'datetime64', 'Mismatch'))
-                    try:
-                        # Attempt to convert to datetime, coerce errors to NaT
-                        data[column] = pd.to_datetime(data[column], errors='coerce')
-                        # validation_results[-1] = (column, actual_dtype, expected_dtype, 'Converted')
-                    except Exception as e:
-                        logger.error(f"Error converting column {column} to datetime: {e}")
-                else:
-                    validation_results.append((column, actual_dtype, 'datetime64', 'Match'))
-
-            # Handle non-datetime expected types
-            elif actual_dtype != expected_dtype:
+            # Dictionary encoded text columns are stored as categoricals
+            if expected_dtype == 'object' and isinstance(actual_dtype, pd.CategoricalDtype):
+                validation_results.append((column, actual_dtype, expected_dtype, 'Match'))
+            # Compare dtype names exactly, e.g. datetime64[us, UTC] does not match datetime64[ns]
+            elif str(actual_dtype) != expected_dtype:
                 validation_results.append((column, actual_dtype, expected_dtype, 'Mismatch'))
-                try:
-                    # Convert to the expected dtype
-                    if expected_dtype == 'float64':
-                        data[column] = pd.to_numeric(data[column], errors='coerce')
-                    elif expected_dtype == 'bool':
-                        data[column] = data[column].astype('bool')
-                    else:
-                        data[column] = data[column].astype(expected_dtype)
-
-                    # validation_results[-1] = (column, actual_dtype, expected_dtype, 'Converted')
-
-                except Exception as e:
-                    logger.error(f"Error converting column {column} to {expected_dtype}: {e}")
+                mismatched.append(column)
             else:
                 validation_results.append((column, actual_dtype, expected_dtype, 'Match'))
         else:
             # Log missing columns
             validation_results.append((column, 'Not Found', expected_dtype, 'Missing'))
 
-    return data, validation_results         
+    def convert(column):
+        try:
+            return column, convert_column(data[column], expected_dtypes[column], (table_name, column))
+        except Exception as e:
+            logger.error(f"Error converting column {column} to {expected_dtypes[column]}: {e}")
+            return column, None
 
+    converted_data = data.copy(deep=False)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(mismatched), os.cpu_count() or 1))) as executor:
+        for column, converted in executor.map(convert, mismatched):
+            if converted is not None:
+                converted_data[column] = converted
 
-def name_category_mapping(data):
+    return converted_data, validation_results
+
+
+def count_pairs(data, var, var_category):
     """
-    
+    Count the (name, category) pairs of two columns on their factorized
+    codes: each pair is packed into one integer and counted in a single
+    bincount, without hashing strings. The pair columns of the result are
+    categoricals over the distinct names and categories, so the strings
+    are only materialized when the mapping is displayed or saved.
+
+    Returns:
+        DataFrame: var, var_category and counts of each pair, most frequent first.
+    """
+    name_codes, names = pd.factorize(data[var])
+    category_codes, categories = pd.factorize(data[var_category])
+    paired = (name_codes >= 0) & (category_codes >= 0)
+    pairs = name_codes[paired].astype(np.int64) * len(categories) + category_codes[paired]
+    if len(names) * len(categories) <= 4 * len(pairs) + (1 << 20):
+        counts = np.bincount(pairs, minlength=len(names) * len(categories))
+        pairs = np.flatnonzero(counts)
+        counts = counts[pairs]
+    else:
+        # Too many possible pairs for a dense count
+        pairs, counts = np.unique(pairs, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    pairs, counts = pairs[order], counts[order]
+    return pd.DataFrame({
+        var: pd.Categorical.from_codes(pairs // len(categories), categories=pd.Index(np.asarray(names, dtype=object))),
+        var_category: pd.Categorical.from_codes(pairs % len(categories), categories=pd.Index(np.asarray(categories, dtype=object))),
+        'counts': counts
+    })
+
+def sketch_pairs(chunks, var, var_category, capacity=DEFAULT_CAPACITY):
+    """
+    Find the most frequent (name, category) pairs of a table given as chunks
+    of rows with a heavy hitter sketch: the pairs of each chunk are counted
+    exactly and merged into a Space-Saving sketch of capacity pairs, so the
+    memory stays bounded whatever the number of distinct pairs.
+
+    Returns:
+        SpaceSavingSketch: Sketch of the pairs, keyed by (name, category).
+    """
+    sketch = SpaceSavingSketch(capacity)
+    for chunk in chunks:
+        pairs = count_pairs(chunk, var, var_category)
+        keys = pd.MultiIndex.from_arrays([pairs[var].astype(object), pairs[var_category].astype(object)], names=[var, var_category])
+        sketch.update(pd.Series(pairs['counts'].to_numpy(), index=keys))
+    return sketch
+
+def name_category_mapping(data, source=None, top_k=None, approximate=False):
     """
+    Count the name to category pairs of every *_name column that has a
+    matching *_category column.
+    In approximate mode only the top_k (default MAPPING_DISPLAY_ROWS) most
+    frequent pairs are found, with a heavy hitter sketch (see sketch_pairs),
+    and a count_error column bounds each count: the true count is between
+    counts - count_error and counts.
+
+    Parameters:
+        data (DataFrame): DataFrame containing the data.
+        source (str, optional): Source file of data to count on out-of-core with DuckDB.
+        top_k (int, optional): Keep only the top_k most frequent pairs of each mapping.
+        approximate (bool): Approximate the counts of the most frequent pairs.
+
+    Returns:
+        list: One DataFrame of pair counts per mapping, most frequent first.
+    """
+    if approximate and top_k is None:
+        top_k = MAPPING_DISPLAY_ROWS
+    mappings = run_duckdb_check(duckdb_qc.name_category_mapping, source, top_k)
+    if mappings is not None:
+        # DuckDB counts the top pairs exactly
+        return [mapping.assign(count_error=0) for mapping in mappings] if approximate else mappings
+
     mappings = []
     vars = [col for col in data.columns if col.endswith('_name')]
 
     for var in vars:
         var_category = var.replace('_name', '_category')
         if var_category in data.columns:
-            frequency = data.groupby([var, var_category]).size().reset_index(name='counts')
-            frequency = frequency.sort_values(by='counts', ascending=False)
-            mappings.append(frequency)
+            if approximate:
+                sketch = sketch_pairs(iter_chunks(data), var, var_category, max(DEFAULT_CAPACITY, 10 * top_k))
+                mappings.append(sketch.top(top_k).reset_index())
+            else:
+                frequency = count_pairs(data, var, var_category)
+                mappings.append(frequency if top_k is None else frequency.head(top_k))
     return mappings
 
+def save_mappings_csv(mappings, path, index=True):
+    """
+    Write name to category mappings to one csv file, as
+    pd.concat(mappings).to_csv would, streaming the rows in chunks instead
+    of building the whole file in memory.
+
+    Parameters:
+        mappings (list): Mapping DataFrames from name_category_mapping.
+        path (str): Path of the csv file.
+        index (bool): Write a row number column.
+    """
+    columns = list(dict.fromkeys(column for mapping in mappings for column in mapping.columns))
+    offset = 0
+    with open(path, 'w', newline='') as file:
+        pd.DataFrame(columns=columns).to_csv(file, index=index)
+        for mapping in mappings:
+            for start in range(0, len(mapping), MAPPING_CSV_CHUNK_SIZE):
+                chunk = mapping.iloc[start:start + MAPPING_CSV_CHUNK_SIZE].reindex(columns=columns)
+                chunk.index = pd.RangeIndex(offset + start, offset + start + len(chunk))
+                chunk.to_csv(file, header=False, index=index)
+            offset += len(mapping)
+
+def save_exact_mappings_in_background(data, path, source=None, mapping=None, index=True):
+    """
+    Count the exact name to category mappings and save them with
+    save_mappings_csv in a background thread, e.g. after displaying
+    approximate mappings. data must not be modified in place meanwhile.
+
+    Parameters:
+        data (DataFrame): DataFrame containing the data.
+        path (str): Path of the csv file.
+        source (str, optional): Source file of data to count on out-of-core with DuckDB.
+        mapping (str, optional): Save only the mapping of this *_name column.
+        index (bool): Write a row number column.
+
+    Returns:
+        Future: Completes once the file is saved.
+    """
+    def save():
+        mappings = name_category_mapping(data, source)
+        if mapping is not None:
+            mappings = [frequency for frequency in mappings if frequency.columns[0] == mapping]
+        save_mappings_csv(mappings, path, index)
+
+    def log_result(future):
+        if future.exception() is not None:
+            logger.error(f"Failed to save exact Name to Category Mappings to {path}: {future.exception()}")
+        else:
+            logger.info(f"Exact Name to Category Mappings saved to {path}")
+
+    future = mapping_export_executor.submit(save)
+    future.add_done_callback(log_result)
+    return future
+
+def build_patient_index(hospitalization):
+    """
+    Build the hospitalization to patient index used to attach patient_id to
+    tables that only carry hospitalization_id.
+
+    Parameters:
+        hospitalization (DataFrame): Hospitalization table.
+
+    Returns:
+        Series: patient_id indexed by unique hospitalization_id.
+    """
+    index = hospitalization[['hospitalization_id', 'patient_id']].drop_duplicates('hospitalization_id')
+    return pd.Series(index['patient_id'].to_numpy(), index=pd.Index(index['hospitalization_id'].to_numpy()))
+
+def get_patient_ids(hospitalization_ids, session):
+    """
+    Look up the patient_id of each hospitalization with the index prebuilt
+    in session['hospitalization_patient_index'], building it from the
+    hospitalization table on first use.
+
+    Returns:
+        ndarray: patient_id per hospitalization, or None if the hospitalization table is not provided.
+    """
+    index = session.get('hospitalization_patient_index')
+    if index is None:
+        if "clif_hospitalization" not in session:
+            return None
+        index = session['hospitalization_patient_index'] = build_patient_index(session["clif_hospitalization"])
+    positions = index.index.get_indexer(hospitalization_ids)
+    patient_ids = index.to_numpy().take(positions) if len(index) else np.full(len(positions), None, dtype=object)
+    # Hospitalizations missing from the index have no patient
+    return np.where(positions >= 0, patient_ids, None)
+
+def dense_ranks(values):
+    """
+    Return the dense rank of each value (0 for the smallest), -1 where missing.
+    Datetime and numeric values are ranked with one argsort of their integer
+    or float keys, other values with a sorted factorize.
+    """
+    values = pd.Series(values)
+    missing = values.isna().to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(values):
+        keys = values.array.asi8
+    elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        keys = values.to_numpy(dtype=float, na_value=np.nan)
+    else:
+        return pd.factorize(values, sort=True)[0]
+    present = np.flatnonzero(~missing)
+    order = present[np.argsort(keys[present])]
+    sorted_keys = keys[order]
+    ranks = np.full(len(values), -1, dtype=np.int64)
+    ranks[order] = np.cumsum(np.r_[False, sorted_keys[1:] != sorted_keys[:-1]]) if len(order) else order
+    return ranks
+
+def find_interval_overlaps(group, start, end):
+    """
+    Find every pair of intervals of the same group that overlap, in
+    O(n log n + k) for n intervals and k overlapping pairs.
+    Intervals are sorted by group and start, and for each interval a binary
+    search finds the later intervals of its group that start before it ends.
+
+    Parameters:
+        group (array-like): Group code of each interval (e.g. factorized patient_id), negative for no group.
+        start (array-like): Start of each interval.
+        end (array-like): End of each interval.
+
+    Returns:
+        ndarray: Positions of the earlier interval of each overlapping pair.
+        ndarray: Positions of the later interval of each overlapping pair.
+    """
+    group = np.asarray(group, dtype=np.int64)
+    n = len(group)
+    # Dense ranks of the start and end times, so that (group, time) packs into one sortable integer
+    ranks = dense_ranks(pd.concat([pd.Series(start), pd.Series(end)], ignore_index=True))
+    start_rank, end_rank = ranks[:n], ranks[n:]
+    valid = np.flatnonzero((group >= 0) & (start_rank >= 0) & (end_rank >= 0))
+    width = np.int64(ranks.max() + 2 if len(ranks) else 1)
+    start_key = group[valid] * width + start_rank[valid]
+    end_key = group[valid] * width + end_rank[valid]
+
+    order = np.argsort(start_key, kind='stable')
+    valid, start_key, end_key = valid[order], start_key[order], end_key[order]
+    # Intervals after i up to (excluding) stop[i] start before interval i ends
+    stop = np.searchsorted(start_key, end_key, side='left')
+    counts = np.maximum(stop - np.arange(len(valid)) - 1, 0)
+    earlier = np.repeat(np.arange(len(valid)), counts)
+    # Offsets 1..counts[i] for each interval i
+    offsets = np.arange(len(earlier)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return valid[earlier], valid[earlier + offsets]
+
 def check_time_overlap(data, session):
+    """
+    Find every pair of ADT bookings of a patient at different locations
+    whose times overlap, including a stay that overlaps several later stays.
+
+    Parameters:
+        data (DataFrame): ADT table.
+        session (dict): Streamlit session state, used for the hospitalization to patient index when data has no patient_id.
+
+    Returns:
+        DataFrame: One row per overlapping pair with the overlap duration, or an
+        error message (str) when patient_id is not available.
+    """
     try:
         # Check if 'patient_id' exists in the data
-        if 'patient_id' not in data.columns:
-            if "clif_hospitalization" not in session:
+        if 'patient_id' in data.columns:
+            patient_ids = data['patient_id']
+        else:
+            patient_ids = get_patient_ids(data['hospitalization_id'], session)
+            if patient_ids is None:
                 error = "patient_id is missing, and the hospitalization table is not provided."
                 return error
-            
-            hospitalization_table = session["clif_hospitalization"]
-            
-            # Join adt_table with hospitalization_table to get patient_id
-            data = data.merge(
-                hospitalization_table[['hospitalization_id', 'patient_id']],
-                on='hospitalization_id',
-                how='left'
-            )
-            
-            # Check if the join was successful
-            if 'patient_id' not in data.columns or data['patient_id'].isnull().all():
+
+            # Check if the lookup was successful
+            if pd.isna(patient_ids).all():
                 error = "Unable to retrieve patient_id after joining with hospitalization_table."
                 return error
-        
-        
-        # Sort by patient_id and in_dttm to make comparisons easier
-        data = data.sort_values(by=['patient_id', 'in_dttm'])
-        
-        overlaps = []
-        
-        # Group by patient_id to compare bookings for each patient
-        for patient_id, group in data.groupby('patient_id'):
-            for i in range(len(group) - 1):
-                # Current and next bookings
-                current = group.iloc[i]
-                next = group.iloc[i + 1]
-
-                # Check if the locations are different and times overlap
-                if (
-                    current['location_name'] != next['location_name'] and
-                    current['out_dttm'] > next['in_dttm']
-                ):
-                    overlaps.append({
-                        'patient_id': patient_id,
-                        'Initial Location': (current['location_name'], current['location_category']),
-                        'Overlapping Location': (next['location_name'], next['location_name']),
-                        'Admission Start': current['in_dttm'],
-                        'Admission End': current['out_dttm'],
-                        'Next Admission Start': next['in_dttm']
-                    })
-        
+
+        first, second = find_interval_overlaps(pd.factorize(patient_ids)[0], data['in_dttm'], data['out_dttm'])
+
+        # Keep the pairs at different locations
+        location_codes = pd.factorize(data['location_name'])[0]
+        different = (location_codes[first] != location_codes[second]) | (location_codes[first] < 0)
+        first, second = first[different], second[different]
+        earlier = data.take(first).reset_index(drop=True)
+        later = data.take(second).reset_index(drop=True)
+
+        overlaps = pd.DataFrame({
+            'patient_id': pd.Series(patient_ids).take(first).reset_index(drop=True),
+            'Initial Location': list(zip(earlier['location_name'], earlier['location_category'])),
+            'Overlapping Location': list(zip(later['location_name'], later['location_category'])),
+            'Admission Start': earlier['in_dttm'],
+            'Admission End': earlier['out_dttm'],
+            'Next Admission Start': later['in_dttm'],
+            'Next Admission End': later['out_dttm'],
+        })
+        if pd.api.types.is_datetime64_any_dtype(earlier['out_dttm']) and pd.api.types.is_datetime64_any_dtype(later['in_dttm']):
+            # The later stay starts inside the earlier one, the overlap ends with whichever stay ends first
+            overlaps['Overlap Duration'] = earlier['out_dttm'].where(earlier['out_dttm'] < later['out_dttm'], later['out_dttm']) - later['in_dttm']
+        # Report patients in sorted order, keeping each patient's bookings in time order
+        overlaps = overlaps.sort_values('patient_id', kind='stable', ignore_index=True, key=lambda ids: ids.astype(object))
         return overlaps
     
     except Exception as e:
@@ -0,0 +1,170 @@
+import os
+import logging
+import pandas as pd
+from logging_config import setup_logging
+from common_cache import get_cache_dir
+from reqd_vars_dtypes import expected_data_types, table_schema_names, get_table_columns
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# QC checks that run as DuckDB SQL over the source Parquet/CSV file, on all
+# cores and spilling to disk. The pages still load the whole table for the
+# preview, dtype validation, outliers and plots, so these checks do not
+# lower the peak memory of a QC.
+
+SQL_TYPES = {
+    'float64': 'DOUBLE',
+    'int64': 'BIGINT',
+    'bool': 'BOOLEAN',
+    'object': 'VARCHAR'
+}
+
+
+def duckdb_available():
+    return duckdb is not None
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def quote_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def connect():
+    """
+    Open a DuckDB connection that uses all cores and spills to the Lighthouse
+    cache directory when a query does not fit in memory. The memory limit can
+    be set with the CLIF_LIGHTHOUSE_DUCKDB_MEMORY environment variable (e.g. '32GB').
+    """
+    con = duckdb.connect()
+    con.execute(f"SET threads TO {os.cpu_count() or 1}")
+    con.execute(f"SET temp_directory = {quote_literal(get_cache_dir('duckdb'))}")
+    con.execute("SET preserve_insertion_order = false")
+    con.execute("SET TimeZone = 'UTC'")
+    memory_limit = os.environ.get("CLIF_LIGHTHOUSE_DUCKDB_MEMORY")
+    if memory_limit:
+        con.execute(f"SET memory_limit = {quote_literal(memory_limit)}")
+    return con
+
+def create_source_view(con, source):
+    """
+    Create a view named clif over a CLIF table file with the table's columns
+    cast to their expected types. Values that do not cast become NULL, as
+    with validate_and_convert_dtypes.
+
+    Parameters:
+        con (DuckDBPyConnection): DuckDB connection.
+        source (str): Path to a Parquet or CSV file named after its table (e.g. clif_labs.parquet).
+
+    Returns:
+        list: Columns of the view.
+    """
+    file_name = os.path.basename(source)
+    table_name = table_schema_names.get(file_name.split('.')[0])
+    if table_name is None:
+        raise ValueError(f"Unknown CLIF table for {file_name}.")
+    if file_name.endswith(".parquet"):
+        relation = f"read_parquet({quote_literal(source)})"
+    elif file_name.endswith(".csv"):
+        relation = f"read_csv({quote_literal(source)}, header = true, all_varchar = true)"
+    else:
+        raise ValueError(f"DuckDB checks support csv and parquet files, not {file_name}.")
+
+    available = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {relation}").fetchall()]
+    expected_dtypes = expected_data_types[table_name]
+    columns = [column for column in get_table_columns(table_name) if column in available]
+    select = []
+    for column in columns:
+        expected_dtype = expected_dtypes.get(column, 'object')
+        sql_type = 'TIMESTAMPTZ' if expected_dtype.startswith('datetime64') else SQL_TYPES[expected_dtype]
+        select.append(f"TRY_CAST({quote_identifier(column)} AS {sql_type}) AS {quote_identifier(column)}")
+    con.execute(f"CREATE OR REPLACE TEMP VIEW clif AS SELECT {', '.join(select)} FROM {relation}")
+    return columns
+
+def count_missing(source):
+    """
+    Count missing values per column.
+
+    Returns:
+        Series: Missing value count per column.
+    """
+    with connect() as con:
+        columns = create_source_view(con, source)
+        select = ", ".join(f"COUNT(*) - COUNT({quote_identifier(column)})" for column in columns)
+        counts = con.execute(f"SELECT {select} FROM clif").fetchone()
+    return pd.Series(counts, index=columns)
+
+def count_duplicates(source):
+    """
+    Count rows that duplicate an earlier row on every column.
+    """
+    with connect() as con:
+        columns = create_source_view(con, source)
+        group_by = ", ".join(quote_identifier(column) for column in columns)
+        query = f"SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM clif GROUP BY {group_by})"
+        return int(con.execute(query).fetchone()[0])
+
+def generate_summary_stats(source, category_column, value_column, approximate=False):
+    """
+    Generate summary statistics of a value column by category.
+    Same output as common_qc.generate_summary_stats. In approximate mode the
+    quartiles use DuckDB's APPROX_QUANTILE (a t-digest) instead of sorting.
+
+    Returns:
+        DataFrame: Summary statistics, or None when the file lacks either
+            column (e.g. lab_value_numeric derived from lab_value), for the
+            pandas fallback.
+    """
+    category, value = quote_identifier(category_column), quote_identifier(value_column)
+    quantile = "APPROX_QUANTILE" if approximate else "QUANTILE_CONT"
+    with connect() as con:
+        columns = create_source_view(con, source)
+        if category_column not in columns or value_column not in columns:
+            logger.info(f"{source} lacks {category_column} or {value_column}, summarizing in pandas.")
+            return None
+        query = f"""
+            SELECT {category} AS "Category",
+                COUNT({value}) AS "N",
+                (COUNT(*) - COUNT({value})) * 100.0 / (SELECT COUNT(*) FROM clif) AS "Missing (%)",
+                MIN({value}) AS "Min",
+                AVG({value}) AS "Mean",
+                {quantile}({value}, 0.25) AS "Q1",
+                {quantile}({value}, 0.5) AS "Median",
+                {quantile}({value}, 0.75) AS "Q3",
+                MAX({value}) AS "Max"
+            FROM clif
+            WHERE {category} IS NOT NULL
+            GROUP BY {category}
+            ORDER BY {category}
+        """
+        return con.execute(query).df()
+
+def name_category_mapping(source, top_k=None):
+    """
+    Count the name to category pairs of every *_name column that has a
+    matching *_category column. Same output as common_qc.name_category_mapping.
+    """
+    limit = "" if top_k is None else f"LIMIT {int(top_k)}"
+    mappings = []
+    with connect() as con:
+        columns = create_source_view(con, source)
+        for var in [column for column in columns if column.endswith('_name')]:
+            var_category = var.replace('_name', '_category')
+            if var_category in columns:
+                name, category = quote_identifier(var), quote_identifier(var_category)
+                query = f"""
+                    SELECT {name}, {category}, COUNT(*) AS counts
+                    FROM clif
+                    WHERE {name} IS NOT NULL AND {category} IS NOT NULL
+                    GROUP BY {name}, {category}
+                    ORDER BY counts DESC
+                    {limit}
+                """
+                mappings.append(con.execute(query).df())
+    return mappings
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+# Mergeable heavy hitter sketches for approximate frequency tables.
+# A sketch is built per chunk of data (or per file or site) and sketches
+# are merged, so the most frequent keys are found in bounded memory
+# whatever the number of distinct keys.
+
+# Default number of counters of a heavy hitter sketch
+DEFAULT_CAPACITY = 10000
+
+
+class SpaceSavingSketch:
+    """
+    Weighted Space-Saving sketch of the most frequent keys of a stream.
+    At most capacity keys are counted. A key that is not counted may have
+    occurred up to threshold times, so a new key starts from the threshold
+    and records it as its error: the true count of a key is between
+    count - error and count, and every key occurring more than threshold
+    times is counted.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+        self.errors = pd.Series(dtype=np.int64)
+        self.threshold = 0
+
+    def update(self, counts):
+        """
+        Add exact counts of a chunk of the stream.
+
+        Parameters:
+            counts (Series): Count of each key in the chunk, indexed by key.
+        """
+        chunk = SpaceSavingSketch(self.capacity)
+        chunk.counts = counts.astype(np.int64)
+        chunk.errors = pd.Series(0, index=counts.index, dtype=np.int64)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Merge another sketch (e.g. of another chunk, file or site) into this one.
+        A key missing from one sketch is counted with that sketch's threshold.
+        """
+        if len(other.counts) == 0:
+            self.threshold += other.threshold
+            return
+        keys = self.counts.index.union(other.counts.index, sort=False) if len(self.counts) else other.counts.index
+        counts = (self.counts.reindex(keys).fillna(self.threshold)
+                  + other.counts.reindex(keys).fillna(other.threshold)).astype(np.int64)
+        errors = (self.errors.reindex(keys).fillna(self.threshold)
+                  + other.errors.reindex(keys).fillna(other.threshold)).astype(np.int64)
+        self.threshold += other.threshold
+        if len(counts) > self.capacity:
+            order = np.argsort(-counts.to_numpy(), kind='stable')
+            # Dropped keys occurred at most as often as the largest dropped count
+            self.threshold = max(self.threshold, int(counts.iloc[order[self.capacity]]))
+            counts, errors = counts.iloc[order[:self.capacity]], errors.iloc[order[:self.capacity]]
+        self.counts, self.errors = counts, errors
+
+    def top(self, n=None):
+        """
+        Return the n most frequent keys (all counted keys by default).
+
+        Returns:
+            DataFrame: counts and error of each key, most frequent first, indexed by key.
+        """
+        order = np.argsort(-self.counts.to_numpy(), kind='stable')[:n]
+        return pd.DataFrame({'counts': self.counts.iloc[order], 'count_error': self.errors.iloc[order]})
@@ -2,9 +2,10 @@ import streamlit as st
 import pandas as pd
 import logging
 import time
-import os 
 from common_qc import check_required_variables
-from common_qc import validate_and_convert_dtypes, name_category_mapping
+from common_qc import MAPPING_DISPLAY_ROWS
+from qc_steps import run_position_qc
+from qc_files import save_table_files
 from logging_config import setup_logging
 from common_features import set_bg_hack_url
 
@@ -49,16 +50,10 @@ def show_position_qc():
                 sampling_rate = st.session_state['sampling_option']
                 download_path = st.session_state['download_path'] 
                 
-                if sampling_rate is not None:
-                    original_data = st.session_state[table]
-                    try:
-                        frac = sampling_rate/100
-                        data = original_data.sample(frac = frac)
-                    except Exception as e:
-                        st.write(f":red[Error: {e}]")
-    
-                else:
-                    data = st.session_state[table]
+                # Sampling is applied while the table is read
+                data = st.session_state[table]
+                # Run the QC steps, or reuse those a background QC has run
+                results = run_position_qc(st.session_state, table, progress=lambda percent, text: progress_bar.progress(percent, text=text))
 
                 logger.info("Data loaded successfully.")
 
@@ -67,19 +62,18 @@ def show_position_qc():
             logger.info("~~~ Displaying data ~~~")
             st.write(f"## {TABLE} Data Preview")
             with st.spinner("Loading data preview..."):
-                progress_bar.progress(20, text='Loading data preview...')
                 ttl_smpl = "Total"
                 if sampling_rate is not None:
                     ttl_smpl = "Sample"
-                    total_counts = original_data.shape[0]
+                    total_counts = st.session_state['total_counts'][table]
                     sample_counts = data.shape[0]
                     st.write(f"Total record count before sampling: {total_counts}")
                     st.write(f"Sample({sampling_rate}%) record count: {sample_counts}")
                 else:
                     total_counts = data.shape[0]
                     st.write(f"Total record count: {total_counts}")
-                ttl_unique_encounters = data['hospitalization_id'].nunique()
-                duplicate_count = data.duplicated().sum()
+                ttl_unique_encounters = results['ttl_unique_encounters']
+                duplicate_count = results['duplicate_count']
                 st.write(f"{ttl_smpl} records: {total_counts}")
                 st.write(f"{ttl_smpl} unique hospital encounters: {ttl_unique_encounters}")
                 if duplicate_count > 0:
@@ -95,9 +89,8 @@ def show_position_qc():
             # Validate and convert data types
             st.write("## Data Type Validation")
             with st.spinner("Validating data types..."):
-                progress_bar.progress(30, text='Validating data types...')
                 logger.info("~~~ Validating data types ~~~")
-                data, validation_results = validate_and_convert_dtypes(TABLE, data)
+                data, validation_results = results['validate_and_convert_dtypes']
                 validation_df = pd.DataFrame(validation_results, columns=['Column', 'Actual', 'Expected', 'Status'])
                 mismatch_columns = [row[0] for row in validation_results if row[3] == 'Mismatch']
                 if mismatch_columns:
@@ -106,24 +99,13 @@ def show_position_qc():
                 st.write(validation_df)
                 logger.info("Data type validation completed.")
 
-                # Download data type validation results
-                if download_path is not None:
-                    try:
-                        validation_results_csv = validation_df.to_csv(index=True)
-                        file_path = os.path.join(download_path, f"{TABLE}_validation_results.csv")
-                        with open(file_path, 'w') as file:
-                            file.write(validation_results_csv)
-                        logger.info(f"Validation results saved to {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to save validation results to {download_path}/{TABLE}_validation_results.csv: {e}")
       
             
             # Display missingness for each column
             st.write(f"## Missingness")
             with st.spinner("Checking for missing values..."):
-                progress_bar.progress(40, text='Checking for missing values...')
                 logger.info("~~~ Checking for missing values ~~~")
-                missing_counts = data.isna().sum()
+                missing_counts = results['missing_counts']
                 missingness_summary = ""  # Store the summary temporarily
                 if missing_counts.any():
                     missing_percentages = (missing_counts / total_counts) * 100
@@ -137,12 +119,6 @@ def show_position_qc():
                     missingness_summary = f"Missing values found in {len(columns_with_missing)} columns:\n"
                     for idx, row in columns_with_missing.iterrows():
                         missingness_summary += f"- {idx}: {row['Missing Count']} records ({row['Missing Percentage']})\n"
-                    if download_path is not None:
-                        # Save missingness information to CSV
-                        missing_info_sorted_csv = missing_info_sorted.reset_index().to_csv(index=True)
-                        with open(os.path.join(download_path, f"{TABLE}_missingness.csv"), 'w') as file:
-                            file.write(missing_info_sorted_csv)
-                        logger.info(f"Missingness information saved to {download_path}/{TABLE}_missingness.csv")             
                 else:
                     st.write("No missing values found in all required columns.")
                     missingness_summary = "No missing values found in any columns."
@@ -153,7 +129,6 @@ def show_position_qc():
             logger.info("~~~ Checking for required columns ~~~")  
             st.write(f"## {TABLE} Required Columns")
             with st.spinner("Checking for required columns..."):
-                progress_bar.progress(60, text='Checking for required columns...')
                 required_cols_check = check_required_variables(TABLE, data)
                 st.write(required_cols_check)
                 qc_summary.append(required_cols_check)
@@ -166,27 +141,29 @@ def show_position_qc():
             logger.info("~~~ Mapping ~~~")
             st.write('## Name to Category Mapping')
             with st.spinner("Displaying Name to Category Mapping..."):
-                progress_bar.progress(90, text='Displaying Name to Category Mapping...')
-                mappings = name_category_mapping(data)
+                approximate_mappings = st.session_state.get('approximate_mappings', False)
+                mappings = results['mappings']
                 n = 1
                 for i, mapping in enumerate(mappings):
                     mapping_name = mapping.columns[0]
                     mapping_cat = mapping.columns[1]
                     st.write(f"{n}. Mapping `{mapping_name}` to `{mapping_cat}`")
-                    st.write(mapping.reset_index().drop("index", axis = 1))
+                    st.write(mapping.head(MAPPING_DISPLAY_ROWS).reset_index().drop("index", axis = 1))
+                    if approximate_mappings:
+                        st.write("Approximate counts of the most frequent pairs: each true count is between `counts - count_error` and `counts`. The saved mapping has the exact counts of all pairs.")
+                    elif len(mapping) > MAPPING_DISPLAY_ROWS:
+                        st.write(f"Showing the {MAPPING_DISPLAY_ROWS} most frequent of {len(mapping)} pairs, the saved mapping has all pairs.")
                     n += 1
                 
-                # Save mappings to CSV
-                if download_path is not None:
-                    try:
-                        mappings_csv = pd.concat(mappings).reset_index().drop("index", axis = 1).to_csv(index=True)
-                        with open(os.path.join(download_path, f"{TABLE}_mappings.csv"), 'w') as file:
-                            file.write(mappings_csv)
-                        logger.info(f"Name to Category Mappings saved to {download_path}/{TABLE}_mappings.csv")
-                    except Exception as e:
-                        logger.error(f"Failed to save Name to Category Mappings to {download_path}/{TABLE}_mappings.csv: {str(e)}")
 
 
+            # Save the page's tables and images to the download path
+            if download_path is not None:
+                try:
+                    save_table_files(st.session_state, results, table, download_path, total_counts)
+                except Exception as e:
+                    logger.error(f"Failed to save {TABLE} QC files to {download_path}: {e}")
+
             qc_summary.append(missingness_summary) 
 
             progress_bar.progress(100, text='Quality check completed. Displaying results...')
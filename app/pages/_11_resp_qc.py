@@ -2,10 +2,10 @@ import streamlit as st
 import pandas as pd
 import logging
 import time
-import os
 from common_qc import check_required_variables
-from common_qc import replace_outliers_with_na_wide
-from common_qc import validate_and_convert_dtypes, name_category_mapping
+from common_qc import MAPPING_DISPLAY_ROWS
+from qc_steps import run_respiratory_support_qc
+from qc_files import save_table_files
 from logging_config import setup_logging
 from common_features import set_bg_hack_url
 
@@ -51,18 +51,10 @@ def show_respiratory_support_qc():
                 sampling_rate = st.session_state['sampling_option']
                 download_path = st.session_state['download_path'] 
                 
-                if sampling_rate is not None:
-                    original_data = st.session_state[table]
-                    try:
-                        frac = sampling_rate/100
-                        data = original_data.sample(frac = frac)
-                    except Exception as e:
-                        st.write(f":red[Error: {e}]")
-    
-                else:
-                    data = st.session_state[table]
-
-                df = data.copy()
+                # Sampling is applied while the table is read
+                data = st.session_state[table]
+                # Run the QC steps, or reuse those a background QC has run
+                results = run_respiratory_support_qc(st.session_state, table, progress=lambda percent, text: progress_bar.progress(percent, text=text))
                 logger.info("Data loaded successfully.")
 
                 
@@ -70,19 +62,18 @@ def show_respiratory_support_qc():
             logger.info("~~~ Displaying data ~~~")
             st.write(f"## Respiratory Support Data Preview")
             with st.spinner("Loading data preview..."):
-                progress_bar.progress(20, text='Loading data preview...')
                 ttl_smpl = "Total"
                 if sampling_rate is not None:
                     ttl_smpl = "Sample"
-                    total_counts = original_data.shape[0]
+                    total_counts = st.session_state['total_counts'][table]
                     sample_counts = data.shape[0]
                     st.write(f"Total record count before sampling: {total_counts}")
                     st.write(f"Sample({sampling_rate}%) record count: {sample_counts}")
                 else:
                     total_counts = data.shape[0]
                     st.write(f"Total record count: {total_counts}")
-                ttl_unique_encounters = data['hospitalization_id'].nunique()
-                duplicate_count = data.duplicated().sum()
+                ttl_unique_encounters = results['ttl_unique_encounters']
+                duplicate_count = results['duplicate_count']
                 st.write(f"{ttl_smpl} records: {total_counts}")
                 st.write(f"{ttl_smpl} unique hospital encounters: {ttl_unique_encounters}")
                 if duplicate_count > 0:
@@ -98,9 +89,8 @@ def show_respiratory_support_qc():
             # Validate and convert data types
             st.write("## Data Type Validation")
             with st.spinner("Validating data types..."):
-                progress_bar.progress(30, text='Validating data types...')
                 logger.info("~~~ Validating data types ~~~")
-                data, validation_results = validate_and_convert_dtypes(TABLE, data)
+                data, validation_results = results['validate_and_convert_dtypes']
                 validation_df = pd.DataFrame(validation_results, columns=['Column', 'Actual', 'Expected', 'Status'])
                 mismatch_columns = [row[0] for row in validation_results if row[3] == 'Mismatch']
                 if mismatch_columns:
@@ -109,25 +99,14 @@ def show_respiratory_support_qc():
                 st.write(validation_df)
                 logger.info("Data type validation completed.")
 
-                # Download data type validation results
-                if download_path is not None:
-                    try:
-                        validation_results_csv = validation_df.to_csv(index=False)
-                        file_path = os.path.join(download_path, f"{TABLE}_validation_results.csv")
-                        with open(file_path, 'w') as file:
-                            file.write(validation_results_csv)
-                        logger.info(f"Validation results saved to {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to save validation results to {download_path}/{TABLE}_validation_results.csv: {e}")
                        
 
 
             # Display missingness for each column
             st.write(f"## Missingness")
             with st.spinner("Checking for missing values..."):
-                progress_bar.progress(40, text='Checking for missing values...')
                 logger.info("~~~ Checking for missing values ~~~")
-                missing_counts = data.isna().sum()
+                missing_counts = results['missing_counts']
                 missingness_summary = ""  # Store the summary temporarily
                 if missing_counts.any():
                     missing_percentages = (missing_counts / total_counts) * 100
@@ -141,12 +120,6 @@ def show_respiratory_support_qc():
                     missingness_summary = f"Missing values found in {len(columns_with_missing)} columns:\n"
                     for idx, row in columns_with_missing.iterrows():
                         missingness_summary += f"- {idx}: {row['Missing Count']} records ({row['Missing Percentage']})\n"
-                    if download_path is not None:
-                        # Save missingness information to CSV
-                        missing_info_sorted_csv = missing_info_sorted.reset_index().to_csv(index=False)
-                        with open(os.path.join(download_path, f"{TABLE}_missingness.csv"), 'w') as file:
-                            file.write(missing_info_sorted_csv)
-                        logger.info(f"Missingness information saved to {download_path}/{TABLE}_missingness.csv")             
                 else:
                     st.write("No missing values found in all required columns.")
                     missingness_summary = "No missing values found in any columns."
@@ -156,14 +129,8 @@ def show_respiratory_support_qc():
             # Display summary statistics
             st.write(f"## Respiratory Support Summary Statistics")
             with st.spinner("Displaying summary statistics..."):  
-                progress_bar.progress(50, text='Displaying summary statistics...')
                 logger.info("~~~ Displaying summary statistics ~~~")  
-                summary = data.describe()
-                summary_csv = summary.reset_index().to_csv(index=False)
-                if download_path is not None:
-                    with open(os.path.join(download_path, f"{TABLE}_summary_statistics.csv"), 'w') as file:
-                        file.write(summary_csv)
-                    logger.info(f"Summary statistics saved to {download_path}/{TABLE}_summary_statistics.csv")
+                summary = results['summary']
                 st.write(summary)
                 logger.info("Displayed summary statistics.")
 
@@ -172,7 +139,6 @@ def show_respiratory_support_qc():
             logger.info("~~~ Checking for required columns ~~~")    
             st.write(f"## Respiratory Support Required Columns")
             with st.spinner("Checking for required columns..."):
-                progress_bar.progress(60, text='Checking for required columns...')
                 required_cols_check = check_required_variables(TABLE, data)
                 st.write(required_cols_check)
                 qc_summary.append(required_cols_check)
@@ -184,9 +150,7 @@ def show_respiratory_support_qc():
             # Check for outliers
             st.write("## Outliers")
             with st.spinner("Checking for outliers..."):
-                resp_outlier_thresholds_filepath = "thresholds/nejm_outlier_thresholds_respiratory_support.csv"
-                resp_outlier_thresholds = pd.read_csv(resp_outlier_thresholds_filepath)
-                data, replaced_count, _, _ = replace_outliers_with_na_wide(data, resp_outlier_thresholds)
+                data, replaced_count, _, _ = results['replace_outliers_with_na_wide']
                 if replaced_count > 0:
                     qc_summary.append("Outliers found in the data.")
                     qc_recommendations.append("Outliers found. Please replace values with NA.")
@@ -195,75 +159,26 @@ def show_respiratory_support_qc():
             st.write("## Device Category Summaries")
             st.write("###### * Without Outliers")
             with st.spinner("Displaying summaries by device category..."):
-                progress_bar.progress(70, text='Displaying summaries by device category...')
                 logger.info("~~~ Displaying summaries by device category ~~~")
                 
                 # Overall Device Category Summary
                 st.write("### Overall Device Category Summary")
-                columns_to_pair = [
-                    'tracheostomy', 'fio2_set', 'lpm_set', 'tidal_volume_set', 'resp_rate_set',
-                    'pressure_control_set', 'pressure_support_set', 'flow_rate_set',
-                    'peak_inspiratory_pressure_set', 'inspiratory_time_set',
-                    'peep_set',
-                    'tidal_volume_obs', 'resp_rate_obs', 'plateau_pressure_obs',
-                    'peak_inspiratory_pressure_obs', 'peep_obs', 'minute_vent_obs',
-                    'mean_airway_pressure_obs'
-                ]
-                long_format = pd.melt(
-                    data,
-                    id_vars=['device_category'],  
-                    value_vars=columns_to_pair,  
-                    var_name='attribute',        
-                    value_name='value'           
-                )
-
-                # Ensure 'value' is numeric
-                long_format['value'] = pd.to_numeric(long_format['value'], errors='coerce')
-
-                overall_category_summary = long_format.groupby(['device_category', 'attribute'])['value'].describe(
-                    percentiles=[.25, .5, .75]
-                ).loc[:, ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']]
-                
-                overall_category_summary = overall_category_summary.reset_index()
+                overall_category_summary = results['overall_category_summary']
                 st.write(overall_category_summary)
 
-                cat_summary_csv = overall_category_summary.to_csv(index=False)
-                if download_path is not None:
-                    with open(os.path.join(download_path, f"{TABLE}_category_summary_stats.csv"), 'w') as file:
-                        file.write(cat_summary_csv)
-                    logger.info(f"Summary statistics saved to {download_path}/{TABLE}_category_summary_stats.csv")
 
                 # Create a histogram data for the overall device category
                 device_counts = data['device_category'].value_counts()
                 device_counts_df = device_counts.reset_index()
                 device_counts_df.columns = ['device_category', 'count']
 
-                # Save the histogram data to CSV if download path is provided
-                if download_path is not None:
-                    histogram_csv = device_counts_df.to_csv(index=False)
-                    with open(os.path.join(download_path, f"{TABLE}_device_category_histogram.csv"), 'w') as file:
-                        file.write(histogram_csv)
-                    logger.info(f"Device category histogram saved to {download_path}/{TABLE}_device_category_histogram.csv")
 
                 logger.info("Displayed category summary statistics.")
                 
                 # Device Category with Mode Category Summary
                 st.write("### Device Category with Mode Category Summary")
-                mode_long_format = pd.melt(
-                    df,
-                    id_vars=['device_category', 'mode_category'],  
-                    value_vars=columns_to_pair,  
-                    var_name='attribute',        
-                    value_name='value'           
-                )
-                mode_category_summary = mode_long_format.groupby(['device_category', 'mode_category', 'attribute'])['value'].describe()
-                mode_category_summary = mode_category_summary.reset_index()
+                mode_category_summary = results['mode_category_summary']
                 st.write(mode_category_summary)
-                mode_summary_csv = mode_category_summary.to_csv(index=False)
-                if download_path is not None:
-                    with open(os.path.join(download_path, f"{TABLE}_mode_summary_stats.csv"), 'w') as file:
-                        file.write(mode_summary_csv)
-                    logger.info(f"Summary statistics saved to {download_path}/{TABLE}_mode_summary_stats.csv")
                 logger.info("Displayed category mode summary statistics.")
         
             
@@ -271,27 +186,28 @@ def show_respiratory_support_qc():
             logger.info("~~~ Mapping ~~~")
             st.write('## Name to Category Mapping')
             with st.spinner("Displaying Name to Category Mapping..."):
-                progress_bar.progress(90, text='Displaying Name to Category Mapping...')
-                mappings = name_category_mapping(data)
+                approximate_mappings = st.session_state.get('approximate_mappings', False)
+                mappings = results['mappings']
                 n = 1
                 for i, mapping in enumerate(mappings):
                     mapping_name = mapping.columns[0]
                     mapping_cat = mapping.columns[1]
                     st.write(f"{n}. Mapping `{mapping_name}` to `{mapping_cat}`")
-                    st.write(mapping.reset_index().drop("index", axis = 1))
+                    st.write(mapping.head(MAPPING_DISPLAY_ROWS).reset_index().drop("index", axis = 1))
+                    if approximate_mappings:
+                        st.write("Approximate counts of the most frequent pairs: each true count is between `counts - count_error` and `counts`. The saved mapping has the exact counts of all pairs.")
+                    elif len(mapping) > MAPPING_DISPLAY_ROWS:
+                        st.write(f"Showing the {MAPPING_DISPLAY_ROWS} most frequent of {len(mapping)} pairs, the saved mapping has all pairs.")
                     n += 1
-                    # Save mappings to CSV
-                    if download_path is not None:
-                        try:
-                            # mapping_csv = mapping.drop("index", axis = 1).to_csv(index=False)
-                            mapping_csv = mapping.reset_index(drop=True).to_csv(index=False)
-                            with open(os.path.join(download_path, f"{TABLE}_{mapping_name}_mapping.csv"), 'w') as file:
-                                file.write(mapping_csv)
-                            logger.info(f"Name to Category Mappings saved to {download_path}/{TABLE}_{mapping_name}_mapping.csv")
-                        except Exception as e:
-                            logger.error(f"Failed to save Name to Category Mappings to {download_path}/{TABLE}_{mapping_name}_mapping.csv: {str(e)}")
 
 
+            # Save the page's tables and images to the download path
+            if download_path is not None:
+                try:
+                    save_table_files(st.session_state, results, table, download_path, total_counts)
+                except Exception as e:
+                    logger.error(f"Failed to save {TABLE} QC files to {download_path}: {e}")
+
             qc_summary.append(missingness_summary)
             
             progress_bar.progress(100, text='Quality check completed. Displaying results...')
@@ -2,10 +2,10 @@ import streamlit as st
 import pandas as pd
 import logging
 import time
-import os
-from common_qc import check_required_variables, check_categories_exist
-from common_qc import replace_outliers_with_na_long, generate_facetgrid_histograms, generate_summary_stats
-from common_qc import validate_and_convert_dtypes, name_category_mapping, read_data
+from common_qc import check_required_variables, read_data
+from common_qc import MAPPING_DISPLAY_ROWS
+from qc_steps import run_vitals_qc
+from qc_files import save_table_files
 from logging_config import setup_logging
 from common_features import set_bg_hack_url
 
@@ -52,38 +52,30 @@ def show_vitals_qc():
                     sampling_rate = st.session_state['sampling_option']
                     download_path = st.session_state['download_path'] 
                     
-                    if sampling_rate is not None:
-                        original_data = st.session_state[table]
-                        try:
-                            frac = sampling_rate/100
-                            data = original_data.sample(frac = frac)
-                        except Exception as e:
-                            st.write(f":red[Error: {e}]")
-        
-                    else:
-                        data = st.session_state[table]
+                    # Sampling is applied while the table is read
+                    data = st.session_state[table]
+                    # Run the QC steps, or reuse those a background QC has run
+                    results = run_vitals_qc(st.session_state, table, progress=lambda percent, text: progress_bar.progress(percent, text=text))
 
-                        df = data.copy()
-                        logger.info("Data loaded successfully.")
+                    logger.info("Data loaded successfully.")
 
 
                 # Display the data
                 st.write(f"## {TABLE} Data Preview")
                 with st.spinner("Loading data preview..."):
-                    progress_bar.progress(20, text='Loading data preview...')
                     logger.info("~~~ Displaying data ~~~")
                     ttl_smpl = "Total"
                     if sampling_rate is not None:
                         ttl_smpl = "Sample"
-                        total_counts = original_data.shape[0]
+                        total_counts = st.session_state['total_counts'][table]
                         sample_counts = data.shape[0]
                         st.write(f"Total record count before sampling: {total_counts}")
                         st.write(f"Sample({sampling_rate}%) record count: {sample_counts}")
                     else:
                         total_counts = data.shape[0]
                         st.write(f"Total record count: {total_counts}")
-                    ttl_unique_encounters = data['hospitalization_id'].nunique()
-                    duplicate_count = data.duplicated().sum()
+                    ttl_unique_encounters = results['ttl_unique_encounters']
+                    duplicate_count = results['duplicate_count']
                     st.write(f"{ttl_smpl} records: {total_counts}")
                     st.write(f"{ttl_smpl} unique hospital encounters: {ttl_unique_encounters}")
                     if duplicate_count > 0:
@@ -99,9 +91,8 @@ def show_vitals_qc():
                 # Validate and convert data types
                 st.write("## Data Type Validation")
                 with st.spinner("Validating data types..."):
-                    progress_bar.progress(30, text='Validating data types...')
                     logger.info("~~~ Validating data types ~~~")
-                    data, validation_results = validate_and_convert_dtypes(TABLE, data)
+                    data, validation_results = results['validate_and_convert_dtypes']
                     validation_df = pd.DataFrame(validation_results, columns=['Column', 'Actual', 'Expected', 'Status'])
                     mismatch_columns = [row[0] for row in validation_results if row[3] == 'Mismatch']
                     if mismatch_columns:
@@ -110,24 +101,13 @@ def show_vitals_qc():
                     st.write(validation_df)
                     logger.info("Data type validation completed.")
 
-                    # Download data type validation results
-                    if download_path is not None:
-                        try:
-                            validation_results_csv = validation_df.to_csv(index=True)
-                            file_path = os.path.join(download_path, f"{TABLE}_validation_results.csv")
-                            with open(file_path, 'w') as file:
-                                file.write(validation_results_csv)
-                            logger.info(f"Validation results saved to {file_path}")
-                        except Exception as e:
-                            logger.error(f"Failed to save validation results to {download_path}/{TABLE}_validation_results.csv: {e}")
                     
 
                 # Display missingness for each column
                 st.write(f"## Missingness")
                 with st.spinner("Checking for missing values..."):
-                    progress_bar.progress(40, text='Checking for missing values...')
                     logger.info("~~~ Checking for missing values ~~~")
-                    missing_counts = data.isna().sum()
+                    missing_counts = results['missing_counts']
                     missingness_summary = ""  # Store the summary temporarily
                     if missing_counts.any():
                         missing_percentages = (missing_counts / total_counts) * 100
@@ -141,12 +121,6 @@ def show_vitals_qc():
                         missingness_summary = f"Missing values found in {len(columns_with_missing)} columns:\n"
                         for idx, row in columns_with_missing.iterrows():
                             missingness_summary += f"- {idx}: {row['Missing Count']} records ({row['Missing Percentage']})\n"
-                        if download_path is not None:
-                            # Save missingness information to CSV
-                            missing_info_sorted_csv = missing_info_sorted.reset_index().to_csv(index=True)
-                            with open(os.path.join(download_path, f"{TABLE}_missingness.csv"), 'w') as file:
-                                file.write(missing_info_sorted_csv)
-                            logger.info(f"Missingness information saved to {download_path}/{TABLE}_missingness.csv")             
                     else:
                         st.write("No missing values found in all required columns.")
                         missingness_summary = "No missing values found in any columns."
@@ -157,7 +131,6 @@ def show_vitals_qc():
                 logger.info("~~~ Checking for required columns ~~~")  
                 st.write(f"## {TABLE} Required Columns")
                 with st.spinner("Checking for required columns..."):
-                    progress_bar.progress(50, text='Checking for required columns...')
                     required_cols_check = check_required_variables(TABLE, data)
                     st.write(required_cols_check)
                     qc_summary.append(required_cols_check)
@@ -169,12 +142,9 @@ def show_vitals_qc():
     
                 # Check for presence of all vital categories
                 logger.info("~~~ Checking for presence of all vital categories ~~~")
-                vitals_outlier_thresholds_filepath = "thresholds/nejm_outlier_thresholds_vitals.csv"
-                vitals_outlier_thresholds = pd.read_csv(vitals_outlier_thresholds_filepath)
                 st.write('## Presence of All Vital Categories')
                 with st.spinner("Checking for presence of all vital categories..."):
-                    progress_bar.progress(60, text='Checking for presence of all vital categories...')
-                    similar_cats, missing_cats = check_categories_exist(data, vitals_outlier_thresholds, 'vital_category')    
+                    similar_cats, missing_cats = results['check_categories_exist']
                     if missing_cats:
                         if similar_cats:
                             qc_summary.append("Some vital categories are missing. Similar categories are present.")
@@ -206,19 +176,13 @@ def show_vitals_qc():
                 logger.info("~~~ Generating vital category summary statistics ~~~")
                 st.write("## Vital Category Summary Statistics")
                 with st.spinner("Generating vital category summary statistics..."):
-                    progress_bar.progress(70, text='Generating vital category summary statistics...')
-                    vitals_summary_stats = generate_summary_stats(data, 'vital_category', 'vital_value')
-                    vitals_summary_csv = vitals_summary_stats.reset_index().to_csv(index=True)
-                    if download_path is not None:
-                        with open(os.path.join(download_path, f"{TABLE}_category_summary_statistics.csv"), 'w') as file:
-                            file.write(vitals_summary_csv)
-                        logger.info(f"Summary statistics saved to {download_path}/{TABLE}_category__summary_stats.csv")
+                    vitals_summary_stats = results['vitals_summary_stats']
                     st.write(vitals_summary_stats)
                     logger.info("Vital category summary statistics displayed.")
 
                 st.write("## Outliers")
                 with st.spinner("Checking for outliers..."):
-                    data, replaced_count, _, _ = replace_outliers_with_na_long(data, vitals_outlier_thresholds, 'vital_category', 'vital_value')
+                    data, replaced_count, _, _ = results['replace_outliers_with_na_long']
                     if replaced_count > 0:
                         st.write(replaced_count, "outliers found in the data.")
                         qc_summary.append("Outliers found in data.")
@@ -230,41 +194,43 @@ def show_vitals_qc():
                 st.write("## Value Distribution* - Vital Categories")
                 st.write("###### * Without Outliers")
                 with st.spinner("Displaying value distribution - vital categories..."):
-                    progress_bar.progress(80, text='Displaying value distribution - vital categories...')
                     logger.info("~~~ Displaying value distribution - vital categories ~~~") 
-                    vitals_plot = generate_facetgrid_histograms(data, 'vital_category', 'vital_value')
-                    if download_path is not None:
-                        vitals_plot.savefig(os.path.join(download_path, f"{TABLE}_vital_category_value_distribution.png"))
-                        logger.info("Vital category value distribution saved to vital_category_value_distribution.png")
-                    st.pyplot(vitals_plot)
-                    logger.info("Value distribution - vital categories displayed.")
+                    # Rendered in the background, the placeholder is filled at the end of the page
+                    vitals_plot = results['vitals_plot']
+                    vitals_plot_placeholder = st.empty()
                 
                 # Name to Category mappings
                 logger.info("~~~ Mapping ~~~")
                 st.write('## Name to Category Mapping')
                 with st.spinner("Displaying Name to Category Mapping..."):
-                    progress_bar.progress(90, text='Displaying Name to Category Mapping...')
-                    mappings = name_category_mapping(data)
+                    approximate_mappings = st.session_state.get('approximate_mappings', False)
+                    mappings = results['mappings']
                     n = 1
                     for i, mapping in enumerate(mappings):
                         mapping_name = mapping.columns[0]
                         mapping_cat = mapping.columns[1]
                         st.write(f"{n}. Mapping `{mapping_name}` to `{mapping_cat}`")
-                        st.write(mapping.reset_index().drop("index", axis = 1))
+                        st.write(mapping.head(MAPPING_DISPLAY_ROWS).reset_index().drop("index", axis = 1))
+                        if approximate_mappings:
+                            st.write("Approximate counts of the most frequent pairs: each true count is between `counts - count_error` and `counts`. The saved mapping has the exact counts of all pairs.")
+                        elif len(mapping) > MAPPING_DISPLAY_ROWS:
+                            st.write(f"Showing the {MAPPING_DISPLAY_ROWS} most frequent of {len(mapping)} pairs, the saved mapping has all pairs.")
                         n += 1
 
-                        # Save each mapping to a separate CSV
-                        if download_path is not None:
-                            try:
-                                mapping_csv = mapping.reset_index().drop("index", axis = 1).to_csv(index=True)
-                                file_name = f"{TABLE}_{mapping_name}_mapping.csv"
-                                with open(os.path.join(download_path, file_name), 'w') as file:
-                                    file.write(mapping_csv)
-                                logger.info(f"Mapping `{mapping_name}` to `{mapping_cat}` saved to {download_path}/{file_name}")
-                            except Exception as e:
-                                logger.error(f"Failed to save mapping `{mapping_name}` to `{mapping_cat}` to {download_path}/{file_name}: {str(e)}")
 
 
+                # Value distribution plot
+                vitals_plot_png = vitals_plot.result()
+                vitals_plot_placeholder.image(vitals_plot_png, use_column_width=True)
+                logger.info("Value distribution - vital categories displayed.")
+
+                # Save the page's tables and images to the download path
+                if download_path is not None:
+                    try:
+                        save_table_files(st.session_state, results, table, download_path, total_counts)
+                    except Exception as e:
+                        logger.error(f"Failed to save {TABLE} QC files to {download_path}: {e}")
+
                 qc_summary.append(missingness_summary)  
 
                 progress_bar.progress(100, text='Quality check completed. Displaying results...')
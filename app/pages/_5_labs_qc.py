@@ -2,10 +2,10 @@ import streamlit as st
 import pandas as pd
 import logging
 import time
-import os
-from common_qc import read_data, check_required_variables, check_categories_exist
-from common_qc import replace_outliers_with_na_long, generate_facetgrid_histograms
-from common_qc import validate_and_convert_dtypes, generate_summary_stats, name_category_mapping
+from common_qc import read_data, check_required_variables
+from common_qc import MAPPING_DISPLAY_ROWS
+from qc_steps import run_labs_qc
+from qc_files import save_table_files
 from logging_config import setup_logging
 from common_features import set_bg_hack_url
 
@@ -51,34 +51,26 @@ def show_labs_qc():
                 sampling_rate = st.session_state['sampling_option']
                 download_path = st.session_state['download_path'] 
                 
-                if sampling_rate is not None:
-                    original_data = st.session_state[table]
-                    try:
-                        frac = sampling_rate/100
-                        data = original_data.sample(frac = frac)
-                    except Exception as e:
-                        st.write(f":red[Error: {e}]")
-    
-                else:
-                    data = st.session_state[table]
+                # Sampling is applied while the table is read
+                data = st.session_state[table]
+                # Run the QC steps, or reuse those a background QC has run
+                results = run_labs_qc(st.session_state, table, progress=lambda percent, text: progress_bar.progress(percent, text=text))
 
                 logger.info("Data loaded successfully.")
-                df = data.copy()
             
 
             # Display the data
             logger.info("~~~ Displaying data ~~~")
             st.write(f"## {TABLE} Data Preview")
             with st.spinner("Loading data preview..."):
-                progress_bar.progress(20, text='Loading data preview...')
                 total_counts = data.shape[0]
                 # ttl_unique_patients = data['patient_id'].nunique()
-                ttl_unique_encounters = data['hospitalization_id'].nunique()
-                duplicate_count = data.duplicated().sum()
+                ttl_unique_encounters = results['ttl_unique_encounters']
+                duplicate_count = results['duplicate_count']
                 ttl_smpl = "Total"
                 if sampling_rate is not None:
                     ttl_smpl = "Sample"
-                    total_counts = original_data.shape[0]
+                    total_counts = st.session_state['total_counts'][table]
                     sample_counts = data.shape[0]
                     st.write(f"Total record count before sampling: {total_counts}")
                     st.write(f"Sample({sampling_rate}%) record count: {sample_counts}")
@@ -100,9 +92,8 @@ def show_labs_qc():
             # Validate and convert data types
             st.write("## Data Type Validation")
             with st.spinner("Validating data types..."):
-                progress_bar.progress(30, text='Validating data types...')
                 logger.info("~~~ Validating data types ~~~")
-                data, validation_results = validate_and_convert_dtypes(TABLE, data)
+                data, validation_results = results['validate_and_convert_dtypes']
                 validation_df = pd.DataFrame(validation_results, columns=['Column', 'Actual', 'Expected', 'Status'])
                 mismatch_columns = [row[0] for row in validation_results if row[3] == 'Mismatch']
                 if mismatch_columns:
@@ -111,25 +102,14 @@ def show_labs_qc():
                 st.write(validation_df)
                 logger.info("Data type validation completed.")
 
-                # Download data type validation results
-                if download_path is not None:
-                    try:
-                        validation_results_csv = validation_df.to_csv(index=True)
-                        file_path = os.path.join(download_path, f"{TABLE}_validation_results.csv")
-                        with open(file_path, 'w') as file:
-                            file.write(validation_results_csv)
-                        logger.info(f"Validation results saved to {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to save validation results to {download_path}/{TABLE}_validation_results.csv: {e}")
                    
 
 
             # Display missingness for each column
             st.write(f"## Missingness")
             with st.spinner("Checking for missing values..."):
-                progress_bar.progress(40, text='Checking for missing values...')
                 logger.info("~~~ Checking for missing values ~~~")
-                missing_counts = data.isna().sum()
+                missing_counts = results['missing_counts']
                 missingness_summary = ""  # Store the summary temporarily
                 if missing_counts.any():
                     missing_percentages = (missing_counts / total_counts) * 100
@@ -143,12 +123,6 @@ def show_labs_qc():
                     missingness_summary = f"Missing values found in {len(columns_with_missing)} columns:\n"
                     for idx, row in columns_with_missing.iterrows():
                         missingness_summary += f"- {idx}: {row['Missing Count']} records ({row['Missing Percentage']})\n"
-                    if download_path is not None:
-                        # Save missingness information to CSV
-                        missing_info_sorted_csv = missing_info_sorted.to_csv(index=True)
-                        with open(os.path.join(download_path, f"{TABLE}_missingness.csv"), 'w') as file:
-                            file.write(missing_info_sorted_csv)
-                        logger.info(f"Missingness information saved to {download_path}/{TABLE}_missingness.csv")             
                 else:
                     st.write("No missing values found in all required columns.")
                     missingness_summary = "No missing values found in any columns."
@@ -158,14 +132,8 @@ def show_labs_qc():
             # Display summary statistics  
             st.write(f"## {TABLE} Summary Statistics")
             with st.spinner("Displaying summary statistics..."):
-                progress_bar.progress(55, text='Displaying summary statistics...')
                 logger.info("~~~ Displaying summary statistics ~~~")  
-                summary = data.describe(include="all")
-                summary_csv = summary.to_csv(index=True)
-                if download_path is not None:
-                    with open(os.path.join(download_path, f"{TABLE}_summary_statistics.csv"), 'w') as file:
-                        file.write(summary_csv)
-                    logger.info(f"Summary statistics saved to {download_path}/{TABLE}_summary_statistics.csv")
+                summary = results['summary']
                 st.write(summary)
                 logger.info("Displayed summary statistics.")
 
@@ -173,7 +141,6 @@ def show_labs_qc():
             # Check for required columns
             st.write(f"## {TABLE} Required Columns")
             with st.spinner("Checking for required columns..."):
-                progress_bar.progress(60, text='Checking for required columns...')
                 logger.info("~~~ Checking for required columns ~~~")    
                 required_cols_check = check_required_variables(TABLE, data)
                 st.write(required_cols_check)
@@ -187,15 +154,13 @@ def show_labs_qc():
             # Additional check for lab_value_numeric
             st.write("## Checking 'lab_value' for Non-Numeric Characters")
             with st.spinner("Checking lab_value for non-numeric characters..."):
-                progress_bar.progress(65, text='Checking for lab_value_numeric...')
                 logger.info("~~~ Checking for lab_value_numeric ~~~")
                 if 'lab_value_numeric' not in data.columns:
-                    if pd.to_numeric(data['lab_value'], errors='coerce').isna().any():
+                    non_numeric = results['non_numeric_lab_value']
+                    if non_numeric:
                         logger.info("Non-numeric characters present in lab_value.")
                         qc_summary.append("Non-numeric characters present in lab_value.")
                         qc_recommendations.append("Recommend extracting numeric values and creating a new column - 'lab_value_numeric'.")
-                        col = data['lab_value'].astype(str)
-                        data['lab_value_numeric'] = pd.to_numeric(col.str.extract('(\d+\.?\d*)', expand=False), errors='coerce')
                         logger.info("Created 'lab_value_numeric' column.")
                         st.write("Non-numeric characters present in lab_value.")
                     else:
@@ -209,11 +174,8 @@ def show_labs_qc():
             # Check for presence of all lab categories
             st.write('## Presence of All Lab Categories')
             with st.spinner("Checking for presence of all lab categories..."):
-                progress_bar.progress(70, text='Checking for presence of all lab categories...')
                 logger.info("~~~ Checking for presence of all lab categories ~~~")  
-                labs_outlier_thresholds_filepath = "thresholds/nejm_outlier_thresholds_labs.csv"
-                labs_outlier_thresholds = pd.read_csv(labs_outlier_thresholds_filepath)
-                similar_cats, missing_cats = check_categories_exist(data, labs_outlier_thresholds, 'lab_category')
+                similar_cats, missing_cats = results['check_categories_exist']
                 if missing_cats:
                     if similar_cats:
                         qc_summary.append("Some lab categories are missing. "
@@ -247,23 +209,16 @@ def show_labs_qc():
             # Lab Category Summary Statistics
             st.write("## Lab Category Summary Statistics")
             with st.spinner("Summarizing lab categories..."):
-                progress_bar.progress(75, text='Summarizing lab categories...')
                 logger.info("~~~ Summarizing lab categories ~~~")  
-                lab_summary_stats = generate_summary_stats(data, 'lab_category', 'lab_value_numeric')
-                lab_summary_stats_csv = lab_summary_stats.to_csv(index=True)
-                if download_path is not None:
-                    with open(os.path.join(download_path, f"{TABLE}_summary_stats.csv"), 'w') as file:
-                        file.write(lab_summary_stats_csv)
-                    logger.info("Lab category summary statistics saved to lab_category_summary_stats.csv")
+                lab_summary_stats = results['lab_summary_stats']
                 st.write(lab_summary_stats)
                 logger.info("Generated lab category summary statistics.")
 
             # Check for outliers
             st.write("## Outliers")
             with st.spinner("Checking for outliers..."):
-                progress_bar.progress(77, text='Checking for outliers...')
                 logger.info("Displaying outlier count...")
-                data, replaced_count, _, outlier_details = replace_outliers_with_na_long(data, labs_outlier_thresholds, 'lab_category', 'lab_value_numeric')
+                data, replaced_count, _, outlier_details = results['replace_outliers_with_na_long']
                 if replaced_count > 0:
                     st.write(replaced_count, "outliers found in the data. <a href='https://github.com/clif-consortium/CLIF/blob/main/outlier-handling/outlier_thresholds_labs.csv' id='labs_thresh'>Acceptable lab category thresholds.</a>", unsafe_allow_html=True)
                     st.write("###### * preference range")
@@ -284,12 +239,6 @@ def show_labs_qc():
                         outliers_df = pd.DataFrame(all_outliers_summary)
                         outliers_df = outliers_df.sort_values(by='Outlier (%)', ascending=False)
                         st.write(outliers_df)
-                        # Save outliers information to CSV
-                        outliers_info_csv = outliers_df.to_csv(index=True)
-                        if download_path is not None:
-                            with open(os.path.join(download_path, f"{TABLE}_outliers.csv"), 'w') as file:
-                                file.write(outliers_info_csv)
-                            logger.info("Outliers information saved to lab_outliers.csv")
                 else:
                     st.write("No outliers found.")
                     qc_summary.append("No outliers found.")
@@ -299,40 +248,43 @@ def show_labs_qc():
             st.write("## Value Distribution - Lab Categories")
             st.write("###### * Without Outliers")
             with st.spinner("Displaying lab category value distribution..."):
-                progress_bar.progress(80, text='Displaying lab category value distribution...')
                 logger.info("~~~ Displaying lab category value distribution ~~~")
-                labs_plot = generate_facetgrid_histograms(data, 'lab_category', 'lab_value_numeric')
-                if download_path is not None:
-                    labs_plot.savefig(os.path.join(download_path, f"{TABLE}_category_value_distribution.png"))
-                    logger.info("Lab category value distribution saved to lab_category_value_distribution.png")
-                st.pyplot(labs_plot)
-                logger.info("Value distribution - lab categories displayed.")
+                # Rendered in the background, the placeholder is filled at the end of the page
+                labs_plot = results['labs_plot']
+                labs_plot_placeholder = st.empty()
         
             # Name to Category mappings
             logger.info("~~~ Mapping ~~~")
             st.write('## Name to Category Mapping')
             with st.spinner("Displaying Name to Category Mapping..."):
-                progress_bar.progress(90, text='Displaying Name to Category Mapping...')
-                mappings = name_category_mapping(data)
+                approximate_mappings = st.session_state.get('approximate_mappings', False)
+                mappings = results['mappings']
                 n = 1 
                 for i, mapping in enumerate(mappings):
                     mapping_name = mapping.columns[0]
                     mapping_cat = mapping.columns[1]
                     st.write(f"{n}. Mapping `{mapping_name}` to `{mapping_cat}`")
-                    st.write(mapping.reset_index().drop("index", axis = 1))
+                    st.write(mapping.head(MAPPING_DISPLAY_ROWS).reset_index().drop("index", axis = 1))
+                    if approximate_mappings:
+                        st.write("Approximate counts of the most frequent pairs: each true count is between `counts - count_error` and `counts`. The saved mapping has the exact counts of all pairs.")
+                    elif len(mapping) > MAPPING_DISPLAY_ROWS:
+                        st.write(f"Showing the {MAPPING_DISPLAY_ROWS} most frequent of {len(mapping)} pairs, the saved mapping has all pairs.")
                     n += 1
                 
-                # Save mappings to CSV
-                if download_path is not None:
-                    try:
-                        mappings_csv = pd.concat(mappings).reset_index().drop("index", axis = 1).to_csv(index=True)
-                        with open(os.path.join(download_path, f"{TABLE}_mappings.csv"), 'w') as file:
-                            file.write(mappings_csv)
-                        logger.info(f"Name to Category Mappings saved to {download_path}/{TABLE}_mappings.csv")
-                    except Exception as e:
-                        logger.error(f"Failed to save Name to Category Mappings to {download_path}/{TABLE}_mappings.csv: {str(e)}")
 
 
+            # Value distribution plot
+            labs_plot_png = labs_plot.result()
+            labs_plot_placeholder.image(labs_plot_png, use_column_width=True)
+            logger.info("Value distribution - lab categories displayed.")
+
+            # Save the page's tables and images to the download path
+            if download_path is not None:
+                try:
+                    save_table_files(st.session_state, results, table, download_path, total_counts)
+                except Exception as e:
+                    logger.error(f"Failed to save {TABLE} QC files to {download_path}: {e}")
+
             qc_summary.append(missingness_summary)  
 
             progress_bar.progress(100, text='Quality check completed. Results displayed below.')
@@ -5,6 +5,7 @@ import time
 import os
 from common_qc import check_required_variables
 from common_qc import validate_and_convert_dtypes, name_category_mapping
+from common_qc import get_qc_source, count_missing, count_duplicates, save_mappings_csv, save_exact_mappings_in_background, MAPPING_DISPLAY_ROWS
 from logging_config import setup_logging
 from common_features import set_bg_hack_url
 
@@ -48,17 +49,10 @@ def show_microbio_qc():
 
                 sampling_rate = st.session_state['sampling_option']
                 download_path = st.session_state['download_path'] 
+                source = get_qc_source(st.session_state, table)
                 
-                if sampling_rate is not None:
-                    original_data = st.session_state[table]
-                    try:
-                        frac = sampling_rate/100
-                        data = original_data.sample(frac = frac)
-                    except Exception as e:
-                        st.write(f":red[Error: {e}]")
-    
-                else:
-                    data = st.session_state[table]
+                # Sampling is applied while the table is read
+                data = st.session_state[table]
 
                 logger.info("Data loaded successfully.")
 
@@ -71,7 +65,7 @@ def show_microbio_qc():
                 ttl_smpl = "Total"
                 if sampling_rate is not None:
                     ttl_smpl = "Sample"
-                    total_counts = original_data.shape[0]
+                    total_counts = st.session_state['total_counts'][table]
                     sample_counts = data.shape[0]
                     st.write(f"Total record count before sampling: {total_counts}")
                     st.write(f"Sample({sampling_rate}%) record count: {sample_counts}")
@@ -79,7 +73,7 @@ def show_microbio_qc():
                     total_counts = data.shape[0]
                     st.write(f"Total record count: {total_counts}")
                 ttl_unique_encounters = data['hospitalization_id'].nunique()
-                duplicate_count = data.duplicated().sum()
+                duplicate_count = count_duplicates(data, source)
                 st.write(f"{ttl_smpl} records: {total_counts}")
                 st.write(f"{ttl_smpl} unique hospital encounters: {ttl_unique_encounters}")
                 if duplicate_count > 0:
@@ -123,7 +117,7 @@ def show_microbio_qc():
             with st.spinner("Checking for missing values..."):
                 progress_bar.progress(40, text='Checking for missing values...')
                 logger.info("~~~ Checking for missing values ~~~")
-                missing_counts = data.isna().sum()
+                missing_counts = count_missing(data, source)
                 missingness_summary = ""  # Store the summary temporarily
                 if missing_counts.any():
                     missing_percentages = (missing_counts / total_counts) * 100
@@ -166,21 +160,27 @@ def show_microbio_qc():
             st.write('## Name to Category Mapping')
             with st.spinner("Displaying Name to Category Mapping..."):
                 progress_bar.progress(90, text='Displaying Name to Category Mapping...')
-                mappings = name_category_mapping(data)
+                approximate_mappings = st.session_state.get('approximate_mappings', False)
+                mappings = name_category_mapping(data, source, approximate=approximate_mappings)
                 if mappings:
                     n = 1
                     for i, mapping in enumerate(mappings):
                         mapping_name = mapping.columns[0]
                         mapping_cat = mapping.columns[1]
                         st.write(f"{n}. Mapping `{mapping_name}` to `{mapping_cat}`")
-                        st.write(mapping.reset_index().drop("index", axis = 1))
+                        st.write(mapping.head(MAPPING_DISPLAY_ROWS).reset_index().drop("index", axis = 1))
+                        if approximate_mappings:
+                            st.write("Approximate counts of the most frequent pairs: each true count is between `counts - count_error` and `counts`. The saved mapping has the exact counts of all pairs.")
+                        elif len(mapping) > MAPPING_DISPLAY_ROWS:
+                            st.write(f"Showing the {MAPPING_DISPLAY_ROWS} most frequent of {len(mapping)} pairs, the saved mapping has all pairs.")
                         n += 1
                     # Save mappings to CSV
                     if download_path is not None:
                         try:
-                            mappings_csv = pd.concat(mappings).reset_index().drop("index", axis = 1).to_csv(index=True)
-                            with open(os.path.join(download_path, f"{TABLE}_mappings.csv"), 'w') as file:
-                                file.write(mappings_csv)
+                            if approximate_mappings:
+                                save_exact_mappings_in_background(data, os.path.join(download_path, f"{TABLE}_mappings.csv"), source)
+                            else:
+                                save_mappings_csv(mappings, os.path.join(download_path, f"{TABLE}_mappings.csv"))
                             logger.info(f"Name to Category Mappings saved to {download_path}/{TABLE}_mappings.csv")
                         except Exception as e:
                             logger.error(f"Failed to save Name to Category Mappings to {download_path}/{TABLE}_mappings.csv: {str(e)}")
@@ -0,0 +1,159 @@
+import io
+import os
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+import seaborn as sns
+from matplotlib.figure import Figure
+from logging_config import setup_logging
+from common_cache import get_cache_dir, get_cache_size_limit, trim_cache
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Plots are rendered to PNG in worker processes, off the Streamlit script
+# thread, and cached on disk by (data fingerprint, plot spec): the spec
+# holds the already aggregated plot data (e.g. histogram bin counts), so
+# a plot of unchanged data is never rendered twice.
+
+# Bump when the look of rendered plots changes
+RENDER_VERSION = 1
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+# Resolution and bounding box of st.pyplot
+PNG_DPI = 200
+
+render_executor = None
+
+
+def get_render_executor():
+    """
+    Return the plot worker pool, started on first use. Workers are spawned
+    rather than forked, as the Streamlit server process runs many threads.
+    """
+    global render_executor
+    if render_executor is None:
+        render_executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return render_executor
+
+def plot_binned_histograms(categories, edges, counts, xlabel, ylabel, col_wrap=3, height=3):
+    """
+    Plot pre-binned histograms (see common_qc.bin_by_category), one facet
+    per category laid out like a seaborn FacetGrid with independent axes.
+    The figure is not registered with pyplot, so it can be built in any thread.
+
+    Returns:
+        Figure: Matplotlib figure containing the histograms.
+    """
+    ncols = max(1, min(col_wrap, len(categories)))
+    nrows = max(1, -(-len(categories) // ncols))
+    fig = Figure(figsize=(height * ncols, height * nrows))
+    axes = fig.subplots(nrows, ncols, squeeze=False).ravel()
+    for ax, category, category_edges, category_counts in zip(axes, categories, edges, counts):
+        if category_counts.any():
+            ax.bar(category_edges[:-1], category_counts, width=np.diff(category_edges), align='edge', color='dodgerblue', edgecolor='black')
+        ax.set_title(category)
+    for i, ax in enumerate(axes):
+        if i >= len(categories):
+            ax.set_visible(False)
+        # Axis labels on the outer facets only
+        elif i + ncols >= len(categories):
+            ax.set_xlabel(xlabel)
+        if i % ncols == 0:
+            ax.set_ylabel(ylabel)
+    sns.despine(fig=fig)
+    fig.tight_layout()
+    fig.subplots_adjust(top=0.9, hspace=0.4, wspace=0.4)
+    return fig
+
+# Plots that can be rendered by name in the worker pool
+PLOTS = {
+    'binned_histograms': plot_binned_histograms
+}
+
+def render_png(kind, spec):
+    """
+    Render a plot to PNG bytes. Runs in a worker process.
+    """
+    fig = PLOTS[kind](**spec)
+    image = io.BytesIO()
+    fig.savefig(image, format='png', dpi=PNG_DPI, bbox_inches='tight')
+    return image.getvalue()
+
+def plot_key(kind, spec):
+    """
+    Return the cache key of a plot: a hash of its kind and spec, arrays
+    included by content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((RENDER_VERSION, kind)).encode())
+    for name in sorted(spec):
+        value = spec[name]
+        digest.update(name.encode())
+        if isinstance(value, np.ndarray):
+            digest.update(f"{value.dtype}{value.shape}".encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+def store_png(path, png):
+    """
+    Store a rendered plot in the cache, then evict the least recently used
+    cached files above the size cap shared with the cached tables.
+    """
+    size_limit = get_cache_size_limit()
+    if size_limit <= 0:
+        return
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(png)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to cache plot at {path}: {e}")
+        return
+    trim_cache(size_limit, keep=path)
+
+def store_rendered_png(path, future):
+    if future.exception() is not None:
+        logger.error(f"Failed to render plot {path}: {future.exception()}")
+        return
+    store_png(path, future.result())
+
+def render_plot(kind, in_process=False, **spec):
+    """
+    Render a plot to PNG in the worker pool, or load it from the plot cache.
+
+    Parameters:
+        kind (str): Name of the plot in PLOTS.
+        in_process (bool): Render in the calling process instead, e.g. in a
+            process that is itself a worker.
+        **spec: Arguments of the plot function (picklable, e.g. bin counts rather than raw data).
+
+    Returns:
+        Future: PNG bytes of the plot, for both st.image and download files.
+    """
+    path = os.path.join(get_cache_dir("plots"), f"{plot_key(kind, spec)}.png")
+    try:
+        with open(path, 'rb') as file:
+            png = file.read()
+        # Mark the plot as recently used, so that it is evicted last
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    else:
+        future = Future()
+        future.set_result(png)
+        logger.info(f"Loaded cached plot {path}.")
+        return future
+    if in_process:
+        future = Future()
+        future.set_result(render_png(kind, spec))
+        store_png(path, future.result())
+        return future
+    future = get_render_executor().submit(render_png, kind, spec)
+    future.add_done_callback(lambda done: store_rendered_png(path, done))
+    return future
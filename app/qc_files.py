@@ -0,0 +1,174 @@
+import os
+import logging
+import pandas as pd
+from logging_config import setup_logging
+from common_qc import get_qc_source, run_qc_step, save_mappings_csv, save_exact_mappings_in_background
+from qc_steps import get_data_name
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# The files each table page saves to the download path, written from the
+# results of its QC steps (see qc_steps). The pages and the headless
+# runner (batch_qc) both save them with save_table_files.
+
+# Per table page: name of its files and how it writes them
+TABLE_FILES = {
+    'clif_adt': {'name': "ADT"},
+    'clif_hospitalization': {'name': "Hospitalization"},
+    'clif_labs': {'name': "Labs"},
+    'Medication_admin_continuous': {'name': "Medications Adminstered Continuous"},
+    'clif_patient': {'name': "Patient"},
+    'Patient_Assessments': {'name': "Patient Assessments"},
+    'clif_position': {'name': "Position", 'missingness_reset_index': True},
+    'clif_respiratory_support': {'name': 'Respiratory_Support', 'index': False, 'missingness_reset_index': True, 'mapping_files': True},
+    'clif_vitals': {'name': "Vitals", 'missingness_reset_index': True, 'mapping_files': True}
+}
+
+
+def write_file(download_path, file_name, content):
+    """
+    Write a csv (str) or png (bytes) file to the download path.
+
+    Returns:
+        str: Path of the file.
+    """
+    path = os.path.join(download_path, file_name)
+    with open(path, 'wb' if isinstance(content, bytes) else 'w') as file:
+        file.write(content)
+    logger.info(f"Saved {path}")
+    return path
+
+def save_validation_file(results, table, download_path):
+    options = TABLE_FILES[table]
+    _, validation_results = results['validate_and_convert_dtypes']
+    validation_df = pd.DataFrame(validation_results, columns=['Column', 'Actual', 'Expected', 'Status'])
+    return [write_file(download_path, f"{options['name']}_validation_results.csv", validation_df.to_csv(index=options.get('index', True)))]
+
+def save_missingness_file(results, table, download_path, total_counts):
+    options = TABLE_FILES[table]
+    missing_counts = results['missing_counts']
+    if not missing_counts.any():
+        return []
+    missing_info = pd.DataFrame({
+        'Missing Count': missing_counts,
+        'Missing Percentage': ((missing_counts / total_counts) * 100).map('{:.2f}%'.format)
+    })
+    missing_info_sorted = missing_info.sort_values(by='Missing Count', ascending=False)
+    if options.get('missingness_reset_index', False):
+        missing_info_sorted = missing_info_sorted.reset_index()
+    return [write_file(download_path, f"{options['name']}_missingness.csv", missing_info_sorted.to_csv(index=options.get('index', True)))]
+
+def save_mapping_files(session, results, table, download_path):
+    """
+    Save the name to category mappings, all to one file or one file per
+    mapping. Approximate mappings are not saved: the exact ones are counted
+    and saved in the background instead.
+
+    Returns:
+        list: Paths of the files, those saved in the background included.
+    """
+    options = TABLE_FILES[table]
+    TABLE, index = options['name'], options.get('index', True)
+    mappings = results['mappings']
+    if options.get('mapping_files', False):
+        files = [(f'save_{mapping.columns[0]}_mapping', f"{TABLE}_{mapping.columns[0]}_mapping.csv", [mapping], mapping.columns[0]) for mapping in mappings]
+    else:
+        files = [('save_mappings', f"{TABLE}_mappings.csv", mappings, None)]
+
+    paths = []
+    for step, file_name, file_mappings, mapping_name in files:
+        path = os.path.join(download_path, file_name)
+        if session.get('approximate_mappings', False):
+            data, _ = results['validate_and_convert_dtypes']
+            source = get_qc_source(session, get_data_name(table))
+            run_qc_step(session, table, step, save_exact_mappings_in_background, data, path, source, mapping=mapping_name, index=index)
+        else:
+            save_mappings_csv(file_mappings, path, index=index)
+            logger.info(f"Saved {path}")
+        paths.append(path)
+    return paths
+
+def save_adt_files(results, table, download_path, total_counts):
+    overlaps = results['overlaps']
+    if isinstance(overlaps, str):
+        logger.info(f"ADT overlapping admissions not checked: {overlaps}")
+    elif len(overlaps) > 0:
+        return [write_file(download_path, f"{TABLE_FILES[table]['name']}_overlapping_admissions.csv", overlaps.to_csv(index=True))]
+    return []
+
+def save_labs_files(results, table, download_path, total_counts):
+    TABLE = TABLE_FILES[table]['name']
+    paths = [
+        write_file(download_path, f"{TABLE}_summary_statistics.csv", results['summary'].to_csv(index=True)),
+        write_file(download_path, f"{TABLE}_summary_stats.csv", results['lab_summary_stats'].to_csv(index=True))
+    ]
+    _, replaced_count, _, outlier_details = results['replace_outliers_with_na_long']
+    if replaced_count > 0:
+        all_outliers_summary = []
+        for category, lower, upper, outliers in outlier_details:
+            if any(outliers):
+                all_outliers_summary.append({
+                    "Category": category,
+                    "Range*": f"{lower} - {upper}",
+                    "Outlier (%)": (len(outliers)/total_counts * 100).__round__(2),
+                })
+        if all_outliers_summary:
+            outliers_df = pd.DataFrame(all_outliers_summary).sort_values(by='Outlier (%)', ascending=False)
+            paths.append(write_file(download_path, f"{TABLE}_outliers.csv", outliers_df.to_csv(index=True)))
+    paths.append(write_file(download_path, f"{TABLE}_category_value_distribution.png", results['labs_plot'].result()))
+    return paths
+
+def save_meds_files(results, table, download_path, total_counts):
+    TABLE = TABLE_FILES[table]['name']
+    return [write_file(download_path, f"{TABLE}_category_summary_stats.csv", results['med_summary_stats'].to_csv(index=True))]
+
+def save_respiratory_support_files(results, table, download_path, total_counts):
+    TABLE = TABLE_FILES[table]['name']
+    data, _, _, _ = results['replace_outliers_with_na_wide']
+    device_counts_df = data['device_category'].value_counts().reset_index()
+    device_counts_df.columns = ['device_category', 'count']
+    return [
+        write_file(download_path, f"{TABLE}_summary_statistics.csv", results['summary'].reset_index().to_csv(index=False)),
+        write_file(download_path, f"{TABLE}_category_summary_stats.csv", results['overall_category_summary'].to_csv(index=False)),
+        write_file(download_path, f"{TABLE}_device_category_histogram.csv", device_counts_df.to_csv(index=False)),
+        write_file(download_path, f"{TABLE}_mode_summary_stats.csv", results['mode_category_summary'].to_csv(index=False))
+    ]
+
+def save_vitals_files(results, table, download_path, total_counts):
+    TABLE = TABLE_FILES[table]['name']
+    return [
+        write_file(download_path, f"{TABLE}_category_summary_statistics.csv", results['vitals_summary_stats'].reset_index().to_csv(index=True)),
+        write_file(download_path, f"{TABLE}_vital_category_value_distribution.png", results['vitals_plot'].result())
+    ]
+
+# Files a table page saves besides the common ones
+TABLE_SAVES = {
+    'clif_adt': save_adt_files,
+    'clif_labs': save_labs_files,
+    'Medication_admin_continuous': save_meds_files,
+    'clif_respiratory_support': save_respiratory_support_files,
+    'clif_vitals': save_vitals_files
+}
+
+def save_table_files(session, results, table, download_path, total_counts):
+    """
+    Save the files of a table page from the results of its QC steps.
+
+    Parameters:
+        session (dict): Streamlit session state, or the session of a headless QC.
+        results (dict): Step name -> result, as returned by the table's QC in qc_steps.
+        table (str): Session name of the table's results (see qc_steps.TABLE_QCS).
+        download_path (str): Directory to save the files to.
+        total_counts (int): Row count of the table, before sampling if sampled.
+
+    Returns:
+        list: Paths of the saved files.
+    """
+    paths = save_validation_file(results, table, download_path)
+    paths.extend(save_missingness_file(results, table, download_path, total_counts))
+    paths.extend(save_mapping_files(session, results, table, download_path))
+    if table in TABLE_SAVES:
+        paths.extend(TABLE_SAVES[table](results, table, download_path, total_counts))
+    return paths
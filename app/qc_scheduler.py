@@ -0,0 +1,266 @@
+import os
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from logging_config import setup_logging
+from qc_steps import TABLE_QCS, TABLE_QC_INPUTS, get_data_name
+
+# Initialize logger
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Table QCs run in parallel in worker processes. Tables are handed to the
+# workers as Arrow IPC files in shared memory (/dev/shm), memory mapped
+# rather than pickled. Each worker runs the QC steps of its table page (see
+# qc_steps) and returns the results of every step keyed by (table, step),
+# so the page renders them without recomputing. Table-sized results come
+# back through shared memory too, referencing the unchanged columns of the
+# loaded table rather than copying them.
+
+# Session options the checks depend on
+QC_OPTIONS = ['qc_backend', 'sampling_option', 'sources', 'approximate_stats', 'approximate_mappings']
+
+def get_shared_memory_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+def share_table(data):
+    """
+    Write a table to an uncompressed Arrow IPC file in shared memory, for
+    the other process to memory map with open_shared_table. The index is
+    kept, a RangeIndex as metadata only.
+
+    Returns:
+        str: Path of the file, to remove once it is read.
+    """
+    fd, path = tempfile.mkstemp(prefix="clif_lighthouse_", suffix=".arrow", dir=get_shared_memory_dir())
+    os.close(fd)
+    try:
+        feather.write_feather(pa.Table.from_pandas(data), path, compression='uncompressed')
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def open_shared_table(path):
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas(split_blocks=True)
+
+
+class SharedFrame:
+    """
+    A table-sized DataFrame or Series of a worker's results. Its columns
+    identical to a column of a reference frame (the loaded table, or a
+    frame shared before it) are referenced, the others are written to a
+    shared Arrow file.
+    """
+    def __init__(self, path, columns, index_reference, series_name=None, is_series=False):
+        self.path = path
+        # Column name -> (reference number, column name), or None when in the file
+        self.columns = columns
+        self.index_reference = index_reference
+        self.series_name = series_name
+        self.is_series = is_series
+
+class FutureResult:
+    """
+    The result of a Future of a worker's results (e.g. a rendered plot),
+    as Futures are not picklable.
+    """
+    def __init__(self, value):
+        self.value = value
+
+def find_reference(frame, column, references):
+    values = frame[column]
+    for number, reference in enumerate(references):
+        if (column in reference.columns and reference.index.equals(frame.index)
+                and reference[column].dtype == values.dtype and reference[column].equals(values)):
+            return number
+    return None
+
+def pack_frame(frame, references):
+    """
+    Pack a table-sized DataFrame or Series of a worker's results as a
+    SharedFrame, or return it as is (pickled) when Arrow cannot write it.
+    """
+    is_series = isinstance(frame, pd.Series)
+    data = frame.to_frame(name='value') if is_series else frame
+    if not data.columns.is_unique or not all(isinstance(column, str) for column in data.columns):
+        return frame
+    columns = {}
+    for column in data.columns:
+        number = find_reference(data, column, references)
+        columns[column] = None if number is None else (number, column)
+    referenced = [reference[0] for reference in columns.values() if reference is not None]
+    new_columns = [column for column, reference in columns.items() if reference is None]
+    path = None
+    if new_columns:
+        try:
+            path = share_table(data[new_columns])
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            logger.info(f"Result not shared, pickled instead: {e}")
+            return frame
+    if not is_series:
+        references.append(frame)
+    return SharedFrame(path, columns, referenced[0] if referenced else None, frame.name if is_series else None, is_series)
+
+def pack_result(result, references, rows):
+    if isinstance(result, Future):
+        return FutureResult(result.result())
+    if isinstance(result, (pd.DataFrame, pd.Series)) and len(result) == rows:
+        return pack_frame(result, references)
+    if isinstance(result, tuple):
+        return tuple(pack_result(value, references, rows) for value in result)
+    return result
+
+def unpack_frame(shared, references):
+    data = open_shared_table(shared.path) if shared.path else None
+    if shared.index_reference is not None:
+        index = references[shared.index_reference].index
+    else:
+        index = data.index
+    frame = pd.DataFrame({
+        column: data[column] if reference is None else references[reference[0]][reference[1]]
+        for column, reference in shared.columns.items()
+    }, index=index, copy=False)
+    if shared.is_series:
+        return frame['value'].rename(shared.series_name)
+    references.append(frame)
+    return frame
+
+def unpack_result(result, references):
+    if isinstance(result, FutureResult):
+        future = Future()
+        future.set_result(result.value)
+        return future
+    if isinstance(result, SharedFrame):
+        return unpack_frame(result, references)
+    if isinstance(result, tuple):
+        return tuple(unpack_result(value, references) for value in result)
+    return result
+
+def get_shared_paths(result):
+    if isinstance(result, SharedFrame) and result.path:
+        return [result.path]
+    if isinstance(result, tuple):
+        return [path for value in result for path in get_shared_paths(value)]
+    return []
+
+def unpack_results(results, data):
+    """
+    Rebuild the results of run_table_qc in the session process, referencing
+    the columns of the loaded table, and remove their shared files.
+
+    Parameters:
+        results (dict): Packed results by (table, step).
+        data (DataFrame): The table's loaded data.
+
+    Returns:
+        dict: Results by (table, step).
+    """
+    # Frames are unpacked in the order they were packed, as they reference the earlier ones
+    references = [data]
+    try:
+        return {key: unpack_result(result, references) for key, result in results.items()}
+    finally:
+        for result in results.values():
+            for path in get_shared_paths(result):
+                os.remove(path)
+
+def run_table_qc(table, table_paths, options):
+    """
+    Run the QC of a table in a worker process.
+
+    Parameters:
+        table (str): Session name of the table's results.
+        table_paths (dict): Session name -> shared Arrow file of the table's data and of the tables its QC reads.
+        options (dict): Session options of the checks (QC_OPTIONS).
+
+    Returns:
+        dict: Packed results of every step by (table, step), for unpack_results.
+            On failure, the steps completed so far.
+    """
+    session = dict(options)
+    for name, path in table_paths.items():
+        session[name] = open_shared_table(path)
+    try:
+        TABLE_QCS[table](session, table, in_process=True)
+    except Exception as e:
+        logger.error(f"Background QC of {table} stopped: {e}")
+    data = session[get_data_name(table)]
+    references = [data]
+    packed = {}
+    try:
+        for key, result in session.get('qc_results', {}).items():
+            packed[key] = pack_result(result, references, len(data))
+    except Exception:
+        for result in packed.values():
+            for path in get_shared_paths(result):
+                os.remove(path)
+        raise
+    return packed
+
+def start_table_qcs(session, max_workers=None):
+    """
+    Start the QC of every loaded table in worker processes. Raises OSError
+    when the tables do not fit in shared memory, leaving no shared file behind.
+
+    Parameters:
+        session (dict): Streamlit session state with the loaded tables.
+        max_workers (int, optional): Number of worker processes. Defaults to one per table, up to the CPU count.
+
+    Returns:
+        dict: Session name of each table -> Future of its results by (table, step),
+            for session['qc_futures'] where run_qc_step collects them.
+    """
+    tables = [table for table in TABLE_QCS if get_data_name(table) in session]
+    if not tables:
+        return {}
+    options = {key: session.get(key) for key in QC_OPTIONS}
+    inputs = {table: [get_data_name(table)] + [name for name in TABLE_QC_INPUTS.get(table, []) if name in session] for table in tables}
+
+    # Each shared table is removed once the last QC reading it is done
+    shared_paths = {}
+    readers = {}
+    lock = threading.Lock()
+    try:
+        for table in tables:
+            for name in inputs[table]:
+                if name not in shared_paths:
+                    shared_paths[name] = share_table(session[name])
+                readers[name] = readers.get(name, 0) + 1
+    except Exception:
+        # e.g. /dev/shm is full (64 MB by default in Docker)
+        for path in shared_paths.values():
+            os.remove(path)
+        raise
+
+    def release(names):
+        with lock:
+            for name in names:
+                readers[name] -= 1
+                if readers[name] == 0:
+                    os.remove(shared_paths[name])
+
+    def collect(done, future, names, data):
+        release(names)
+        try:
+            future.set_result(unpack_results(done.result(), data))
+        except Exception as e:
+            future.set_exception(e)
+
+    executor = ProcessPoolExecutor(max_workers=max_workers or min(len(tables), os.cpu_count() or 1),
+                                   mp_context=multiprocessing.get_context('spawn'))
+    futures = {}
+    for table in tables:
+        future = Future()
+        worker = executor.submit(run_table_qc, table, {name: shared_paths[name] for name in inputs[table]}, options)
+        worker.add_done_callback(lambda done, future=future, names=inputs[table], data=session[get_data_name(table)]: collect(done, future, names, data))
+        futures[table] = future
+    # Workers exit once the submitted QCs are done
+    executor.shutdown(wait=False)
+    logger.info(f"Started background QC of {len(tables)} tables.")
+    return futures
@@ -0,0 +1,184 @@
+import pandas as pd
+from common_qc import get_qc_source, run_qc_step, validate_and_convert_dtypes, count_missing, count_duplicates
+from common_qc import generate_summary_stats, describe_columns, describe_by_group, check_categories_exist
+from common_qc import replace_outliers_with_na_long, replace_outliers_with_na_wide, name_category_mapping
+from common_qc import parse_unique_values, extract_numeric_values, render_facetgrid_histograms, check_time_overlap
+
+# The QC steps of each table. The table pages, the background table QCs
+# (qc_scheduler) and the headless runner (batch_qc) all run a table's
+# steps with these functions. Each step is memoized with run_qc_step, so
+# a page reuses the steps a background QC has already computed.
+
+RESP_SUMMARY_COLUMNS = [
+    'tracheostomy', 'fio2_set', 'lpm_set', 'tidal_volume_set', 'resp_rate_set',
+    'pressure_control_set', 'pressure_support_set', 'flow_rate_set',
+    'peak_inspiratory_pressure_set', 'inspiratory_time_set',
+    'peep_set',
+    'tidal_volume_obs', 'resp_rate_obs', 'plateau_pressure_obs',
+    'peak_inspiratory_pressure_obs', 'peep_obs', 'minute_vent_obs',
+    'mean_airway_pressure_obs'
+]
+
+
+def no_progress(percent, text):
+    pass
+
+def get_data_name(table):
+    """
+    Return the session name of a table's loaded data, for pages that key
+    their results differently (see TABLE_DATA).
+    """
+    return TABLE_DATA.get(table, table)
+
+def get_table_results(session, table):
+    """
+    Return the results of a table's QC steps.
+
+    Returns:
+        dict: Step name -> result.
+    """
+    return {step: result for (name, step), result in session.get('qc_results', {}).items() if name == table}
+
+def run_common_steps(session, table, table_name, unique_columns, progress):
+    """
+    Run the checks every table page starts with: unique counts, duplicates,
+    dtype validation and missingness.
+
+    Returns:
+        tuple: (validated data, DuckDB source or None).
+    """
+    data = session[get_data_name(table)]
+    source = get_qc_source(session, get_data_name(table))
+    progress(20, 'Loading data preview...')
+    for column, step in unique_columns:
+        run_qc_step(session, table, step, data[column].nunique)
+    run_qc_step(session, table, 'duplicate_count', count_duplicates, data, source)
+    progress(30, 'Validating data types...')
+    data, _ = run_qc_step(session, table, 'validate_and_convert_dtypes', validate_and_convert_dtypes, table_name, data)
+    progress(40, 'Checking for missing values...')
+    run_qc_step(session, table, 'missing_counts', count_missing, data, source)
+    return data, source
+
+def run_mapping_step(session, table, data, source, progress):
+    progress(90, 'Displaying Name to Category Mapping...')
+    run_qc_step(session, table, 'mappings', name_category_mapping, data, source, approximate=session.get('approximate_mappings', False))
+
+def run_basic_qc(table_name, unique_columns):
+    """
+    Return the QC of a page that only runs the common checks and the mappings.
+    """
+    def run(session, table, progress=no_progress, in_process=False):
+        data, source = run_common_steps(session, table, table_name, unique_columns, progress)
+        run_mapping_step(session, table, data, source, progress)
+        return get_table_results(session, table)
+    return run
+
+ENCOUNTERS = ('hospitalization_id', 'ttl_unique_encounters')
+PATIENTS = ('patient_id', 'ttl_unique_patients')
+
+def run_adt_qc(session, table, progress=no_progress, in_process=False):
+    """
+    Run the QC steps of the ADT table.
+
+    Parameters:
+        session (dict): Streamlit session state with the loaded tables and QC options.
+        table (str): Session name of the table's results.
+        progress (callable): Called with (percent, text) before each step.
+        in_process (bool): Render plots in the calling process, e.g. in a worker process.
+
+    Returns:
+        dict: Step name -> result.
+    """
+    data, source = run_common_steps(session, table, "ADT", [ENCOUNTERS], progress)
+    run_mapping_step(session, table, data, source, progress)
+    progress(95, 'Checking for Overlapping Admissions...')
+    run_qc_step(session, table, 'overlaps', check_time_overlap, data, session)
+    return get_table_results(session, table)
+
+def run_labs_qc(session, table, progress=no_progress, in_process=False):
+    data, source = run_common_steps(session, table, "Labs", [ENCOUNTERS], progress)
+    progress(55, 'Displaying summary statistics...')
+    run_qc_step(session, table, 'summary', data.describe, include="all")
+    progress(65, 'Checking for lab_value_numeric...')
+    if 'lab_value_numeric' not in data.columns:
+        non_numeric = run_qc_step(session, table, 'non_numeric_lab_value',
+            lambda: parse_unique_values(data['lab_value'], lambda values: pd.to_numeric(values, errors='coerce')).isna().any())
+        if non_numeric:
+            # Added to a shallow copy, the memoized validated data stays unchanged
+            data = data.copy(deep=False)
+            data['lab_value_numeric'] = run_qc_step(session, table, 'extract_numeric_values', extract_numeric_values, data['lab_value'])
+    progress(70, 'Checking for presence of all lab categories...')
+    labs_outlier_thresholds = pd.read_csv("thresholds/nejm_outlier_thresholds_labs.csv")
+    run_qc_step(session, table, 'check_categories_exist', check_categories_exist, data, labs_outlier_thresholds, 'lab_category')
+    progress(75, 'Summarizing lab categories...')
+    run_qc_step(session, table, 'lab_summary_stats', generate_summary_stats, data, 'lab_category', 'lab_value_numeric', source, session.get('approximate_stats', False))
+    progress(77, 'Checking for outliers...')
+    data, _, _, _ = run_qc_step(session, table, 'replace_outliers_with_na_long', replace_outliers_with_na_long, data, labs_outlier_thresholds, 'lab_category', 'lab_value_numeric')
+    progress(80, 'Displaying lab category value distribution...')
+    # Rendered in the background while the mappings are counted
+    run_qc_step(session, table, 'labs_plot', render_facetgrid_histograms, data, 'lab_category', 'lab_value_numeric', in_process=in_process)
+    run_mapping_step(session, table, data, source, progress)
+    return get_table_results(session, table)
+
+def run_meds_qc(session, table, progress=no_progress, in_process=False):
+    data, source = run_common_steps(session, table, table, [ENCOUNTERS], progress)
+    progress(75, 'Summarizing medication doses by categories...')
+    run_qc_step(session, table, 'med_summary_stats', generate_summary_stats, data, 'med_category', 'med_dose', source, session.get('approximate_stats', False))
+    run_mapping_step(session, table, data, source, progress)
+    return get_table_results(session, table)
+
+def run_respiratory_support_qc(session, table, progress=no_progress, in_process=False):
+    loaded_data = session[table]
+    data, source = run_common_steps(session, table, 'Respiratory_Support', [ENCOUNTERS], progress)
+    progress(50, 'Displaying summary statistics...')
+    run_qc_step(session, table, 'summary', describe_columns, data, session.get('approximate_stats', False))
+    progress(65, 'Checking for outliers...')
+    resp_outlier_thresholds = pd.read_csv("thresholds/nejm_outlier_thresholds_respiratory_support.csv")
+    data, _, _, _ = run_qc_step(session, table, 'replace_outliers_with_na_wide', replace_outliers_with_na_wide, data, resp_outlier_thresholds)
+    progress(70, 'Displaying summaries by device category...')
+    run_qc_step(session, table, 'overall_category_summary', describe_by_group, data, ['device_category'], RESP_SUMMARY_COLUMNS)
+    run_qc_step(session, table, 'mode_category_summary', describe_by_group, loaded_data, ['device_category', 'mode_category'], RESP_SUMMARY_COLUMNS)
+    run_mapping_step(session, table, data, source, progress)
+    return get_table_results(session, table)
+
+def run_vitals_qc(session, table, progress=no_progress, in_process=False):
+    data, source = run_common_steps(session, table, "Vitals", [ENCOUNTERS], progress)
+    progress(60, 'Checking for presence of all vital categories...')
+    vitals_outlier_thresholds = pd.read_csv("thresholds/nejm_outlier_thresholds_vitals.csv")
+    run_qc_step(session, table, 'check_categories_exist', check_categories_exist, data, vitals_outlier_thresholds, 'vital_category')
+    progress(70, 'Generating vital category summary statistics...')
+    run_qc_step(session, table, 'vitals_summary_stats', generate_summary_stats, data, 'vital_category', 'vital_value', source, session.get('approximate_stats', False))
+    progress(75, 'Checking for outliers...')
+    data, _, _, _ = run_qc_step(session, table, 'replace_outliers_with_na_long', replace_outliers_with_na_long, data, vitals_outlier_thresholds, 'vital_category', 'vital_value')
+    progress(80, 'Displaying value distribution - vital categories...')
+    # Rendered in the background while the mappings are counted
+    run_qc_step(session, table, 'vitals_plot', render_facetgrid_histograms, data, 'vital_category', 'vital_value', in_process=in_process)
+    run_mapping_step(session, table, data, source, progress)
+    return get_table_results(session, table)
+
+run_hosp_qc = run_basic_qc("Hospitalization", [PATIENTS, ENCOUNTERS])
+run_patient_qc = run_basic_qc("Patient", [PATIENTS])
+run_patient_assess_qc = run_basic_qc('Patient_Assessments', [ENCOUNTERS])
+run_position_qc = run_basic_qc("Position", [ENCOUNTERS])
+
+# Session name of each table page's results -> its QC, in the order of the tabs
+TABLE_QCS = {
+    'clif_adt': run_adt_qc,
+    'clif_hospitalization': run_hosp_qc,
+    'clif_labs': run_labs_qc,
+    'Medication_admin_continuous': run_meds_qc,
+    'clif_patient': run_patient_qc,
+    'Patient_Assessments': run_patient_assess_qc,
+    'clif_position': run_position_qc,
+    'clif_respiratory_support': run_respiratory_support_qc,
+    'clif_vitals': run_vitals_qc
+}
+# Session name of the loaded data of pages that key their results differently
+TABLE_DATA = {
+    'Medication_admin_continuous': 'clif_medication_admin_continuous',
+    'Patient_Assessments': 'clif_patient_assessments'
+}
+# Other tables a table's QC reads
+TABLE_QC_INPUTS = {
+    'clif_adt': ['clif_hospitalization']
+}
@@ -0,0 +1,174 @@
+import math
+import numpy as np
+import pandas as pd
+
+# Mergeable quantile sketches for approximate summary statistics.
+# A sketch is built per chunk of data (or per file or site) and sketches
+# are merged, so the statistics never need a whole column in memory.
+
+# Default normalized rank error of the approximate quantiles
+DEFAULT_EPSILON = 0.01
+# KLL capacity decay between levels
+CAPACITY_DECAY = 2 / 3
+
+
+def epsilon_to_k(epsilon):
+    """
+    Return the KLL accuracy parameter k giving a normalized rank error of
+    at most epsilon with 99% confidence (the empirical bound of KLL
+    sketches is epsilon = 2.296 / k^0.9723).
+    """
+    return max(8, math.ceil((2.296 / epsilon) ** (1 / 0.9723)))
+
+class KLLSketch:
+    """
+    KLL quantile sketch of a stream of floats.
+    Values are appended to level 0. A level over its capacity is sorted and
+    every other value, from a random offset, moves up one level with twice
+    the weight, so the sketch keeps O(k log(n / k)) values.
+    """
+
+    def __init__(self, k, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * CAPACITY_DECAY ** depth))
+
+    def update(self, values):
+        """
+        Add an array of values. Missing values are ignored.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.n += other.n
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[level])
+                # An odd value out stays on its level
+                kept = values[:len(values) % 2]
+                promoted = values[len(kept) + self.rng.integers(2)::2]
+                self.levels[level] = kept
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, qs):
+        """
+        Return the approximate quantiles qs (floats in [0, 1]), NaN if the sketch is empty.
+        """
+        qs = np.asarray(qs, dtype=float)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2 ** level) for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, ranks = values[order], np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, qs * ranks[-1], side='left')
+        return values[np.minimum(positions, len(values) - 1)]
+
+class GroupedSummarySketch:
+    """
+    Mergeable summary statistics of a value column by category: exact count,
+    missing, min, mean and max, and approximate quartiles from a KLL sketch
+    per category.
+    """
+
+    def __init__(self, epsilon=DEFAULT_EPSILON):
+        self.k = epsilon_to_k(epsilon)
+        self.total_rows = 0
+        # category -> [rows, count, sum, min, max, sketch]
+        self.groups = {}
+
+    def get_group(self, category):
+        if category not in self.groups:
+            self.groups[category] = [0, 0, 0.0, np.inf, -np.inf, KLLSketch(self.k)]
+        return self.groups[category]
+
+    def update(self, categories, values):
+        """
+        Add a chunk of rows. Rows without a category only count towards the total.
+
+        Parameters:
+            categories (array-like): Category of each row.
+            values (array-like): Value of each row.
+        """
+        codes, uniques = pd.factorize(categories)
+        values = np.asarray(values, dtype=float)
+        self.total_rows += len(codes)
+        # Small integer codes sort with a radix sort
+        order = np.argsort(codes.astype(np.min_scalar_type(-len(uniques))), kind='stable')
+        sizes = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        # Rows without a category (code -1) sort first
+        start = len(codes) - sizes.sum()
+        for category, size in zip(uniques, sizes):
+            group_values = values[order[start:start + size]]
+            start += size
+            group_values = group_values[~np.isnan(group_values)]
+            group = self.get_group(category)
+            group[0] += size
+            if len(group_values):
+                group[1] += len(group_values)
+                group[2] += group_values.sum()
+                group[3] = min(group[3], group_values.min())
+                group[4] = max(group[4], group_values.max())
+                group[5].update(group_values)
+
+    def merge(self, other):
+        """
+        Merge another grouped sketch (e.g. of another chunk, file or site) into this one.
+        """
+        self.total_rows += other.total_rows
+        for category, (rows, count, total, minimum, maximum, sketch) in other.groups.items():
+            group = self.get_group(category)
+            group[0] += rows
+            group[1] += count
+            group[2] += total
+            group[3] = min(group[3], minimum)
+            group[4] = max(group[4], maximum)
+            group[5].merge(sketch)
+
+    def to_frame(self):
+        """
+        Return the statistics with the columns of common_qc.generate_summary_stats.
+        """
+        rows = []
+        for category, (size, count, total, minimum, maximum, sketch) in self.groups.items():
+            q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+            rows.append({
+                'Category': category,
+                'N': count,
+                'Missing (%)': (size - count) / self.total_rows * 100,
+                'Min': minimum if count else np.nan,
+                'Mean': total / count if count else np.nan,
+                'Q1': q1,
+                'Median': median,
+                'Q3': q3,
+                'Max': maximum if count else np.nan
+            })
+        columns = ['Category', 'N', 'Missing (%)', 'Min', 'Mean', 'Q1', 'Median', 'Q3', 'Max']
+        summary_stats = pd.DataFrame(rows, columns=columns)
+        summary_stats['Category'] = summary_stats['Category'].astype(object)
+        return summary_stats.sort_values(by=['Category'], ignore_index=True)
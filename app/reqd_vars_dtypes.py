@@ -200,3 +200,34 @@ required_variables = {
         'patient_id', 'hospitalization_id', 'recorded_dttm', 'position_name', 'position_category'
     ]
 }
+
+
+optional_variables = {
+    'Labs': ['lab_value_numeric']
+}
+
+
+table_schema_names = {
+    'clif_labs': 'Labs',
+    'clif_vitals': 'Vitals',
+    'clif_respiratory_support': 'Respiratory_Support',
+    'clif_medication_admin_continuous': 'Medication_admin_continuous',
+    'clif_adt': 'ADT',
+    'clif_hospitalization': 'Hospitalization',
+    'clif_microbiology_culture': 'Microbiology_Culture',
+    'clif_patient': 'Patient',
+    'clif_patient_assessments': 'Patient_Assessments',
+    'clif_position': 'Position'
+}
+
+
+def get_table_columns(table_name):
+    """
+    Return the columns read for a CLIF table: the typed columns, the required
+    columns and the optional columns, in that order.
+    """
+    columns = list(expected_data_types[table_name])
+    for column in required_variables.get(table_name, []) + optional_variables.get(table_name, []):
+        if column not in columns:
+            columns.append(column)
+    return columns
@@ -0,0 +1,81 @@
+"""
+Benchmark of common_qc.check_time_overlap on synthetic ADT tables.
+
+    cd app
+    python ../benchmarks/bench_check_time_overlap.py 20000 1000000 10000000
+
+The ADT tables have one patient per 5 bookings, string patient ids, UTC
+timestamps and 4 locations. Up to LOOP_MAX_ROWS rows, the row by row loop
+check_time_overlap used before it was vectorized is timed too, and each
+overlap it reports (a booking and the patient's next one) is checked to be
+among the overlaps found now.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+from common_qc import check_time_overlap
+
+LOOP_MAX_ROWS = 20_000
+LOCATIONS = [('icu_a', 'icu'), ('ward_b', 'ward'), ('ed_c', 'ed'), ('or_d', 'procedural')]
+
+
+def make_adt(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    patients = rng.permutation(rows) // 5
+    in_dttm = pd.Timestamp('2024-01-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s')
+    locations = rng.integers(0, len(LOCATIONS), rows)
+    return pd.DataFrame({
+        'hospitalization_id': patients.astype(str),
+        'patient_id': patients.astype(str),
+        'location_name': [LOCATIONS[i][0] for i in locations],
+        'location_category': [LOCATIONS[i][1] for i in locations],
+        'in_dttm': in_dttm,
+        'out_dttm': in_dttm + pd.to_timedelta(rng.integers(3600, 30 * 24 * 3600, rows), unit='s')
+    })
+
+def check_time_overlap_loop(data):
+    """
+    check_time_overlap before it was vectorized, with the 'Overlapping
+    Location' category fixed.
+    """
+    data = data.sort_values(by=['patient_id', 'in_dttm'])
+    overlaps = []
+    for patient_id, group in data.groupby('patient_id'):
+        for i in range(len(group) - 1):
+            current = group.iloc[i]
+            next = group.iloc[i + 1]
+            if current['location_name'] != next['location_name'] and current['out_dttm'] > next['in_dttm']:
+                overlaps.append({
+                    'patient_id': patient_id,
+                    'Initial Location': (current['location_name'], current['location_category']),
+                    'Overlapping Location': (next['location_name'], next['location_category']),
+                    'Admission Start': current['in_dttm'],
+                    'Admission End': current['out_dttm'],
+                    'Next Admission Start': next['in_dttm']
+                })
+    return pd.DataFrame(overlaps)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main(argv):
+    for rows in [int(arg) for arg in argv] or [20_000, 1_000_000]:
+        data = make_adt(rows)
+        overlaps, seconds = timed(check_time_overlap, data, {})
+        line = f"{rows:>12,} rows  {seconds:8.2f} s  {len(overlaps):>10,} overlapping pairs"
+        if rows <= LOOP_MAX_ROWS:
+            expected, loop_seconds = timed(check_time_overlap_loop, data)
+            columns = list(expected.columns)
+            found = expected.merge(overlaps[columns], on=columns, how='left', indicator=True)
+            assert (found['_merge'] == 'both').all(), "an overlap of the loop is missing"
+            line += f"  (loop {loop_seconds:.2f} s, {len(expected):,} overlaps with the next booking, all found)"
+        print(line, flush=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,25 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# The app modules import each other as top-level modules (e.g. from common_qc import ...)
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+
+def make_vitals(rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    categories = rng.choice(['heart_rate', 'sbp', 'dbp', 'temp_c', 'spo2'], rows)
+    values = rng.normal(80, 30, rows).round()
+    # Missing values and outliers, so the missingness and outlier files are written
+    values[rng.random(rows) < 0.05] = np.nan
+    values[:5] = 1000
+    return pd.DataFrame({
+        'hospitalization_id': rng.integers(1, 50, rows).astype(str),
+        'recorded_dttm': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 10**6, rows), unit='s'),
+        'vital_name': [f"{category} ({site})" for category, site in zip(categories, rng.choice(['arm', 'leg'], rows))],
+        'vital_category': categories,
+        'vital_value': values,
+        'meas_site_name': rng.choice(['arm', 'leg', None], rows)
+    })
@@ -0,0 +1,41 @@
+import os
+import pytest
+from conftest import APP_DIR, make_vitals
+from batch_qc import run_batch
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+
+def run_page(data_path, download_path, tab):
+    app = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=300)
+    app.run()
+    next(text for text in app.text_input if "glob pattern" in text.label).input(data_path)
+    next(text for text in app.text_input if "automated downloads" in text.label).input(download_path)
+    app.button[0].click().run()
+    app.radio[0].set_value(tab).run()
+    assert not app.exception
+
+def read_files(path):
+    files = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as file:
+            files[name] = file.read()
+    return files
+
+def test_batch_files_match_page(tmp_path, monkeypatch):
+    # The outlier thresholds are read relative to the app directory
+    monkeypatch.chdir(APP_DIR)
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_DIR", str(tmp_path / "cache"))
+    data_dir, page_dir, batch_dir = tmp_path / "clif", tmp_path / "page", tmp_path / "batch"
+    data_dir.mkdir()
+    page_dir.mkdir()
+    make_vitals().to_parquet(data_dir / "clif_vitals.parquet", index=False)
+
+    run_page(str(data_dir / "*.parquet"), str(page_dir), "Vitals")
+    assert run_batch(str(data_dir), str(batch_dir), max_workers=1) == {}
+
+    page_files, batch_files = read_files(page_dir), read_files(batch_dir)
+    assert sorted(batch_files) == sorted(page_files)
+    assert "Vitals_missingness.csv" in page_files
+    for name, content in page_files.items():
+        assert batch_files[name] == content, name
@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from common_cache import get_cache_dir, load_cached_table, store_cached_table
+from plot_render import store_png
+
+
+def test_concurrent_eviction(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_DIR", str(tmp_path))
+    # Room for a few tables only, so every store evicts
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_SIZE_GB", str(3 * 80_000 / (1 << 30)))
+    data = pd.DataFrame({'value': np.arange(10_000, dtype=float)})
+
+    def store(i):
+        store_cached_table(f"table_{i}", data)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        # Raises if any store fails
+        list(executor.map(store, range(200)))
+    cache_dir = get_cache_dir("tables")
+    assert sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)) <= 8 * 80_000
+
+def test_store_and_load(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_DIR", str(tmp_path))
+    data = pd.DataFrame({'value': [1.0, 2.0], 'name': ['a', 'b']})
+    data.attrs['total_rows'] = 10
+    store_cached_table("key", data)
+    loaded = load_cached_table("key")
+    pd.testing.assert_frame_equal(loaded, data)
+    assert loaded.attrs == {'total_rows': 10}
+
+def test_plots_under_size_cap(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("CLIF_LIGHTHOUSE_CACHE_SIZE_GB", str(3 * 1000 / (1 << 30)))
+    plots_dir = get_cache_dir("plots")
+    for i in range(10):
+        path = os.path.join(plots_dir, f"plot_{i}.png")
+        store_png(path, bytes(1000))
+        # Distinct modification times for the LRU order
+        os.utime(path, (i, i))
+    assert sorted(os.listdir(plots_dir)) == [f"plot_{i}.png" for i in (7, 8, 9)]
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+from common_qc import count_pairs
+
+
+def random_labels(rng, rows, distinct):
+    labels = np.array([f"label_{i}" for i in rng.integers(0, distinct, rows)], dtype=object)
+    labels[rng.random(rows) < 0.1] = None
+    return labels
+
+# Few distinct labels for the dense count, many for the sparse one
+@pytest.mark.parametrize("seed, distinct", [(0, 3), (1, 5), (2, 10), (3, 5000)])
+def test_same_as_groupby_size(seed, distinct):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        rows = int(rng.integers(0, 2000 if distinct > 100 else 50))
+        data = pd.DataFrame({
+            'vital_name': random_labels(rng, rows, distinct),
+            'vital_category': random_labels(rng, rows, distinct)
+        })
+        pairs = count_pairs(data, 'vital_name', 'vital_category')
+        assert (np.diff(pairs['counts']) <= 0).all()
+
+        expected = data.groupby(['vital_name', 'vital_category']).size().rename('counts').reset_index()
+        pairs = pairs.astype({'vital_name': object, 'vital_category': object})
+        pd.testing.assert_frame_equal(
+            pairs.sort_values(['vital_name', 'vital_category']).reset_index(drop=True),
+            expected, check_dtype=False)
@@ -0,0 +1,32 @@
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+from common_qc import generate_summary_stats
+from conftest import make_vitals
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def vitals_file(tmp_path):
+    data = make_vitals()
+    path = tmp_path / "clif_vitals.parquet"
+    data.to_parquet(path, index=False)
+    return data, str(path)
+
+def test_summary_stats_match_pandas(vitals_file):
+    data, source = vitals_file
+    expected = generate_summary_stats(data, 'vital_category', 'vital_value')
+    summary = generate_summary_stats(data, 'vital_category', 'vital_value', source)
+    pd.testing.assert_frame_equal(summary, expected, check_dtype=False)
+
+def test_summary_stats_of_derived_column(vitals_file, caplog):
+    data, source = vitals_file
+    data = data.assign(vital_value_derived=data['vital_value'] * 2)
+    expected = generate_summary_stats(data, 'vital_category', 'vital_value_derived')
+    with caplog.at_level(logging.WARNING):
+        summary = generate_summary_stats(data, 'vital_category', 'vital_value_derived', source)
+    # The file has no such column: summarized in pandas without a failed query
+    assert not [record for record in caplog.records if record.levelno >= logging.WARNING]
+    pd.testing.assert_frame_equal(summary, expected)
@@ -0,0 +1,35 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from common_qc import find_interval_overlaps
+
+
+def all_pairs_overlaps(group, start, end):
+    pairs = set()
+    for i in range(len(group)):
+        for j in range(len(group)):
+            if i == j or group[i] < 0 or group[i] != group[j] or pd.isna(start[i]) or pd.isna(start[j]) or pd.isna(end[i]) or pd.isna(end[j]):
+                continue
+            # i is the earlier interval: it starts first, ties in row order
+            if (start[i], i) < (start[j], j) and start[j] < end[i]:
+                pairs.add((i, j))
+    return pairs
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_as_checking_every_pair(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        n = rng.randint(0, 12)
+        group = [rng.randint(-1, 2) for _ in range(n)]
+        # Few distinct times, so that starts and ends tie
+        start = [rng.randint(0, 10) for _ in range(n)]
+        end = [value + rng.randint(-2, 5) for value in start]
+        start = pd.Series(pd.to_datetime(start, unit='h'))
+        end = pd.Series(pd.to_datetime(end, unit='h'))
+        for i in range(n):
+            if rng.random() < 0.1:
+                (start if rng.random() < 0.5 else end)[i] = pd.NaT
+        earlier, later = find_interval_overlaps(group, start, end)
+        assert len(earlier) == len(set(zip(earlier, later)))
+        assert set(zip(earlier.tolist(), later.tolist())) == all_pairs_overlaps(group, start.tolist(), end.tolist())
@@ -0,0 +1,48 @@
+import random
+import pytest
+from common_qc import match_categories, find_closest_match
+
+ALPHABET = 'abcdefgh'
+
+
+def exhaustive_match(expected, observed, threshold):
+    similar_categories = []
+    missing_categories = []
+    for category in expected:
+        if category in observed:
+            continue
+        closest_match, similarity = find_closest_match(category, list(observed))
+        if similarity >= threshold:
+            similar_categories.append((category, closest_match))
+        else:
+            missing_categories.append(category)
+    return similar_categories, missing_categories
+
+def edit(rng, label):
+    label = list(label)
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(label) + 1)
+        operation = rng.choice(['substitute', 'insert', 'delete'])
+        if operation == 'insert':
+            label.insert(i, rng.choice(ALPHABET))
+        elif i < len(label):
+            if operation == 'substitute':
+                label[i] = rng.choice(ALPHABET)
+            else:
+                del label[i]
+    prefix = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 8)))
+    suffix = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 8)))
+    return prefix + ''.join(label) + suffix
+
+def test_match_with_insertions_inside_the_window():
+    # partial_ratio 90, with inserted characters inside the best window
+    assert match_categories(('ehedfgbbbg',), ('eeccaccehexdfbbbgafgg',)) == ([('ehedfgbbbg', 'eeccaccehexdfbbbgafgg')], [])
+
+@pytest.mark.parametrize("threshold", [80, 90, 95])
+def test_same_as_scoring_every_pair(threshold):
+    rng = random.Random(threshold)
+    for _ in range(500):
+        expected = tuple(''.join(rng.choice(ALPHABET) for _ in range(rng.randint(3, 20))) for _ in range(2))
+        observed = tuple(dict.fromkeys(label for label in (edit(rng, rng.choice(expected)) for _ in range(4)) if label))
+        similar_categories, missing_categories = match_categories(expected, observed, threshold)
+        assert (list(similar_categories), list(missing_categories)) == exhaustive_match(expected, observed, threshold)
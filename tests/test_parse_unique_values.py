@@ -0,0 +1,31 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from common_qc import parse_unique_values, extract_numeric_values, convert_datetime_column
+
+
+@pytest.mark.parametrize("parse, expected", [
+    (lambda values: pd.to_numeric(values, errors='coerce'), [1.5, np.nan, 1.5, np.nan, 7.0]),
+    (lambda values: values.str.len(), [3.0, 1.0, 3.0, np.nan, 1.0]),
+    (lambda values: values.str.upper(), ['1.5', 'X', '1.5', np.nan, '7'])
+])
+def test_parse_unique_values(parse, expected):
+    series = pd.Series(['1.5', 'x', '1.5', None, '7'], index=[5, 6, 7, 8, 9], name='lab_value')
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        parsed = parse_unique_values(series, parse)
+    pd.testing.assert_series_equal(parsed, pd.Series(expected, index=series.index, name='lab_value'), check_dtype=False)
+
+def test_extract_numeric_values_without_warnings():
+    series = pd.Series(['>1.5', 'x', '2', None] * 10)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        values = extract_numeric_values(series)
+    np.testing.assert_allclose(values, [1.5, np.nan, 2.0, np.nan] * 10)
+
+def test_convert_datetime_column_keeps_time_zone():
+    series = pd.Series(['2024-01-01 10:00:00', None, '2024-01-01 10:00:00'])
+    converted = convert_datetime_column(series)
+    assert str(converted.dtype).startswith('datetime64') and converted.dt.tz is not None
+    assert converted.isna().tolist() == [False, True, False]
@@ -0,0 +1,25 @@
+import errno
+import os
+import pytest
+import qc_scheduler
+from conftest import make_vitals
+
+
+def test_shared_tables_removed_when_shared_memory_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(qc_scheduler, 'get_shared_memory_dir', lambda: str(tmp_path))
+    share_table = qc_scheduler.share_table
+    shared = []
+
+    def share_once(data):
+        if shared:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        shared.append(share_table(data))
+        return shared[-1]
+
+    monkeypatch.setattr(qc_scheduler, 'share_table', share_once)
+    data = make_vitals()
+    session = {'clif_vitals': data, 'clif_labs': data}
+    with pytest.raises(OSError):
+        qc_scheduler.start_table_qcs(session)
+    assert len(shared) == 1
+    assert os.listdir(tmp_path) == []
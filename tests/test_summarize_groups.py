@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from common_qc import summarize_groups, describe_by_group
+
+
+def random_values(rng, rows):
+    # Few distinct values, so that quartiles fall on ties, and some missing
+    values = rng.integers(0, 5, rows).astype(float)
+    values[rng.random(rows) < 0.2] = np.nan
+    return values
+
+@pytest.mark.parametrize("seed", range(5))
+def test_summarize_groups_same_as_groupby(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        num_groups = int(rng.integers(1, 6))
+        # Every group has a row, other rows have no group (-1)
+        codes = np.concatenate([np.arange(num_groups), rng.integers(-1, num_groups, int(rng.integers(0, 30)))])
+        rng.shuffle(codes)
+        values = random_values(rng, len(codes))
+        stats = summarize_groups(codes, values.copy(), num_groups, std=True)
+
+        grouped = pd.Series(values[codes >= 0]).groupby(codes[codes >= 0])
+        expected = {
+            'N': grouped.count(),
+            'Missing': grouped.size() - grouped.count(),
+            'Min': grouped.min(),
+            'Mean': grouped.mean(),
+            'Q1': grouped.quantile(0.25),
+            'Median': grouped.quantile(0.5),
+            'Q3': grouped.quantile(0.75),
+            'Max': grouped.max(),
+            'Std': grouped.std()
+        }
+        assert sorted(stats) == sorted(expected)
+        for name, column in expected.items():
+            np.testing.assert_allclose(stats[name], column.to_numpy(dtype=float), err_msg=name)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_describe_by_group_same_as_melt_and_describe(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        rows = int(rng.integers(1, 40))
+        data = pd.DataFrame({
+            'site': rng.choice(['a', 'b', 'c', None], rows),
+            'unit': rng.choice(['x', 'y'], rows),
+            'heart_rate': random_values(rng, rows),
+            'sbp': random_values(rng, rows)
+        })
+        summary = describe_by_group(data, ['site', 'unit'], ['sbp', 'heart_rate'])
+
+        long = data.melt(id_vars=['site', 'unit'], value_vars=['sbp', 'heart_rate'], var_name='attribute')
+        expected = long.groupby(['site', 'unit', 'attribute'])['value'].describe().reset_index()
+        pd.testing.assert_frame_equal(summary, expected, check_dtype=False)